@@ -1,6 +1,10 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Material, Room, TimeBlock, RoomUnavailability, ReservationRules, Reservation, Role, UserProfile
+from .models import Material, Room, TimeBlock, RoomUnavailability, ReservationRules, Reservation, ReservationArchive, Role, UserProfile, WeeklyUtilization, OutboxMessage
+from . import calendario, exportacion
+from .horarios import horario
 
 
 # ========================================
@@ -43,7 +47,12 @@ class RoomAdmin(admin.ModelAdmin):
             'fields': ('is_public', 'is_active'),
             'description': 'Controla la visibilidad y disponibilidad de la sala'
         }),
+        ('Calendario', {
+            'fields': ('calendar_link',),
+            'description': 'Dirección para suscribirse a la agenda de la sala desde un calendario'
+        }),
     )
+    readonly_fields = ['calendar_link']
     
     def visibility_badge(self, obj):
         """Badge visual para visibilidad"""
@@ -67,6 +76,14 @@ class RoomAdmin(admin.ModelAdmin):
         return "Sin materiales"
     materials_list.short_description = "Materiales"
 
+    def calendar_link(self, obj):
+        """URL del feed .ics de la sala"""
+        if not obj.pk:
+            return "Disponible al guardar la sala"
+        url = reverse('reservas:calendario', args=[calendario.token_sala(obj.pk)])
+        return format_html('<a href="{}">{}</a>', url, url)
+    calendar_link.short_description = "Calendario (.ics)"
+
 
 # ========================================
 # ADMIN: TimeBlock
@@ -179,32 +196,19 @@ class RequestedMaterialsInline(admin.TabularInline):
     verbose_name_plural = "Materiales Solicitados"
 
 
-@admin.register(Reservation)
-class ReservationAdmin(admin.ModelAdmin):
-    list_display = ['user', 'room', 'date', 'time_block', 'status_badge', 'materials_requested', 'created_at']
-    list_filter = ['status', 'date', 'room', 'time_block']
-    search_fields = ['user__username', 'user__email', 'room__name']
-    date_hierarchy = 'date'
-    filter_horizontal = ['requested_materials']
-    readonly_fields = ['created_at', 'updated_at']
-    
-    fieldsets = (
-        ('Reserva', {
-            'fields': ('user', 'room', 'date', 'time_block')
-        }),
-        ('Materiales', {
-            'fields': ('requested_materials',),
-            'description': 'Solo se pueden solicitar materiales disponibles en la sala seleccionada'
-        }),
-        ('Estado y Notas', {
-            'fields': ('status', 'notes')
-        }),
-        ('Información del Sistema', {
-            'fields': ('created_at', 'updated_at'),
-            'classes': ('collapse',)
-        }),
-    )
-    
+class ReservationDisplayMixin:
+    """Columnas y acciones comunes a reservas vigentes y archivadas"""
+    actions = ['exportar_csv', 'exportar_ndjson']
+
+    @admin.action(description="Exportar seleccionadas (CSV)")
+    def exportar_csv(self, request, queryset):
+        # En streaming: con "seleccionar todas" puede ser un año completo
+        return exportacion.respuesta([queryset.order_by('date', 'pk')], 'csv', 'reservas')
+
+    @admin.action(description="Exportar seleccionadas (JSON por líneas)")
+    def exportar_ndjson(self, request, queryset):
+        return exportacion.respuesta([queryset.order_by('date', 'pk')], 'ndjson', 'reservas')
+
     def status_badge(self, obj):
         """Badge colorido para el estado"""
         colors = {
@@ -221,6 +225,13 @@ class ReservationAdmin(admin.ModelAdmin):
         )
     status_badge.short_description = "Estado"
     
+    def time_block_display(self, obj):
+        """Bloque desde el horario en memoria (evita un JOIN por fila)"""
+        bloque = horario().bloque(obj.time_block_id)
+        return str(bloque) if bloque else obj.time_block
+    time_block_display.short_description = "Bloque horario"
+    time_block_display.admin_order_field = 'time_block'
+    
     def materials_requested(self, obj):
         """Lista de materiales solicitados"""
         materials = obj.requested_materials.all()
@@ -228,6 +239,34 @@ class ReservationAdmin(admin.ModelAdmin):
             return ", ".join([m.name for m in materials])
         return "Sin materiales"
     materials_requested.short_description = "Materiales"
+
+
+@admin.register(Reservation)
+class ReservationAdmin(ReservationDisplayMixin, admin.ModelAdmin):
+    list_display = ['user', 'room', 'date', 'time_block_display', 'status_badge', 'materials_requested', 'created_at']
+    list_select_related = ['user', 'room']
+    list_filter = ['status', 'date', 'room', 'time_block']
+    search_fields = ['user__username', 'user__email', 'room__name']
+    date_hierarchy = 'date'
+    filter_horizontal = ['requested_materials']
+    readonly_fields = ['created_at', 'updated_at']
+    
+    fieldsets = (
+        ('Reserva', {
+            'fields': ('user', 'room', 'date', 'time_block')
+        }),
+        ('Materiales', {
+            'fields': ('requested_materials',),
+            'description': 'Solo se pueden solicitar materiales disponibles en la sala seleccionada'
+        }),
+        ('Estado y Notas', {
+            'fields': ('status', 'notes')
+        }),
+        ('Información del Sistema', {
+            'fields': ('created_at', 'updated_at'),
+            'classes': ('collapse',)
+        }),
+    )
     
     def get_form(self, request, obj=None, **kwargs):
         """Filtrar materiales disponibles según la sala seleccionada"""
@@ -238,6 +277,71 @@ class ReservationAdmin(admin.ModelAdmin):
         return form
 
 
+@admin.register(ReservationArchive)
+class ReservationArchiveAdmin(ReservationDisplayMixin, admin.ModelAdmin):
+    """Historial archivado: solo lectura, con las mismas columnas y filtros"""
+    list_display = ['id', 'user', 'room', 'date', 'time_block_display', 'status_badge', 'materials_requested', 'archived_at']
+    list_select_related = ['user', 'room']
+    list_filter = ['status', 'date', 'room', 'time_block']
+    search_fields = ['user__username', 'user__email', 'room__name']
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# ========================================
+# ADMIN: WeeklyUtilization (Analítica)
+# ========================================
+@admin.register(WeeklyUtilization)
+class WeeklyUtilizationAdmin(admin.ModelAdmin):
+    """Ocupación semanal por sala: solo lectura, la llena refrescar_analitica"""
+    list_display = ['week', 'room', 'bookings', 'cancelled', 'completed', 'occupied_slots', 'offered_slots', 'occupancy_display']
+    list_select_related = ['room']
+    search_fields = ['room__name']
+    date_hierarchy = 'week'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def occupancy_display(self, obj):
+        return f'{obj.occupancy_ratio():.0%}'
+    occupancy_display.short_description = "Ocupación"
+
+# ========================================
+# ADMIN: OutboxMessage (Notificaciones)
+# ========================================
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    """Bandeja de salida: solo lectura, la vacía enviar_notificaciones"""
+    list_display = ['created_at', 'event', 'recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'event']
+    search_fields = ['recipient', 'subject']
+    readonly_fields = [field.name for field in OutboxMessage._meta.fields]
+    actions = ['reintentar']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Reintentar ahora")
+    def reintentar(self, request, queryset):
+        actualizados = queryset.exclude(status=OutboxMessage.SENT).update(
+            status=OutboxMessage.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, f'{actualizados} notificaciones volverán a enviarse')
+
 # ========================================
 # Personalización del Admin Site
 # ========================================
@@ -273,8 +377,8 @@ class RoleAdmin(admin.ModelAdmin):
             'description': 'Configura qué puede hacer este rol en el sistema'
         }),
         ('Configuración Avanzada', {
-            'fields': ('priority',),
-            'description': 'Mayor número = mayor prioridad',
+            'fields': ('priority', 'requests_per_minute'),
+            'description': 'Mayor número = mayor prioridad (decide empates en el modo oleada)',
             'classes': ('collapse',)
         }),
     )
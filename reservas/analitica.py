@@ -0,0 +1,320 @@
+"""
+Analítica de utilización: reservas, canceladas, completadas y ocupación por
+(sala, bloque, fecha) en UtilizationSummary y por (sala, semana) en
+WeeklyUtilization.
+
+Los tableros leen solo estas tablas con un rango de su índice, nunca las
+reservas, así que responden en milisegundos aunque cubran años.
+
+El refresco es incremental (comando refrescar_analitica):
+
+- Solo se recalculan los bloques (sala, fecha, bloque) de las reservas con
+  updated_at posterior a la marca de SummaryWatermark, más los marcados
+  pending_refresh al borrar una reserva (signals.py). La marca se relee con
+  SOLAPE hacia atrás por las transacciones que confirman tarde; recalcular un
+  bloque dos veces da lo mismo.
+- Cada bloque se recalcula desde Reservation y ReservationArchive, así que
+  archivar no cambia la analítica.
+- Después se rehacen las semanas (sala, lunes) tocadas.
+
+`reconstruir` rehace todo desde cero (primera ejecución o para verificar).
+
+Solo existen filas para los bloques y semanas con al menos una reserva; los
+bloques ofrecidos salen del horario actual (sin descontar los bloqueos).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from .horarios import DIAS, horario
+from .models import (
+    ACTIVE_STATUSES,
+    Reservation,
+    ReservationArchive,
+    SummaryWatermark,
+    UtilizationSummary,
+    WeeklyUtilization,
+)
+
+
+NOMBRE = 'utilizacion'
+SOLAPE = timedelta(minutes=5)
+
+
+def lunes(fecha):
+    return fecha - timedelta(days=fecha.weekday())
+
+
+def bloques_ofrecidos(semana):
+    """Bloques activos del horario en la semana que empieza el lunes `semana`"""
+    horario_actual = horario()
+    return sum(len(horario_actual.del_dia(semana + timedelta(days=dia))) for dia in range(7))
+
+
+def _semanas(desde, hasta):
+    semana = lunes(desde)
+    while semana <= hasta:
+        yield semana
+        semana += timedelta(days=7)
+
+
+# ========================================
+# Cálculo
+# ========================================
+def _contar(filtro, claves=None):
+    """
+    {(sala, fecha, bloque): [reservas, canceladas, completadas, activas]} de
+    reservas y archivadas que cumplen `filtro` (y están en `claves`, si se indica).
+    """
+    totales = defaultdict(lambda: [0, 0, 0, 0])
+    for modelo in (Reservation, ReservationArchive):
+        filas = (
+            modelo.objects.filter(**filtro)
+            .values('room_id', 'date', 'time_block_id', 'status')
+            .annotate(n=Count('id'))
+            .values_list('room_id', 'date', 'time_block_id', 'status', 'n')
+            .order_by()
+        )
+        for sala_id, fecha, bloque_id, estado, n in filas.iterator():
+            clave = (sala_id, fecha, bloque_id)
+            if claves is not None and clave not in claves:
+                continue
+            total = totales[clave]
+            total[0] += n
+            if estado == 'cancelled':
+                total[1] += n
+            elif estado == 'completed':
+                total[2] += n
+            elif estado in ACTIVE_STATUSES:
+                total[3] += n
+    return totales
+
+
+def _resumenes(totales):
+    return [
+        UtilizationSummary(
+            room_id=sala_id,
+            date=fecha,
+            time_block_id=bloque_id,
+            bookings=reservas,
+            cancelled=canceladas,
+            completed=completadas,
+            active=activas,
+            occupied=bool(completadas or activas),
+        )
+        for (sala_id, fecha, bloque_id), (reservas, canceladas, completadas, activas) in totales.items()
+    ]
+
+
+def _semanales(filas):
+    """
+    filas: (sala, fecha, reservas, canceladas, completadas, ocupado) por bloque.
+    Retorna {(sala, lunes): [reservas, canceladas, completadas, ocupados]}.
+    """
+    semanales = defaultdict(lambda: [0, 0, 0, 0])
+    for sala_id, fecha, reservas, canceladas, completadas, ocupado in filas:
+        total = semanales[(sala_id, lunes(fecha))]
+        total[0] += reservas
+        total[1] += canceladas
+        total[2] += completadas
+        total[3] += ocupado
+    return semanales
+
+
+def _filas_semanales(semanales):
+    ofrecidos = {}
+    filas = []
+    for (sala_id, semana), (reservas, canceladas, completadas, ocupados) in semanales.items():
+        if semana not in ofrecidos:
+            ofrecidos[semana] = bloques_ofrecidos(semana)
+        filas.append(WeeklyUtilization(
+            room_id=sala_id,
+            week=semana,
+            bookings=reservas,
+            cancelled=canceladas,
+            completed=completadas,
+            occupied_slots=ocupados,
+            offered_slots=ofrecidos[semana],
+        ))
+    return filas
+
+
+# ========================================
+# Refresco
+# ========================================
+def recalcular(claves, lote=500):
+    """
+    Rehace las filas de los bloques (sala, fecha, bloque) indicados, de a
+    `lote` por transacción. Retorna las semanas (sala, lunes) tocadas.
+    """
+    claves = sorted(claves)
+    semanas = set()
+    for inicio in range(0, len(claves), lote):
+        grupo = set(claves[inicio:inicio + lote])
+        rango = {
+            'date__in': {fecha for _, fecha, _ in grupo},
+            'room_id__in': {sala_id for sala_id, _, _ in grupo},
+        }
+        totales = _contar(rango, grupo)
+
+        with transaction.atomic():
+            existentes = [
+                pk for pk, *clave in UtilizationSummary.objects.filter(**rango)
+                .values_list('pk', 'room_id', 'date', 'time_block_id')
+                if tuple(clave) in grupo
+            ]
+            UtilizationSummary.objects.filter(pk__in=existentes).delete()
+            UtilizationSummary.objects.bulk_create(_resumenes(totales), batch_size=lote)
+
+        semanas.update((sala_id, lunes(fecha)) for sala_id, fecha, _ in grupo)
+    return semanas
+
+
+def recalcular_semanas(semanas):
+    """Rehace las filas (sala, lunes) indicadas desde UtilizationSummary, una consulta por semana"""
+    salas_por_semana = defaultdict(set)
+    for sala_id, semana in semanas:
+        salas_por_semana[semana].add(sala_id)
+
+    for semana, salas in sorted(salas_por_semana.items()):
+        filas = UtilizationSummary.objects.filter(
+            room_id__in=salas,
+            date__gte=semana,
+            date__lt=semana + timedelta(days=7),
+        ).values_list('room_id', 'date', 'bookings', 'cancelled', 'completed', 'occupied')
+
+        with transaction.atomic():
+            WeeklyUtilization.objects.filter(week=semana, room_id__in=salas).delete()
+            WeeklyUtilization.objects.bulk_create(_filas_semanales(_semanales(filas)))
+
+
+def reconstruir(lote=1000):
+    """Rehace ambas tablas desde cero y deja la marca al día. Retorna la cantidad de bloques"""
+    # La marca se toma antes de leer: lo que cambie durante la lectura se
+    # vuelve a ver en el próximo refresco
+    ahora = timezone.now()
+    marca = min(Reservation.objects.aggregate(marca=Max('updated_at'))['marca'] or ahora, ahora)
+    totales = _contar({})
+    resumenes = _resumenes(totales)
+    semanales = _semanales(
+        (r.room_id, r.date, r.bookings, r.cancelled, r.completed, r.occupied) for r in resumenes
+    )
+
+    with transaction.atomic():
+        UtilizationSummary.objects.all().delete()
+        UtilizationSummary.objects.bulk_create(resumenes, batch_size=lote)
+        WeeklyUtilization.objects.all().delete()
+        WeeklyUtilization.objects.bulk_create(_filas_semanales(semanales), batch_size=lote)
+        SummaryWatermark.objects.update_or_create(name=NOMBRE, defaults={'high_water_mark': marca})
+    return len(resumenes)
+
+
+def refrescar(lote=500):
+    """
+    Recalcula los bloques que cambiaron desde la marca (o reconstruye si no
+    hay marca). Retorna la cantidad de bloques recalculados.
+    """
+    marca = SummaryWatermark.objects.filter(name=NOMBRE).first()
+    if marca is None or marca.high_water_mark is None:
+        return reconstruir()
+
+    # La marca nunca pasa de ahora: una reserva con updated_at futuro (datos
+    # importados, reloj desfasado) no debe esconder los cambios siguientes
+    ahora = timezone.now()
+    nueva_marca = marca.high_water_mark
+    claves = set()
+    cambiadas = Reservation.objects.filter(
+        updated_at__gt=marca.high_water_mark - SOLAPE,
+    ).values_list('room_id', 'date', 'time_block_id', 'updated_at')
+    for sala_id, fecha, bloque_id, actualizada in cambiadas.iterator(chunk_size=lote):
+        claves.add((sala_id, fecha, bloque_id))
+        nueva_marca = max(nueva_marca, min(actualizada, ahora))
+    claves.update(
+        UtilizationSummary.objects.filter(pending_refresh=True)
+        .values_list('room_id', 'date', 'time_block_id')
+    )
+
+    recalcular_semanas(recalcular(claves, lote))
+    SummaryWatermark.objects.filter(pk=marca.pk).update(high_water_mark=nueva_marca)
+    return len(claves)
+
+
+# ========================================
+# Tableros
+# ========================================
+def ocupacion_por_sala(desde, hasta):
+    """
+    Por sala, de las semanas entre `desde` y `hasta`: reservas, canceladas,
+    completadas, bloques ocupados y ofrecidos y la ocupación (0 a 1).
+    Una consulta a WeeklyUtilization.
+    """
+    semanas = list(_semanas(desde, hasta))
+    ofrecidos = sum(bloques_ofrecidos(semana) for semana in semanas)
+    filas = (
+        WeeklyUtilization.objects.filter(week__gte=semanas[0], week__lte=semanas[-1])
+        .values('room_id', 'room__name')
+        .annotate(
+            reservas=Sum('bookings'),
+            canceladas=Sum('cancelled'),
+            completadas=Sum('completed'),
+            ocupados=Sum('occupied_slots'),
+        )
+        .order_by('room__name')
+    )
+    return [
+        {**fila, 'ofrecidos': ofrecidos, 'ocupacion': fila['ocupados'] / ofrecidos if ofrecidos else 0}
+        for fila in filas
+    ]
+
+
+def ocupacion_semanal(sala_id, desde, hasta):
+    """Filas WeeklyUtilization de la sala entre `desde` y `hasta` (una por semana con reservas)"""
+    return list(
+        WeeklyUtilization.objects.filter(room_id=sala_id, week__gte=lunes(desde), week__lte=hasta)
+        .order_by('week')
+    )
+
+
+def ocupacion_por_bloque(sala_id, desde, hasta):
+    """
+    Por bloque (y con él, por día de la semana) de la sala entre `desde` y
+    `hasta`: reservas, canceladas, completadas, días ocupados, días ofrecidos y
+    ocupación. Una consulta a UtilizationSummary.
+    """
+    # Días del rango por día de la semana
+    dias_ofrecidos = defaultdict(int)
+    for dias in range((hasta - desde).days + 1):
+        dias_ofrecidos[DIAS[(desde + timedelta(days=dias)).weekday()]] += 1
+
+    horario_actual = horario()
+    filas = (
+        UtilizationSummary.objects.filter(room_id=sala_id, date__gte=desde, date__lte=hasta)
+        .values('time_block_id')
+        .annotate(
+            reservas=Sum('bookings'),
+            canceladas=Sum('cancelled'),
+            completadas=Sum('completed'),
+            ocupados=Count('id', filter=Q(occupied=True)),
+        )
+        .order_by()
+    )
+    resultado = []
+    for fila in filas:
+        bloque = horario_actual.por_id.get(fila['time_block_id'])
+        ofrecidos = dias_ofrecidos[bloque.day_of_week] if bloque else 0
+        resultado.append({
+            **fila,
+            'bloque': bloque,
+            'ofrecidos': ofrecidos,
+            'ocupacion': fila['ocupados'] / ofrecidos if ofrecidos else 0,
+        })
+    def orden(fila):
+        bloque = fila['bloque']
+        if bloque is None:
+            return (len(DIAS), fila['time_block_id'])
+        return (DIAS.index(bloque.day_of_week), bloque.start_time)
+
+    return sorted(resultado, key=orden)
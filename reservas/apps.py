@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ReservasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservas'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .consultas import instalar
+        from . import signals  # noqa: F401 (invalidación del caché)
+
+        # Registro de consultas lentas en cada conexión nueva
+        connection_created.connect(instalar, dispatch_uid='reservas_consultas_lentas')
@@ -0,0 +1,142 @@
+"""
+Archivado de reservas antiguas.
+
+Las reservas con fecha anterior al horizonte configurado se mueven (junto con
+sus materiales solicitados) a la tabla ReservationArchive, de modo que la tabla
+de reservas solo contenga el período actual y el próximo.
+
+Solo se archivan reservas de días anteriores a hoy que ya no ocupan su bloque
+(completadas o canceladas): una activa fuera de la tabla principal desaparecería
+del grid y dejaría de impedir que se reserve dos veces el mismo bloque.
+
+Mover una reserva al archivo no es un borrado para las señales de signals.py:
+sus contadores son de días pasados y la analítica sigue contándola desde el
+archivo. Mientras `archivar_lote` borra, `archivando()` es True y esas señales
+no hacen nada, así cada lote son unas pocas consultas.
+"""
+import contextvars
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import calendario
+from .models import ACTIVE_STATUSES, Reservation, ReservationArchive
+
+
+_archivando = contextvars.ContextVar('reservas_archivando', default=False)
+
+
+def archivando():
+    """True mientras se borran de la tabla principal reservas ya copiadas al archivo"""
+    return _archivando.get()
+
+
+def fecha_limite_archivo(dias=None):
+    """Retorna la fecha desde la cual (excluida) hacia atrás se archiva"""
+    if dias is None:
+        dias = getattr(settings, 'RESERVAS_ARCHIVO_DIAS', 180)
+    if dias < 1:
+        raise ValueError('Solo se archivan reservas de al menos un día de antigüedad')
+    return timezone.localdate() - timedelta(days=dias)
+
+
+def _archivables(antes_de):
+    # Nunca desde hoy, aunque `antes_de` sea posterior
+    return Reservation.objects.filter(
+        date__lt=min(antes_de, timezone.localdate()),
+    ).exclude(status__in=ACTIVE_STATUSES)
+
+
+def archivar_lote(ids, antes_de):
+    """Mueve al archivo, en una sola transacción, las reservas indicadas que sigan siendo archivables"""
+    MaterialesReserva = Reservation.requested_materials.through
+    MaterialesArchivo = ReservationArchive.requested_materials.through
+
+    with transaction.atomic():
+        reservas = list(_archivables(antes_de).filter(pk__in=ids))
+        if not reservas:
+            return 0
+
+        ReservationArchive.objects.bulk_create([
+            ReservationArchive(
+                id=r.pk,
+                user_id=r.user_id,
+                room_id=r.room_id,
+                date=r.date,
+                time_block_id=r.time_block_id,
+                status=r.status,
+                notes=r.notes,
+                created_at=r.created_at,
+                updated_at=r.updated_at,
+            )
+            for r in reservas
+        ])
+
+        materiales = MaterialesReserva.objects.filter(
+            reservation_id__in=[r.pk for r in reservas]
+        ).values_list('reservation_id', 'material_id')
+        MaterialesArchivo.objects.bulk_create([
+            MaterialesArchivo(reservationarchive_id=reserva_id, material_id=material_id)
+            for reserva_id, material_id in materiales
+        ])
+
+        MaterialesReserva.objects.filter(reservation_id__in=[r.pk for r in reservas]).delete()
+        token = _archivando.set(True)
+        try:
+            Reservation.objects.filter(pk__in=[r.pk for r in reservas]).delete()
+        finally:
+            _archivando.reset(token)
+        # Las archivadas salen de los calendarios (las señales se saltan al archivar)
+        calendario.invalidar({r.user_id for r in reservas}, {r.room_id for r in reservas})
+
+    return len(reservas)
+
+
+def archivar_reservas(antes_de, lote=500):
+    """
+    Archiva las reservas completadas o canceladas con fecha anterior a
+    `antes_de` (y a hoy), en lotes.
+
+    Cada lote es independiente: si el proceso se interrumpe, lo ya archivado
+    queda archivado y la siguiente ejecución continúa con el resto.
+    """
+    total = 0
+    ultimo_id = 0
+    while True:
+        ids = list(
+            _archivables(antes_de).filter(pk__gt=ultimo_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:lote]
+        )
+        if not ids:
+            break
+        total += archivar_lote(ids, antes_de)
+        # Las que cambiaron de estado entre la lectura y el lote se saltan
+        ultimo_id = ids[-1]
+    return total
+
+
+def historial_reservas(user, limite=10):
+    """
+    Últimas reservas pasadas del usuario, leyendo de ambas tablas.
+
+    Las archivadas son siempre más antiguas que las que siguen en la tabla
+    principal, así que solo se consulta el archivo si faltan filas.
+    """
+    hoy = timezone.now().date()
+    reservas = list(
+        Reservation.objects.filter(user=user, date__lt=hoy)
+        .select_related('room', 'time_block')
+        .order_by('-date', '-time_block__start_time')[:limite]
+    )
+
+    if len(reservas) < limite:
+        reservas += list(
+            ReservationArchive.objects.filter(user=user)
+            .select_related('room', 'time_block')
+            .order_by('-date', '-time_block__start_time')[:limite - len(reservas)]
+        )
+
+    return reservas
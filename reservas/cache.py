@@ -0,0 +1,157 @@
+"""
+Datos casi estáticos que se leen en cada solicitud: reglas, salas públicas y
+límites de cada rol (el horario semanal está en horarios.py).
+
+Se guardan en el caché `default` y se invalidan con señales al modificarse
+(ver signals.py). Con CACHE=locmem cada proceso tiene su copia, así que los
+demás procesos ven el cambio a más tardar en RESERVAS_CACHE_SEGUNDOS.
+
+Se cargan siempre desde la base principal, aunque la solicitud sea de una vista
+@solo_lectura: justo después de invalidar, una réplica atrasada todavía tiene el
+valor viejo y quedaría en el caché por RESERVAS_CACHE_SEGUNDOS.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import get_template
+
+from . import horarios
+from .metricas import registrar_cache
+from .models import ReservationRules, Role, Room, UserProfile
+
+
+logger = logging.getLogger('reservas')
+
+CLAVE_REGLAS = 'reservas:reglas'
+CLAVE_SALAS = 'reservas:salas_publicas'
+CLAVE_ROLES = 'reservas:roles'
+
+
+def clave_rol_usuario(user_id):
+    return f'reservas:rol_usuario:{user_id}'
+
+# Plantillas que se compilan en la precarga (quedan en el cached loader)
+PLANTILLAS = [
+    'reservas/base.html',
+    'reservas/index.html',
+    'reservas/disponibilidad.html',
+    'reservas/confirmar.html',
+    'reservas/mis_reservas.html',
+    'admin/index.html',
+    'admin/change_list.html',
+    'admin/change_form.html',
+    'admin/login.html',
+]
+
+_FALTA = object()
+
+
+def _obtener(clave, nombre, cargar):
+    valor = cache.get(clave, _FALTA)
+    if valor is not _FALTA:
+        registrar_cache(nombre, True)
+        return valor
+    registrar_cache(nombre, False)
+    valor = cargar()
+    cache.set(clave, valor, getattr(settings, 'RESERVAS_CACHE_SEGUNDOS', 300))
+    return valor
+
+
+def obtener_reglas():
+    """Reglas de reserva (o None si no hay)"""
+    return _obtener(CLAVE_REGLAS, 'reglas', ReservationRules.objects.using(DEFAULT_DB_ALIAS).first)
+
+
+def salas_publicas():
+    """
+    Salas públicas y activas, ordenadas por nombre, con sus materiales ya
+    cargados (el grid los cuenta por sala sin consultar la base)
+    """
+    return _obtener(
+        CLAVE_SALAS, 'salas',
+        lambda: list(
+            Room.objects.using(DEFAULT_DB_ALIAS).filter(is_public=True, is_active=True)
+            .prefetch_related('available_materials').order_by('name')
+        )
+    )
+
+
+def datos_de_roles():
+    """{role_id: {'max_horas', 'solicitudes_por_minuto', 'prioridad'}}; None = usar la regla global"""
+    return _obtener(
+        CLAVE_ROLES, 'roles',
+        lambda: {
+            pk: {'max_horas': max_horas, 'solicitudes_por_minuto': por_minuto, 'prioridad': prioridad}
+            for pk, max_horas, por_minuto, prioridad in Role.objects.using(DEFAULT_DB_ALIAS).values_list(
+                'pk', 'max_hours_override', 'requests_per_minute', 'priority'
+            )
+        }
+    )
+
+
+def datos_de_rol_usuario(user_id):
+    """Datos del rol del usuario (vacío si no tiene perfil)"""
+    return datos_de_roles().get(rol_de_usuario(user_id), {})
+
+
+def max_horas_por_dia(user_id):
+    """Igual que UserProfile.get_max_hours_per_day, sin consultar la base"""
+    max_horas = datos_de_rol_usuario(user_id).get('max_horas')
+    if max_horas:
+        return max_horas
+    reglas = obtener_reglas()
+    return reglas.max_hours_per_day if reglas else 2
+
+
+def rol_de_usuario(user_id):
+    """role_id del perfil del usuario (o None si no tiene perfil)"""
+    return _obtener(
+        clave_rol_usuario(user_id), 'rol_usuario',
+        lambda: UserProfile.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+        .values_list('role_id', flat=True).first()
+    )
+
+
+def invalidar_todo():
+    """Para cargas masivas (bulk_create no dispara señales) o al cambiar de base"""
+    cache.delete_many([CLAVE_REGLAS, CLAVE_SALAS, CLAVE_ROLES])
+    horarios.invalidar()
+
+
+# ========================================
+# Precarga al iniciar un proceso
+# ========================================
+def precargar():
+    """Carga el caché y compila las plantillas; devuelve los tiempos en ms por paso"""
+    pasos = [
+        ('reglas', obtener_reglas),
+        ('horario', horarios.horario),
+        ('salas', salas_publicas),
+        ('plantillas', lambda: [get_template(nombre) for nombre in PLANTILLAS]),
+    ]
+    tiempos = {}
+    for nombre, paso in pasos:
+        inicio = time.perf_counter()
+        paso()
+        tiempos[nombre] = round((time.perf_counter() - inicio) * 1000, 2)
+    tiempos['total'] = round(sum(tiempos.values()), 2)
+    return tiempos
+
+
+def precargar_al_iniciar():
+    """
+    Hook para wsgi.py/asgi.py: precarga al levantar cada worker (no corre en
+    migrate ni en otros comandos). Se desactiva con RESERVAS_PRECARGAR = False.
+    """
+    if not getattr(settings, 'RESERVAS_PRECARGAR', True):
+        return
+    try:
+        tiempos = precargar()
+    except Exception:
+        # Sin base todavía (primer deploy, antes de migrar): se carga en la primera solicitud
+        logger.exception('No se pudo precargar el caché')
+        return
+    logger.info('Precarga: %s', ', '.join(f'{paso} {ms}ms' for paso, ms in tiempos.items()))
@@ -0,0 +1,236 @@
+"""
+Calendarios iCalendar (.ics) para suscribirse: uno por usuario (sus reservas)
+y uno por sala (su agenda).
+
+Los clientes de calendario consultan el feed cada pocos minutos, así que casi
+nunca se debe armar:
+
+- La URL lleva un token firmado con SECRET_KEY (`token_usuario`,
+  `token_sala`): se valida sin consultar la base y no se puede adivinar.
+- La versión del feed es un hash de una consulta por índice (cantidad de
+  reservas de la ventana, cuántas se muestran, su último updated_at y el de la
+  sala), así que es la misma en todos los procesos. Se guarda en el caché y
+  solo se consulta la base si no está: las señales (y completar_reservas y
+  archivar_lote, que no pasan por ellas) la borran después del commit al crear,
+  cancelar, completar, editar o borrar una reserva. Vence a los
+  RESERVAS_CALENDARIO_VERSION_SEGUNDOS por si el cambio no llegó a este
+  caché (con CACHE=locmem, los otros procesos) o cambió otra cosa que se
+  muestra (ej: el nombre de la sala en los feeds de usuario).
+- La versión es el ETag: con If-None-Match el cliente recibe 304 sin que se
+  arme el feed. El .ics se genera con otra consulta y se guarda en el caché
+  bajo su versión (con CACHE=locmem, una copia por proceso).
+
+Las horas van sin zona (hora local del cliente), igual que los bloques.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, FilteredRelation, Max, Q
+from django.utils import timezone
+
+from .horarios import horario
+from .metricas import registrar_cache
+from .models import Reservation, Room
+
+
+USUARIO = 'u'
+SALA = 's'
+
+# Las canceladas desaparecen del feed (y del calendario del cliente)
+ESTADOS = {'pending': 'TENTATIVE', 'confirmed': 'CONFIRMED', 'completed': 'CONFIRMED'}
+
+_firmador = signing.Signer(salt='reservas.calendario')
+
+
+def _segundos():
+    return getattr(settings, 'RESERVAS_CALENDARIO_SEGUNDOS', 3600)
+
+
+# ========================================
+# Tokens
+# ========================================
+def token_usuario(user_id):
+    return _firmador.sign(f'{USUARIO}{user_id}')
+
+
+def token_sala(room_id):
+    return _firmador.sign(f'{SALA}{room_id}')
+
+
+def leer_token(token):
+    """(tipo, id) del feed, o None si el token no es válido"""
+    try:
+        valor = _firmador.unsign(token)
+    except signing.BadSignature:
+        return None
+    tipo, pk = valor[:1], valor[1:]
+    if tipo not in (USUARIO, SALA) or not pk.isdigit():
+        return None
+    return tipo, int(pk)
+
+
+# ========================================
+# Versiones
+# ========================================
+def _desde():
+    return timezone.localdate() - timedelta(days=getattr(settings, 'RESERVAS_CALENDARIO_DIAS_ATRAS', 30))
+
+
+def clave_version(tipo, pk):
+    return f'reservas:calendario:version:{tipo}{pk}'
+
+
+def version(tipo, pk):
+    """Versión actual del feed: del caché o, si no está, con una consulta"""
+    clave = clave_version(tipo, pk)
+    valor = cache.get(clave)
+    registrar_cache('calendario_version', valor is not None)
+    if valor is None:
+        valor = _calcular_version(tipo, pk)
+        cache.set(clave, valor, getattr(settings, 'RESERVAS_CALENDARIO_VERSION_SEGUNDOS', 300))
+    return valor
+
+
+def _calcular_version(tipo, pk):
+    desde = _desde()
+    if tipo == USUARIO:
+        datos = Reservation.objects.filter(user_id=pk, date__gte=desde).aggregate(
+            reservas=Count('id'),
+            visibles=Count('id', filter=Q(status__in=list(ESTADOS))),
+            reserva=Max('updated_at'),
+            sala=Max('room__updated_at'),
+        )
+    else:
+        # La fecha va en el JOIN: la sala cuenta aunque no tenga reservas en la ventana
+        datos = Room.objects.filter(pk=pk).annotate(
+            ventana=FilteredRelation('reservations', condition=Q(reservations__date__gte=desde)),
+        ).aggregate(
+            reservas=Count('ventana'),
+            visibles=Count('ventana', filter=Q(ventana__status__in=list(ESTADOS))),
+            reserva=Max('ventana__updated_at'),
+            sala=Max('updated_at'),
+        )
+    # Borrar cambia la cantidad; cancelar, las visibles; editar, el último updated_at
+    firma = f'{desde}|{datos["reservas"]}|{datos["visibles"]}|{datos["reserva"]}|{datos["sala"]}'
+    return hashlib.sha256(firma.encode()).hexdigest()[:20]
+
+
+def invalidar(usuarios=(), salas=()):
+    """Descarta la versión de los feeds indicados, después del commit"""
+    claves = [clave_version(USUARIO, pk) for pk in usuarios] + [clave_version(SALA, pk) for pk in salas]
+    if claves:
+        transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+# ========================================
+# Generación
+# ========================================
+def _texto(valor):
+    return (
+        str(valor).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _plegar(linea):
+    """Líneas de hasta 75 octetos, las siguientes empiezan con un espacio (RFC 5545)"""
+    datos = linea.encode('utf-8')
+    if len(datos) <= 75:
+        return linea
+    partes = []
+    while datos:
+        corte = 75 if not partes else 74
+        # No cortar a la mitad de un carácter UTF-8
+        while corte < len(datos) and (datos[corte] & 0xC0) == 0x80:
+            corte -= 1
+        partes.append(datos[:corte].decode('utf-8'))
+        datos = datos[corte:]
+    return '\r\n '.join(partes)
+
+
+def _fecha_hora(fecha, hora):
+    return datetime.combine(fecha, hora).strftime('%Y%m%dT%H%M%S')
+
+
+def _evento(pk, fecha, bloque, estado, actualizada, resumen, lugar):
+    return [
+        'BEGIN:VEVENT',
+        f'UID:reserva-{pk}@sala-reservas',
+        f'DTSTAMP:{actualizada.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")}',
+        f'DTSTART:{_fecha_hora(fecha, bloque.start_time)}',
+        f'DTEND:{_fecha_hora(fecha, bloque.end_time)}',
+        f'SUMMARY:{_texto(resumen)}',
+        f'LOCATION:{_texto(lugar)}',
+        f'STATUS:{ESTADOS[estado]}',
+        'END:VEVENT',
+    ]
+
+
+def _calendario(nombre, eventos):
+    lineas = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Sala Reservas//Calendario//ES',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_texto(nombre)}',
+    ]
+    for evento in eventos:
+        lineas.extend(evento)
+    lineas.append('END:VCALENDAR')
+    return '\r\n'.join(_plegar(linea) for linea in lineas) + '\r\n'
+
+
+def _reservas(**filtro):
+    return Reservation.objects.filter(
+        date__gte=_desde(), status__in=list(ESTADOS), **filtro,
+    ).order_by('date', 'pk')
+
+
+def generar_usuario(user_id):
+    """Reservas del usuario, con una consulta"""
+    horario_actual = horario()
+    filas = _reservas(user_id=user_id).values_list(
+        'pk', 'date', 'time_block_id', 'status', 'updated_at', 'room__name', 'room__location',
+    )
+    eventos = []
+    for pk, fecha, bloque_id, estado, actualizada, sala, ubicacion in filas:
+        bloque = horario_actual.bloque(bloque_id)
+        if bloque:
+            eventos.append(_evento(pk, fecha, bloque, estado, actualizada, f'Reserva: {sala}', ubicacion))
+    return _calendario('Mis reservas de salas', eventos)
+
+
+def generar_sala(room_id):
+    """Agenda de la sala, con una consulta (dos si no tiene reservas)"""
+    horario_actual = horario()
+    filas = list(_reservas(room_id=room_id).values_list(
+        'pk', 'date', 'time_block_id', 'status', 'updated_at',
+        'room__name', 'room__location', 'user__username', 'user__first_name', 'user__last_name',
+    ))
+    if filas:
+        nombre = filas[0][5]
+    else:
+        nombre = Room.objects.filter(pk=room_id).values_list('name', flat=True).first() or f'Sala {room_id}'
+
+    eventos = []
+    for pk, fecha, bloque_id, estado, actualizada, _, ubicacion, usuario, nombres, apellidos in filas:
+        bloque = horario_actual.bloque(bloque_id)
+        if bloque:
+            quien = f'{nombres} {apellidos}'.strip() or usuario
+            eventos.append(_evento(pk, fecha, bloque, estado, actualizada, f'Reservada: {quien}', ubicacion))
+    return _calendario(nombre, eventos)
+
+
+def feed(tipo, pk, version_actual):
+    """Texto del .ics de esa versión, desde el caché o generado"""
+    clave = f'reservas:calendario:{tipo}{pk}:{version_actual}'
+    cuerpo = cache.get(clave)
+    registrar_cache('calendario', cuerpo is not None)
+    if cuerpo is None:
+        cuerpo = generar_usuario(pk) if tipo == USUARIO else generar_sala(pk)
+        cache.set(clave, cuerpo, _segundos())
+    return cuerpo
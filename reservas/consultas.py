@@ -0,0 +1,103 @@
+"""
+Registro de consultas lentas (y de una muestra de todas) con el punto de llamada.
+
+Se instala en cada conexión nueva mediante la señal `connection_created`, así
+cubre vistas, comandos y cualquier hilo. Cada consulta registrada es una línea
+JSON en el logger `reservas.consultas`:
+
+    {"fecha": ..., "motivo": "lenta" | "muestra", "peso": 1.0, "alias": "default",
+     "huella": "SELECT ... WHERE id = ?", "parametros": 2, "duracion_ms": 153.2,
+     "sitio": "reservas/views.py:74 disponibilidad"}
+
+`peso` es la cantidad de consultas que representa la línea (1 para las lentas,
+1/muestreo para las de la muestra); el comando `reporte_consultas` lo usa para
+estimar totales. Configuración en settings:
+
+    RESERVAS_CONSULTAS_UMBRAL_MS  se registran las consultas más lentas que esto (None = ninguna)
+    RESERVAS_CONSULTAS_MUESTREO   fracción de las demás consultas que se registra (0 a 1)
+    RESERVAS_CONSULTAS_LOG        archivo donde escribe el logger
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .rendimiento import huella_sql
+
+
+logger = logging.getLogger('reservas.consultas')
+
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+RAIZ_PROYECTO = os.path.dirname(DIRECTORIO_APP)
+
+# Módulos de instrumentación: envuelven el código real, no son el punto de llamada
+MODULOS_IGNORADOS = {
+    os.path.join(DIRECTORIO_APP, nombre)
+    for nombre in ('consultas.py', 'middleware.py', 'metricas.py', 'perfil.py', 'rendimiento.py')
+}
+
+
+def sitio_llamada():
+    """
+    Primer marco de la pila que pertenece a la app reservas (sin contar los
+    módulos de instrumentación), como "reservas/views.py:74 disponibilidad".
+    None si la consulta no viene de código de reservas (ej. la autenticación).
+    """
+    marco = sys._getframe(1)
+    while marco is not None:
+        archivo = marco.f_code.co_filename
+        if archivo.startswith(DIRECTORIO_APP) and archivo not in MODULOS_IGNORADOS:
+            relativo = os.path.relpath(archivo, RAIZ_PROYECTO)
+            return f'{relativo}:{marco.f_lineno} {marco.f_code.co_name}'
+        marco = marco.f_back
+    return None
+
+
+class ConsultasLentas:
+    """Execute wrapper que registra las consultas lentas y una muestra del resto"""
+
+    def __init__(self, umbral_ms=None, muestreo=0.0):
+        self.umbral = umbral_ms / 1000 if umbral_ms is not None else None
+        self.muestreo = muestreo
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            if self.umbral is not None and duracion >= self.umbral:
+                self.registrar('lenta', 1.0, sql, params, duracion, context)
+            elif self.muestreo and random.random() < self.muestreo:
+                self.registrar('muestra', 1 / self.muestreo, sql, params, duracion, context)
+
+    def registrar(self, motivo, peso, sql, params, duracion, context):
+        logger.info(json.dumps({
+            'fecha': timezone.now().isoformat(),
+            'motivo': motivo,
+            'peso': round(peso, 3),
+            'alias': context['connection'].alias,
+            'huella': huella_sql(sql),
+            # Con executemany params es una lista de filas
+            'parametros': len(params) if params is not None else 0,
+            'duracion_ms': round(duracion * 1000, 3),
+            'sitio': sitio_llamada(),
+        }, ensure_ascii=False))
+
+
+def instalar(sender, connection, **kwargs):
+    """Receptor de `connection_created`: agrega el wrapper a la conexión nueva"""
+    umbral_ms = getattr(settings, 'RESERVAS_CONSULTAS_UMBRAL_MS', None)
+    muestreo = getattr(settings, 'RESERVAS_CONSULTAS_MUESTREO', 0.0)
+    if umbral_ms is None and not muestreo:
+        return
+    if any(isinstance(wrapper, ConsultasLentas) for wrapper in connection.execute_wrappers):
+        return
+    # Al inicio de la lista: la conexión puede abrirse dentro de un
+    # `with connection.execute_wrapper(...)`, que al salir quita el último
+    connection.execute_wrappers.insert(0, ConsultasLentas(umbral_ms, muestreo))
@@ -0,0 +1,152 @@
+"""
+Contadores por usuario y fecha (ReservationCounter): reservas activas y
+minutos reservados. Los minutos incluyen las reservas completadas: una reserva
+que ya terminó sigue contando para las horas del día (si no, al completarla
+quedaría espacio para pasarse de max_hours_per_day ese mismo día).
+
+Con ellos los dos topes de una reserva nueva (máximo de reservas activas y
+horas por día) se revisan con una sola lectura por rango del índice
+(usuario, fecha), sin contar reservas.
+
+Se mantienen con UPDATE ... SET x = x + n (F()), atómicos aunque haya
+escrituras concurrentes:
+
+- signals.py ajusta al guardar o borrar una Reservation (crear, cancelar,
+  cambiar de estado o de fecha desde el admin), en la misma transacción.
+- completar_reservas ajusta los lotes que actualiza con QuerySet.update().
+- `reconciliar` (comando reconciliar_contadores) los recalcula desde las
+  reservas y corrige las diferencias.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .horarios import horario
+from .models import ACTIVE_STATUSES, Reservation, ReservationCounter, TimeBlock
+
+
+# Estados cuyas reservas suman minutos al día del usuario
+ESTADOS_CON_MINUTOS = ACTIVE_STATUSES + ['completed']
+
+
+def minutos_bloque(bloque_id):
+    bloque = horario().bloque(bloque_id)
+    if bloque is None:
+        # Bloque creado en esta misma transacción, o por otro proceso antes de
+        # que este recargue el horario: se lee de la base (sin recargar el
+        # horario, que podría quedar con datos sin confirmar)
+        bloque = TimeBlock.objects.get(pk=bloque_id)
+    return round(bloque.duration_hours() * 60)
+
+
+def aporte(estado, bloque_id):
+    """(reservas activas, minutos) que suma al contador una reserva en `estado`"""
+    return (
+        1 if estado in ACTIVE_STATUSES else 0,
+        minutos_bloque(bloque_id) if estado in ESTADOS_CON_MINUTOS else 0,
+    )
+
+
+def ajustar(user_id, fecha, reservas, minutos):
+    """Suma (o resta) reservas activas y minutos al contador de (usuario, fecha)"""
+    if not reservas and not minutos:
+        return
+    filas = ReservationCounter.objects.filter(user_id=user_id, date=fecha)
+    cambios = {
+        'active_reservations': F('active_reservations') + reservas,
+        'reserved_minutes': F('reserved_minutes') + minutos,
+    }
+    if filas.update(**cambios):
+        return
+    if reservas < 0 or minutos < 0:
+        # Restar de un contador que no existe es un desfase: lo corrige reconciliar
+        return
+    try:
+        with transaction.atomic():
+            ReservationCounter.objects.create(
+                user_id=user_id, date=fecha, active_reservations=reservas, reserved_minutes=minutos
+            )
+    except IntegrityError:
+        # Otra transacción lo creó entre el UPDATE y el INSERT
+        filas.update(**cambios)
+
+
+def ajustar_lote(filas, signo, con_minutos=True):
+    """
+    filas: (user_id, fecha, bloque_id) de reservas que pasan a (o dejan de estar)
+    activas. con_minutos=False para las que se completan: dejan de estar activas
+    pero sus minutos siguen contando.
+    """
+    totales = defaultdict(lambda: [0, 0])
+    for user_id, fecha, bloque_id in filas:
+        total = totales[(user_id, fecha)]
+        total[0] += signo
+        if con_minutos:
+            total[1] += signo * minutos_bloque(bloque_id)
+    for (user_id, fecha), (reservas, minutos) in sorted(totales.items()):
+        ajustar(user_id, fecha, reservas, minutos)
+
+
+def leer(user_ids, desde=None):
+    """
+    {user_id: {fecha: (reservas activas, minutos)}} desde `desde` (default: hoy),
+    con una consulta.
+    """
+    contadores = defaultdict(dict)
+    filas = ReservationCounter.objects.filter(
+        user_id__in=user_ids,
+        date__gte=desde or timezone.localdate(),
+    ).values_list('user_id', 'date', 'active_reservations', 'reserved_minutes')
+    for user_id, fecha, reservas, minutos in filas:
+        contadores[user_id][fecha] = (reservas, minutos)
+    return contadores
+
+
+def reconciliar(desde=None, corregir=True):
+    """
+    Recalcula los contadores desde las reservas activas y completadas a partir
+    de `desde` (default: hoy) y, si `corregir`, arregla las diferencias. Borra además los
+    contadores de fechas pasadas. Retorna la lista de diferencias
+    (user_id, fecha, guardado, real) con (reservas, minutos).
+    """
+    desde = desde or timezone.localdate()
+    with transaction.atomic():
+        reales = defaultdict(lambda: [0, 0])
+        reservas = (
+            Reservation.objects.filter(date__gte=desde, status__in=ESTADOS_CON_MINUTOS)
+            .values('user_id', 'date', 'time_block_id', 'status')
+            .annotate(n=Count('id'))
+            .values_list('user_id', 'date', 'time_block_id', 'status', 'n')
+        )
+        for user_id, fecha, bloque_id, estado, n in reservas.iterator():
+            activas, minutos = aporte(estado, bloque_id)
+            real = reales[(user_id, fecha)]
+            real[0] += n * activas
+            real[1] += n * minutos
+
+        guardados = {
+            (user_id, fecha): (reservas, minutos)
+            for user_id, fecha, reservas, minutos in ReservationCounter.objects.filter(date__gte=desde)
+            .values_list('user_id', 'date', 'active_reservations', 'reserved_minutes').iterator()
+        }
+
+        diferencias = []
+        for clave in set(reales) | set(guardados):
+            real = tuple(reales.get(clave, (0, 0)))
+            guardado = guardados.get(clave, (0, 0))
+            if real != guardado:
+                diferencias.append((*clave, guardado, real))
+
+        if corregir:
+            ReservationCounter.objects.filter(date__lt=timezone.localdate()).delete()
+            for user_id, fecha, guardado, real in diferencias:
+                if real == (0, 0):
+                    ReservationCounter.objects.filter(user_id=user_id, date=fecha).delete()
+                else:
+                    ReservationCounter.objects.update_or_create(
+                        user_id=user_id, date=fecha,
+                        defaults={'active_reservations': real[0], 'reserved_minutes': real[1]},
+                    )
+    return sorted(diferencias)
@@ -0,0 +1,132 @@
+"""
+Exportación de reservas en streaming (CSV o JSON por líneas).
+
+Para auditorías y planificación se exportan rangos de meses o años: en vez de
+armar la lista en memoria, las filas se leen con .iterator(chunk_size=lote) (en
+PostgreSQL, con un cursor del servidor) y se escriben a medida que llegan en una
+StreamingHttpResponse. Sala, usuario y rol vienen en el mismo SELECT; los
+materiales, con un solo prefetch por lote; los bloques, del horario en memoria.
+La memoria queda plana y el primer byte sale de inmediato.
+
+Se usa desde la vista `exportar_reservas` (staff) y desde la acción del admin.
+"""
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+
+from . import metricas
+from .horarios import horario
+from .models import Material
+
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+CAMPOS = [
+    'id', 'fecha', 'inicio', 'fin', 'bloque', 'sala', 'ubicacion', 'usuario',
+    'email', 'nombre', 'rol', 'estado', 'materiales', 'notas', 'creada', 'actualizada',
+]
+
+
+def _lote():
+    return getattr(settings, 'RESERVAS_EXPORTACION_LOTE', 2000)
+
+
+def preparar(queryset):
+    """Columnas justas, sala/usuario/rol en el mismo SELECT y materiales en un prefetch por lote"""
+    return (
+        queryset
+        .select_related('room', 'user', 'user__profile__role')
+        .prefetch_related(Prefetch('requested_materials', queryset=Material.objects.only('name').order_by('name')))
+        .only(
+            'id', 'date', 'time_block_id', 'status', 'notes', 'created_at', 'updated_at',
+            'room__name', 'room__location',
+            'user__username', 'user__email', 'user__first_name', 'user__last_name',
+            'user__profile__role__display_name',
+        )
+    )
+
+
+def registros(queryset, lote=None):
+    """Un dict por reserva (claves = CAMPOS), leyendo de a `lote` filas"""
+    horario_actual = horario()
+    estados = dict(queryset.model._meta.get_field('status').choices)
+
+    for reserva in preparar(queryset).iterator(chunk_size=lote or _lote()):
+        bloque = horario_actual.bloque(reserva.time_block_id)
+        perfil = getattr(reserva.user, 'profile', None)
+        rol = perfil.role if perfil else None
+        yield {
+            'id': reserva.pk,
+            'fecha': reserva.date.isoformat(),
+            'inicio': bloque.start_time.strftime('%H:%M') if bloque else '',
+            'fin': bloque.end_time.strftime('%H:%M') if bloque else '',
+            'bloque': bloque.name if bloque else '',
+            'sala': reserva.room.name,
+            'ubicacion': reserva.room.location,
+            'usuario': reserva.user.username,
+            'email': reserva.user.email,
+            'nombre': reserva.user.get_full_name(),
+            'rol': rol.display_name if rol else '',
+            'estado': estados.get(reserva.status, reserva.status),
+            'materiales': [material.name for material in reserva.requested_materials.all()],
+            'notas': reserva.notes,
+            'creada': reserva.created_at.isoformat(),
+            'actualizada': reserva.updated_at.isoformat(),
+        }
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve lo escrito en vez de guardarlo"""
+
+    def write(self, valor):
+        return valor
+
+
+# Excel (y LibreOffice) interpretan como fórmula una celda que empieza así
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _celda(valor):
+    """Texto escrito por usuarios (notas, nombres) sin que se ejecute como fórmula"""
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def lineas_csv(filas):
+    escritor = csv.writer(_Eco())
+    # BOM para que Excel reconozca UTF-8
+    yield '﻿' + escritor.writerow(CAMPOS)
+    for fila in filas:
+        fila['materiales'] = ', '.join(fila['materiales'])
+        yield escritor.writerow([_celda(fila[campo]) for campo in CAMPOS])
+
+
+def lineas_ndjson(filas):
+    for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
+
+
+def respuesta(querysets, formato, nombre):
+    """
+    StreamingHttpResponse con las reservas de `querysets` (uno tras otro, ej:
+    archivadas y actuales) en `formato` ('csv' o 'ndjson').
+    """
+    def filas():
+        for queryset in querysets:
+            yield from registros(queryset)
+
+    lineas = lineas_csv(filas()) if formato == 'csv' else lineas_ndjson(filas())
+    metricas.incrementar('exportaciones_total', formato=formato)
+
+    response = StreamingHttpResponse(lineas, content_type=FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    # Que nginx no junte la respuesta completa antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,122 @@
+"""
+Horario semanal en memoria: los bloques horarios agrupados por día.
+
+Los bloques cambian una vez por semestre pero se consultan en cada solicitud,
+así que cada proceso guarda una copia inmutable (registros `Bloque` con
+__slots__) y la vuelve a cargar solo cuando cambia la versión:
+
+- Al guardar o borrar un TimeBlock (signals.py) se publica una versión nueva
+  en el caché `default`; con CACHE=archivo todos los procesos la ven al instante.
+- Con CACHE=locmem los demás procesos recargan a más tardar en
+  RESERVAS_CACHE_SEGUNDOS.
+
+Se carga desde la base principal (no de una réplica atrasada), igual que cache.py.
+"""
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .metricas import registrar_cache
+from .models import TimeBlock
+
+
+CLAVE_VERSION = 'reservas:horario:version'
+
+# weekday() → 'monday', 'tuesday', ...
+DIAS = tuple(dia for dia, _ in TimeBlock.DAYS_OF_WEEK)
+NOMBRES_DIAS = dict(TimeBlock.DAYS_OF_WEEK)
+
+
+class Bloque:
+    """
+    Copia inmutable y liviana de un TimeBlock.
+
+    Expone los mismos atributos que usan las vistas y plantillas (id, name,
+    start_time, end_time, duration_hours()...), así se usa en su lugar.
+    """
+    __slots__ = ('id', 'name', 'day_of_week', 'start_time', 'end_time', 'is_active', '_duracion')
+
+    def __init__(self, bloque):
+        for campo in ('id', 'name', 'day_of_week', 'start_time', 'end_time', 'is_active'):
+            object.__setattr__(self, campo, getattr(bloque, campo))
+        object.__setattr__(self, '_duracion', bloque.duration_hours())
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('Los bloques del horario son de solo lectura')
+
+    @property
+    def pk(self):
+        return self.id
+
+    def duration_hours(self):
+        return self._duracion
+
+    def __str__(self):
+        dia = NOMBRES_DIAS.get(self.day_of_week, self.day_of_week)
+        return f"{dia} - {self.name} ({self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')})"
+
+    def __repr__(self):
+        return f'<Bloque {self.id}: {self}>'
+
+
+class HorarioSemanal:
+    """Bloques activos por día (ordenados por hora) y todos los bloques por id"""
+    __slots__ = ('por_dia', 'por_id', 'version', 'cargado')
+
+    def __init__(self, bloques, version):
+        por_dia = {dia: [] for dia in DIAS}
+        por_id = {}
+        for bloque in sorted(bloques, key=lambda b: b.start_time):
+            por_id[bloque.id] = bloque
+            if bloque.is_active:
+                por_dia.setdefault(bloque.day_of_week, []).append(bloque)
+        self.por_dia = MappingProxyType({dia: tuple(lista) for dia, lista in por_dia.items()})
+        self.por_id = MappingProxyType(por_id)
+        self.version = version
+        self.cargado = time.monotonic()
+
+    def del_dia(self, fecha):
+        """Bloques activos del día de la semana de `fecha`"""
+        return self.por_dia[DIAS[fecha.weekday()]]
+
+    def bloque(self, bloque_id):
+        """Bloque por id (activo o no), o None"""
+        return self.por_id.get(bloque_id)
+
+    @property
+    def total_activos(self):
+        return sum(len(bloques) for bloques in self.por_dia.values())
+
+
+_horario = None
+_candado = threading.Lock()
+
+
+def horario():
+    """Horario vigente; lo carga si no está o si cambió la versión"""
+    global _horario
+    version = cache.get(CLAVE_VERSION, 0)
+    vigencia = getattr(settings, 'RESERVAS_CACHE_SEGUNDOS', 300)
+    actual = _horario
+    if actual is None or actual.version != version or time.monotonic() - actual.cargado > vigencia:
+        with _candado:
+            actual = _horario
+            if actual is None or actual.version != version or time.monotonic() - actual.cargado > vigencia:
+                registrar_cache('horario', False)
+                actual = _horario = HorarioSemanal(
+                    [Bloque(b) for b in TimeBlock.objects.using(DEFAULT_DB_ALIAS)], version
+                )
+                return actual
+    registrar_cache('horario', True)
+    return actual
+
+
+def invalidar():
+    """Descarta el horario de este proceso y publica una versión nueva para los demás"""
+    global _horario
+    _horario = None
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
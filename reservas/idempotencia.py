@@ -0,0 +1,196 @@
+"""
+Envíos repetidos del formulario de confirmación.
+
+Con la red lenta el usuario vuelve a presionar "Confirmar" y el navegador manda
+el mismo POST dos o tres veces. El formulario lleva un token de un solo uso
+(`nuevo_token()` al mostrarlo), firmado con SECRET_KEY para ese usuario y con
+vencimiento: un token inventado o ajeno se ignora sin tocar la base, así que un
+script no puede llenar la tabla. El decorador `idempotente`:
+
+- El primer envío toma el token con un INSERT en IdempotencyKey: la clave única
+  (usuario, token) garantiza que solo uno lo logre aunque lleguen a la vez a
+  distintos workers (cache.add() no es atómico con el caché en archivos). Ese
+  envío ejecuta la vista y al terminar guarda en la fila a dónde redirigió y
+  los mensajes que dejó.
+- Los demás, antes de tocar las reservas, repiten esa misma respuesta (o, si la
+  primera sigue en curso, la esperan unos segundos). Quedan marcados en el
+  caché para que `limitar` no les cobre fichas (`es_reenvio`).
+
+Los tokens duran RESERVAS_IDEMPOTENCIA_SEGUNDOS; las filas vencidas las borra
+`purgar()` desde el barrido de completar_reservas, fuera de las solicitudes.
+"""
+import functools
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import messages
+from django.core import signing
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from .models import IdempotencyKey
+from .transacciones import reintentar_si_bloqueada
+
+
+CAMPO = 'idempotencia'
+LARGO_TOKEN = IdempotencyKey._meta.get_field('token').max_length
+
+# Cuánto espera un reintento a que termine el primer envío
+ESPERA_MAXIMA = 5.0
+
+
+_firmador = signing.TimestampSigner(salt='reservas.idempotencia')
+
+
+def _segundos():
+    return getattr(settings, 'RESERVAS_IDEMPOTENCIA_SEGUNDOS', 600)
+
+
+def nuevo_token(user_id):
+    return _firmador.sign(f'{user_id}:{secrets.token_urlsafe(16)}')
+
+
+def leer_token(request):
+    """
+    Parte aleatoria del token del formulario (lo que se guarda en
+    IdempotencyKey), o None si no viene, no lo firmó este sitio para este
+    usuario o ya venció
+    """
+    firmado = request.POST.get(CAMPO) if request.method == 'POST' else None
+    if not firmado or not request.user.is_authenticated:
+        return None
+    try:
+        valor = _firmador.unsign(firmado, max_age=_segundos())
+    except signing.BadSignature:
+        return None
+    user_id, _, token = valor.partition(':')
+    if user_id != str(request.user.pk) or not token or len(token) > LARGO_TOKEN:
+        return None
+    return token
+
+
+def _clave(user_id, token):
+    return f'reservas:idempotencia:{user_id}:{token}'
+
+
+def es_reenvio(request):
+    """True si el token del formulario ya lo tomó un envío anterior (según el caché)"""
+    token = leer_token(request)
+    return token is not None and cache.get(_clave(request.user.pk, token)) is not None
+
+
+@reintentar_si_bloqueada
+def reclamar(user_id, token):
+    """True si este envío tomó el token; False si otro lo tomó antes"""
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(user_id=user_id, token=token)
+    except IntegrityError:
+        return False
+    cache.set(_clave(user_id, token), 1, _segundos())
+    return True
+
+
+def _soltar(user_id, token):
+    """Libera el token para que el próximo envío se procese como nuevo"""
+    IdempotencyKey.objects.filter(user_id=user_id, token=token).delete()
+    cache.delete(_clave(user_id, token))
+
+
+def purgar():
+    """
+    Borra los tokens vencidos: su firma ya no es válida, así que ningún envío
+    los puede usar. Devuelve cuántos borró.
+    """
+    return IdempotencyKey.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=_segundos())
+    ).delete()[0]
+
+
+def _esperar(user_id, token):
+    """
+    Respuesta guardada del envío que tomó el token; None si sigue en curso tras
+    ESPERA_MAXIMA, o False si ese envío falló y este pudo tomar el token.
+    """
+    limite = time.monotonic() + ESPERA_MAXIMA
+    while True:
+        fila = IdempotencyKey.objects.filter(user_id=user_id, token=token).values('response').first()
+        if fila is None:
+            # El primero falló (borró el token) o venció: este lo intenta tomar
+            if reclamar(user_id, token):
+                return False
+        elif fila['response'] is not None:
+            return fila['response']
+        if time.monotonic() >= limite:
+            return None
+        time.sleep(0.1)
+
+
+class _GrabadoraMensajes:
+    """Envuelve el almacenamiento de mensajes para saber qué agregó la vista"""
+
+    def __init__(self, almacenamiento):
+        self.almacenamiento = almacenamiento
+        self.mensajes = []
+
+    def add(self, level, message, extra_tags=''):
+        self.mensajes.append((level, str(message), extra_tags))
+        return self.almacenamiento.add(level, message, extra_tags)
+
+    def __getattr__(self, nombre):
+        return getattr(self.almacenamiento, nombre)
+
+    def __iter__(self):
+        return iter(self.almacenamiento)
+
+    def __len__(self):
+        return len(self.almacenamiento)
+
+
+def _repetir(request, resultado):
+    for level, mensaje, extra_tags in resultado['mensajes']:
+        messages.add_message(request, level, mensaje, extra_tags=extra_tags)
+    return redirect(resultado['url'])
+
+
+def idempotente(vista):
+    """Decorador para vistas POST que terminan en una redirección con mensajes"""
+    @functools.wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        token = leer_token(request)
+        if token is None:
+            return vista(request, *args, **kwargs)
+
+        user_id = request.user.pk
+        # Un reenvío conocido va directo a leer la respuesta, sin intentar el INSERT
+        if es_reenvio(request) or not reclamar(user_id, token):
+            resultado = _esperar(user_id, token)
+            if resultado:
+                return _repetir(request, resultado)
+            if resultado is None:
+                messages.info(request, 'Tu solicitud anterior todavía se está procesando')
+                return redirect('reservas:mis_reservas')
+
+        grabadora = _GrabadoraMensajes(request._messages)
+        request._messages = grabadora
+        try:
+            respuesta = vista(request, *args, **kwargs)
+        except Exception:
+            _soltar(user_id, token)
+            raise
+        finally:
+            request._messages = grabadora.almacenamiento
+
+        if respuesta.status_code in (301, 302):
+            IdempotencyKey.objects.filter(user_id=user_id, token=token).update(
+                response={'url': respuesta.url, 'mensajes': grabadora.mensajes}
+            )
+        else:
+            # Sin redirección no hay qué repetir: el reenvío se procesa como nuevo
+            _soltar(user_id, token)
+        return respuesta
+    return envoltura
@@ -0,0 +1,182 @@
+"""
+Disponibilidad precalculada (AvailabilitySnapshot): una fila por (fecha, sala)
+con el estado de cada bloque no disponible.
+
+El grid lee un día completo de todas las salas con una sola consulta por rango
+del índice (fecha, sala), en vez de revisar reservas y bloqueos celda por celda.
+
+Las filas se mantienen al escribir:
+
+- signals.py recalcula la (sala, fecha) afectada al guardar o borrar una
+  Reservation o un RoomUnavailability, dentro de la misma transacción.
+- Los UPDATE masivos (completar_reservas) llaman a `recalcular_pares`.
+- `reconstruir` las rehace en bloque (comando actualizar_disponibilidad,
+  generar_datos y la migración que crea la tabla).
+
+Solo se guardan fechas desde hoy: las pasadas no se muestran en el grid.
+"""
+import contextlib
+import contextvars
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ACTIVE_STATUSES, AvailabilitySnapshot, Reservation, RoomUnavailability
+
+
+# Estado del grid por código guardado
+ESTADOS = {
+    AvailabilitySnapshot.RESERVED: 'reservado',
+    AvailabilitySnapshot.BLOCKED: 'bloqueado',
+}
+
+# set de (sala, fecha) pendientes mientras se está dentro de diferir()
+_diferidos = contextvars.ContextVar('instantaneas_diferidas', default=None)
+
+
+def calcular(room_id, fecha):
+    """Estados de los bloques no disponibles de la sala en la fecha, desde las tablas originales"""
+    # Sin el orden por defecto de los modelos (JOIN a bloques y salas): el orden no importa
+    estados = {}
+    reservados = Reservation.objects.filter(
+        room_id=room_id,
+        date=fecha,
+        status__in=ACTIVE_STATUSES,
+    ).order_by().values_list('time_block_id', flat=True)
+    for bloque_id in reservados:
+        estados[str(bloque_id)] = AvailabilitySnapshot.RESERVED
+
+    # Un bloqueo gana sobre una reserva, igual que en el grid
+    bloqueados = RoomUnavailability.objects.filter(
+        room_id=room_id,
+        date=fecha,
+    ).order_by().values_list('time_block_id', flat=True)
+    for bloque_id in bloqueados:
+        clave = AvailabilitySnapshot.WHOLE_DAY if bloque_id is None else str(bloque_id)
+        estados[clave] = AvailabilitySnapshot.BLOCKED
+    return estados
+
+
+def recalcular(room_id, fecha):
+    """
+    Actualiza la fila de (sala, fecha) dentro de la transacción en curso.
+
+    La fila se bloquea antes de leer las reservas: si dos transacciones tocan
+    la misma sala y fecha, la segunda espera y calcula con lo que dejó la primera.
+    Si no hay fila y todo está disponible no se crea ninguna.
+    """
+    if fecha < timezone.localdate():
+        return
+    filas = AvailabilitySnapshot.objects.select_for_update().filter(room_id=room_id, date=fecha)
+    with transaction.atomic():
+        instantanea = filas.first()
+        estados = calcular(room_id, fecha)
+        if instantanea is None:
+            if not estados:
+                return
+            try:
+                with transaction.atomic():
+                    AvailabilitySnapshot.objects.create(room_id=room_id, date=fecha, states=estados)
+                return
+            except IntegrityError:
+                # Otra transacción la creó primero: se espera su commit y se recalcula
+                instantanea = filas.get()
+                estados = calcular(room_id, fecha)
+        if estados != instantanea.states:
+            instantanea.states = estados
+            instantanea.save(update_fields=['states', 'updated_at'])
+
+
+def programar(room_id, fecha):
+    """Recalcula ahora, o al salir de diferir() si se está dentro de uno"""
+    pendientes = _diferidos.get()
+    if pendientes is not None:
+        pendientes.add((room_id, fecha))
+    else:
+        recalcular(room_id, fecha)
+
+
+def recalcular_pares(pares):
+    for room_id, fecha in sorted(set(pares)):
+        recalcular(room_id, fecha)
+
+
+@contextlib.contextmanager
+def diferir():
+    """
+    Junta los recálculos de las señales y los hace una vez por (sala, fecha)
+    al final; para borrados o cambios de muchas filas a la vez.
+    """
+    if _diferidos.get() is not None:
+        yield
+        return
+    pendientes = set()
+    token = _diferidos.set(pendientes)
+    try:
+        yield
+    finally:
+        _diferidos.reset(token)
+    recalcular_pares(pendientes)
+
+
+def reconstruir(desde=None, hasta=None, lote=1000):
+    """
+    Rehace todas las filas desde `desde` (default: hoy) hasta `hasta` (inclusive,
+    opcional) con dos lecturas por rango. Borra además las filas de fechas pasadas.
+
+    Retorna la cantidad de filas escritas.
+    """
+    desde = max(desde or timezone.localdate(), timezone.localdate())
+    rango = {'date__gte': desde}
+    if hasta:
+        rango['date__lte'] = hasta
+
+    with transaction.atomic():
+        estados = defaultdict(dict)
+        reservados = Reservation.objects.filter(
+            status__in=ACTIVE_STATUSES, **rango
+        ).order_by().values_list('room_id', 'date', 'time_block_id')
+        for room_id, fecha, bloque_id in reservados.iterator(chunk_size=lote):
+            estados[(room_id, fecha)][str(bloque_id)] = AvailabilitySnapshot.RESERVED
+
+        bloqueados = (
+            RoomUnavailability.objects.filter(**rango).order_by().values_list('room_id', 'date', 'time_block_id')
+        )
+        for room_id, fecha, bloque_id in bloqueados.iterator(chunk_size=lote):
+            clave = AvailabilitySnapshot.WHOLE_DAY if bloque_id is None else str(bloque_id)
+            estados[(room_id, fecha)][clave] = AvailabilitySnapshot.BLOCKED
+
+        AvailabilitySnapshot.objects.filter(date__lt=timezone.localdate()).delete()
+        AvailabilitySnapshot.objects.filter(**rango).delete()
+        AvailabilitySnapshot.objects.bulk_create(
+            [
+                AvailabilitySnapshot(room_id=room_id, date=fecha, states=estados_sala)
+                for (room_id, fecha), estados_sala in estados.items()
+            ],
+            batch_size=lote,
+        )
+    return len(estados)
+
+
+def del_dia(fecha):
+    """{room_id: AvailabilitySnapshot} de la fecha, con una sola consulta"""
+    return {
+        instantanea.room_id: instantanea
+        for instantanea in AvailabilitySnapshot.objects.filter(date=fecha)
+    }
+
+
+def del_rango(desde, hasta):
+    """{(room_id, fecha): AvailabilitySnapshot} entre dos fechas (inclusive)"""
+    return {
+        (instantanea.room_id, instantanea.date): instantanea
+        for instantanea in AvailabilitySnapshot.objects.filter(date__range=(desde, hasta))
+    }
+
+
+def estado(instantanea, bloque_id):
+    """'disponible', 'reservado' o 'bloqueado' para el grid"""
+    if instantanea is None:
+        return 'disponible'
+    return ESTADOS.get(instantanea.state_for(bloque_id), 'disponible')
@@ -0,0 +1,136 @@
+"""
+Límite de solicitudes a reservar y cancelar, por usuario y por IP.
+
+Cada usuario e IP tiene un balde de fichas que se rellena completo al comenzar
+cada minuto. Los baldes viven en el caché `default` (cache.add + cache.incr):
+al vaciarse se responde 429 con Retry-After sin que la solicitud llegue a la
+base. Los conteos son aproximados, lo que basta para frenar abusos:
+
+- Con CACHE=locmem cada proceso cuenta por su lado: el límite real es el
+  configurado por la cantidad de workers.
+- Con el caché en archivos, incr() no es atómico: dos solicitudes simultáneas
+  pueden contarse como una.
+
+Con RESERVAS_LIMITES_EN_BD = True los baldes son filas de RequestBucket y el
+conteo es un UPDATE ... SET used = used + 1, exacto entre procesos, a cambio
+de dos transacciones de escritura (IP y usuario) por solicitud; con SQLite eso
+serializa el tráfico, así que solo conviene con PostgreSQL.
+
+El límite de cada usuario (el de su rol o el global) sale del caché.
+
+Configuración en settings:
+
+    RESERVAS_LIMITE_USUARIO_POR_MINUTO  si el rol no define requests_per_minute (None = sin límite)
+    RESERVAS_LIMITE_IP_POR_MINUTO       por dirección IP (None = sin límite)
+    RESERVAS_IP_DESDE_PROXY             tomar la IP de X-Forwarded-For (detrás de un proxy confiable)
+    RESERVAS_LIMITES_EN_BD              contar en la tabla RequestBucket en vez del caché
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse
+
+from . import metricas
+from .cache import datos_de_rol_usuario
+from .models import RequestBucket
+from .transacciones import reintentar_si_bloqueada
+
+
+VENTANA = 60
+
+
+def ip_cliente(request):
+    if getattr(settings, 'RESERVAS_IP_DESDE_PROXY', False):
+        reenviada = request.META.get('HTTP_X_FORWARDED_FOR')
+        if reenviada:
+            # La última la agrega el proxy; las anteriores las puede inventar el cliente
+            return reenviada.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def limite_usuario(user):
+    """Solicitudes por minuto del usuario: la de su rol o la global"""
+    limite = datos_de_rol_usuario(user.pk).get('solicitudes_por_minuto')
+    if limite is None:
+        limite = getattr(settings, 'RESERVAS_LIMITE_USUARIO_POR_MINUTO', None)
+    return limite
+
+
+def _gastar_en_cache(clave, minuto):
+    """Suma una solicitud al balde de `clave` en `minuto` y retorna cuántas lleva"""
+    clave = f'reservas:limite:{clave}:{minuto}'
+    # Vive un poco más que su minuto: el siguiente usa otra clave
+    if cache.add(clave, 1, VENTANA + 10):
+        return 1
+    try:
+        return cache.incr(clave)
+    except ValueError:
+        # Venció entre add() e incr()
+        cache.add(clave, 1, VENTANA + 10)
+        return 1
+
+
+@reintentar_si_bloqueada
+@transaction.atomic
+def _gastar_en_bd(clave, minuto):
+    """Como _gastar_en_cache, con una fila de RequestBucket (exacto entre procesos)"""
+    balde = RequestBucket.objects.filter(key=clave, window=minuto)
+    # La fila queda bloqueada hasta el commit: el SELECT ve exactamente este UPDATE
+    if balde.update(used=F('used') + 1):
+        return balde.values_list('used', flat=True).get()
+    RequestBucket.objects.filter(window__lt=minuto).delete()
+    try:
+        with transaction.atomic():
+            RequestBucket.objects.create(key=clave, window=minuto, used=1)
+        return 1
+    except IntegrityError:
+        # Otra solicitud creó el balde entre el UPDATE y el INSERT
+        balde.update(used=F('used') + 1)
+        return balde.values_list('used', flat=True).get()
+
+
+def consumir(clave, limite):
+    """Gasta una ficha; retorna 0 si alcanzó o los segundos hasta el próximo relleno"""
+    if limite is None:
+        return 0
+    ahora = time.time()
+    gastar = _gastar_en_bd if getattr(settings, 'RESERVAS_LIMITES_EN_BD', False) else _gastar_en_cache
+    if gastar(clave, int(ahora // VENTANA)) <= limite:
+        return 0
+    return max(1, math.ceil(VENTANA - ahora % VENTANA))
+
+
+def limitar(accion, exento=None):
+    """
+    Decorador de vistas: aplica el límite por IP y, con sesión iniciada, el del
+    usuario. Reservar y cancelar comparten el mismo balde. `exento(request)`
+    indica las solicitudes que no gastan fichas.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if exento is not None and exento(request):
+                return vista(request, *args, **kwargs)
+            espera = consumir(
+                f'ip:{ip_cliente(request)}',
+                getattr(settings, 'RESERVAS_LIMITE_IP_POR_MINUTO', None),
+            )
+            if not espera and request.user.is_authenticated:
+                espera = consumir(f'usuario:{request.user.pk}', limite_usuario(request.user))
+            if espera:
+                metricas.incrementar('limite_solicitudes_total', accion=accion)
+                respuesta = HttpResponse(
+                    f'Demasiadas solicitudes. Intenta nuevamente en {espera} segundos.',
+                    status=429,
+                    content_type='text/plain; charset=utf-8',
+                )
+                respuesta['Retry-After'] = str(espera)
+                return respuesta
+            return vista(request, *args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservas.instantaneas import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye la disponibilidad precalculada desde las reservas y bloqueos '
+        '(las señales la mantienen al día; esto es para cargas masivas o para verificar)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=None,
+            help='Solo desde hoy hasta N días adelante (default: todas las fechas futuras)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Filas por lectura y por bulk_create (default: 1000)'
+        )
+
+    def handle(self, *args, **kwargs):
+        hasta = None
+        if kwargs['dias'] is not None:
+            hasta = timezone.localdate() + timedelta(days=kwargs['dias'])
+
+        inicio = time.perf_counter()
+        filas = reconstruir(hasta=hasta, lote=kwargs['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Disponibilidad reconstruida: {filas} filas (sala, fecha) '
+            f'en {(time.perf_counter() - inicio) * 1000:.0f} ms'
+        ))
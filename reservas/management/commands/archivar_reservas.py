@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from reservas.archivo import archivar_reservas, fecha_limite_archivo
+
+
+class Command(BaseCommand):
+    help = 'Mueve las reservas antiguas (y sus materiales) a la tabla de archivo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=None,
+            help='Archivar reservas completadas o canceladas con más de N días de antigüedad, N >= 1 '
+                 '(default: RESERVAS_ARCHIVO_DIAS)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Cantidad de reservas movidas por transacción (default: 500)'
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            limite = fecha_limite_archivo(kwargs['dias'])
+        except ValueError as error:
+            raise CommandError(f'{error} (--dias o RESERVAS_ARCHIVO_DIAS)')
+        self.stdout.write(f'Archivando reservas anteriores al {limite.strftime("%d/%m/%Y")}...')
+
+        total = archivar_reservas(limite, lote=kwargs['lote'])
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Reservas archivadas: {total}'))
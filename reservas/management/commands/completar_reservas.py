@@ -0,0 +1,151 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from reservas import calendario, idempotencia, notificaciones
+from reservas.contadores import ajustar_lote
+from reservas.instantaneas import recalcular_pares
+from reservas.models import Reservation
+
+
+class Command(BaseCommand):
+    help = (
+        'Marca como completadas las reservas confirmadas que ya pasaron y '
+        'cancela las pendientes vencidas, en lotes pequeños; de paso borra '
+        'los tokens de idempotencia vencidos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Cantidad de reservas actualizadas por transacción (default: 1000)'
+        )
+        parser.add_argument(
+            '--pendiente-minutos',
+            type=int,
+            default=30,
+            help='Minutos tras los cuales una reserva pendiente se considera vencida (default: 30)'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=0,
+            help='Si es mayor que 0, repite el barrido cada N segundos (modo worker)'
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0.05,
+            help='Segundos de espera entre lotes para no competir con el tráfico (default: 0.05)'
+        )
+
+    def handle(self, *args, **kwargs):
+        intervalo = kwargs['intervalo']
+
+        while True:
+            self.barrer(kwargs['lote'], kwargs['pendiente_minutos'], kwargs['pausa'])
+            if intervalo <= 0:
+                break
+            time.sleep(intervalo)
+
+    def barrer(self, lote, pendiente_minutos, pausa):
+        """Ejecuta un barrido completo (pendientes vencidas, reservas pasadas y tokens vencidos)"""
+        ahora = timezone.localtime()
+
+        # Bloques ya terminados: días anteriores o bloques de hoy cuya hora fin pasó
+        terminada = (
+            Q(date__lt=ahora.date()) |
+            Q(date=ahora.date(), time_block__end_time__lte=ahora.time())
+        )
+
+        # 1. Pendientes que nunca se confirmaron → canceladas
+        limite_pendiente = ahora - timedelta(minutes=pendiente_minutos)
+        canceladas = self.actualizar_por_lotes(
+            'pending',
+            terminada | Q(created_at__lt=limite_pendiente),
+            nuevo_estado='cancelled',
+            lote=lote,
+            pausa=pausa,
+        )
+
+        # 2. Confirmadas cuyo bloque ya terminó → completadas
+        completadas = self.actualizar_por_lotes(
+            'confirmed',
+            terminada,
+            nuevo_estado='completed',
+            lote=lote,
+            pausa=pausa,
+        )
+
+        # 3. Tokens del formulario de confirmación que ya no pasan la firma
+        tokens = idempotencia.purgar()
+
+        self.stdout.write(self.style.WARNING(f'✗ Pendientes vencidas canceladas: {canceladas}'))
+        self.stdout.write(self.style.SUCCESS(f'✓ Reservas completadas: {completadas}'))
+        self.stdout.write(f'Tokens de idempotencia vencidos borrados: {tokens}')
+
+    def actualizar_por_lotes(self, estado_actual, filtro, nuevo_estado, lote, pausa):
+        """
+        Recorre las reservas por id ascendente y las actualiza en lotes.
+
+        Cada lote es una transacción corta e independiente, así que el comando
+        puede interrumpirse y volver a ejecutarse sin problemas: las reservas
+        ya procesadas dejan de cumplir el filtro.
+        """
+        total = 0
+        ultimo_id = 0
+
+        while True:
+            ids = list(
+                Reservation.objects.filter(filtro, status=estado_actual, pk__gt=ultimo_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:lote]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                # Se repite el filtro de estado por si la reserva cambió
+                # (ej: el usuario la canceló) entre la lectura y el UPDATE;
+                # las filas quedan bloqueadas hasta el final del lote.
+                filas = list(
+                    Reservation.objects.select_for_update()
+                    .filter(pk__in=ids, status=estado_actual)
+                    .values_list('pk', 'user_id', 'date', 'time_block_id', 'room_id')
+                )
+                # update() no actualiza auto_now, por eso se fija updated_at.
+                total += Reservation.objects.filter(
+                    pk__in=[fila[0] for fila in filas],
+                ).update(status=nuevo_estado, updated_at=timezone.now())
+
+                # update() no dispara señales: los contadores por usuario, la
+                # disponibilidad precalculada, los calendarios y los avisos se
+                # hacen aquí
+                # (las completadas mantienen sus minutos en las horas del día)
+                ajustar_lote(
+                    [(user_id, fecha, bloque_id) for _, user_id, fecha, bloque_id, _ in filas],
+                    -1,
+                    con_minutos=nuevo_estado != 'completed',
+                )
+                hoy = timezone.localdate()
+                recalcular_pares([
+                    (sala_id, fecha) for _, _, fecha, _, sala_id in filas if fecha >= hoy
+                ])
+                calendario.invalidar(
+                    {user_id for _, user_id, _, _, _ in filas},
+                    {sala_id for _, _, _, _, sala_id in filas},
+                )
+                if nuevo_estado == 'cancelled':
+                    notificaciones.reservas_canceladas([fila[0] for fila in filas])
+
+            ultimo_id = ids[-1]
+            if pausa:
+                time.sleep(pausa)
+
+        return total
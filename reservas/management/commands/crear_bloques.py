@@ -2,6 +2,24 @@ from django.core.management.base import BaseCommand
 from reservas.models import TimeBlock
 
 
+# Horario estándar (también lo usa generar_datos)
+DIAS_SEMANA = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+
+BLOQUES_LUN_VIE = [
+    {'nombre': 'Bloque 1', 'inicio': '09:00', 'fin': '11:00'},
+    {'nombre': 'Bloque 2', 'inicio': '11:00', 'fin': '13:00'},
+    {'nombre': 'Bloque 3', 'inicio': '13:00', 'fin': '15:00'},
+    {'nombre': 'Bloque 4', 'inicio': '15:00', 'fin': '17:00'},
+    {'nombre': 'Bloque 5', 'inicio': '17:00', 'fin': '19:00'},
+    {'nombre': 'Bloque 6', 'inicio': '19:00', 'fin': '20:00'},
+]
+
+BLOQUES_SABADO = [
+    {'nombre': 'Sábado M1', 'inicio': '10:00', 'fin': '12:00'},
+    {'nombre': 'Sábado M2', 'inicio': '12:00', 'fin': '14:00'},
+]
+
+
 class Command(BaseCommand):
     help = 'Crea los bloques horarios para Lunes-Viernes y Sábados'
 
@@ -16,19 +34,8 @@ class Command(BaseCommand):
         # ========================================
         # Bloques Lunes a Viernes (9am - 8pm)
         # ========================================
-        dias_semana = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
-        
-        bloques_lun_vie = [
-            {'nombre': 'Bloque 1', 'inicio': '09:00', 'fin': '11:00'},
-            {'nombre': 'Bloque 2', 'inicio': '11:00', 'fin': '13:00'},
-            {'nombre': 'Bloque 3', 'inicio': '13:00', 'fin': '15:00'},
-            {'nombre': 'Bloque 4', 'inicio': '15:00', 'fin': '17:00'},
-            {'nombre': 'Bloque 5', 'inicio': '17:00', 'fin': '19:00'},
-            {'nombre': 'Bloque 6', 'inicio': '19:00', 'fin': '20:00'},
-        ]
-
-        for dia in dias_semana:
-            for bloque in bloques_lun_vie:
+        for dia in DIAS_SEMANA:
+            for bloque in BLOQUES_LUN_VIE:
                 TimeBlock.objects.create(
                     name=bloque['nombre'],
                     day_of_week=dia,
@@ -47,12 +54,7 @@ class Command(BaseCommand):
         # ========================================
         # Bloques Sábado (10am - 2pm)
         # ========================================
-        bloques_sabado = [
-            {'nombre': 'Sábado M1', 'inicio': '10:00', 'fin': '12:00'},
-            {'nombre': 'Sábado M2', 'inicio': '12:00', 'fin': '14:00'},
-        ]
-
-        for bloque in bloques_sabado:
+        for bloque in BLOQUES_SABADO:
             TimeBlock.objects.create(
                 name=bloque['nombre'],
                 day_of_week='saturday',
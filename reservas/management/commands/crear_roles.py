@@ -2,50 +2,52 @@ from django.core.management.base import BaseCommand
 from reservas.models import Role
 
 
+# Roles básicos (también los usa generar_datos)
+ROLES_DATA = [
+    {
+        'name': 'estudiante',
+        'display_name': 'Estudiante',
+        'description': 'Estudiante regular de la universidad',
+        'can_reserve': True,
+        'can_reserve_internal_rooms': False,
+        'max_hours_override': None,
+        'priority': 10,
+    },
+    {
+        'name': 'profesor',
+        'display_name': 'Profesor',
+        'description': 'Profesor de la universidad con permisos extendidos',
+        'can_reserve': True,
+        'can_reserve_internal_rooms': False,
+        'max_hours_override': 4,
+        'priority': 20,
+    },
+    {
+        'name': 'personal',
+        'display_name': 'Personal Administrativo',
+        'description': 'Personal administrativo con acceso a salas internas',
+        'can_reserve': True,
+        'can_reserve_internal_rooms': True,
+        'max_hours_override': None,
+        'priority': 30,
+    },
+    {
+        'name': 'administrador',
+        'display_name': 'Administrador',
+        'description': 'Administrador del sistema con acceso completo',
+        'can_reserve': True,
+        'can_reserve_internal_rooms': True,
+        'max_hours_override': None,
+        'priority': 100,
+    },
+]
+
+
 class Command(BaseCommand):
     help = 'Crea los roles básicos del sistema'
 
     def handle(self, *args, **kwargs):
-        roles_data = [
-            {
-                'name': 'estudiante',
-                'display_name': 'Estudiante',
-                'description': 'Estudiante regular de la universidad',
-                'can_reserve': True,
-                'can_reserve_internal_rooms': False,
-                'max_hours_override': None,
-                'priority': 10,
-            },
-            {
-                'name': 'profesor',
-                'display_name': 'Profesor',
-                'description': 'Profesor de la universidad con permisos extendidos',
-                'can_reserve': True,
-                'can_reserve_internal_rooms': False,
-                'max_hours_override': 4,
-                'priority': 20,
-            },
-            {
-                'name': 'personal',
-                'display_name': 'Personal Administrativo',
-                'description': 'Personal administrativo con acceso a salas internas',
-                'can_reserve': True,
-                'can_reserve_internal_rooms': True,
-                'max_hours_override': None,
-                'priority': 30,
-            },
-            {
-                'name': 'administrador',
-                'display_name': 'Administrador',
-                'description': 'Administrador del sistema con acceso completo',
-                'can_reserve': True,
-                'can_reserve_internal_rooms': True,
-                'max_hours_override': None,
-                'priority': 100,
-            },
-        ]
-
-        for role_data in roles_data:
+        for role_data in ROLES_DATA:
             role, created = Role.objects.get_or_create(
                 name=role_data['name'],
                 defaults=role_data
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reservas.notificaciones import enviar_lote, purgar
+
+
+class Command(BaseCommand):
+    help = (
+        'Envía los correos pendientes de la bandeja de salida en lotes, por una '
+        'sola conexión SMTP por lote, reintentando los fallidos con espera exponencial'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=100,
+            help='Correos por lote y por conexión SMTP (default: 100)'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=0,
+            help='Si es mayor que 0, vuelve a revisar la bandeja cada N segundos (modo worker)'
+        )
+        parser.add_argument(
+            '--conservar-dias',
+            type=int,
+            default=30,
+            help='Borra los correos enviados hace más de N días (default: 30)'
+        )
+
+    def handle(self, *args, **kwargs):
+        intervalo = kwargs['intervalo']
+
+        while True:
+            self.vaciar(kwargs['lote'])
+            borrados = purgar(kwargs['conservar_dias'])
+            if borrados:
+                self.stdout.write(f'  Enviados antiguos borrados: {borrados}')
+            if intervalo <= 0:
+                break
+            time.sleep(intervalo)
+
+    def vaciar(self, lote):
+        """Envía lotes hasta que no queden pendientes vencidos"""
+        enviados = reintentos = fallidos = 0
+        while True:
+            resultado = enviar_lote(lote)
+            enviados += resultado[0]
+            reintentos += resultado[1]
+            fallidos += resultado[2]
+            if sum(resultado) < lote:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Correos enviados: {enviados}'))
+        if reintentos:
+            self.stdout.write(self.style.WARNING(f'↻ Se reintentarán más tarde: {reintentos}'))
+        if fallidos:
+            self.stdout.write(self.style.ERROR(f'✗ Fallidos (sin más intentos): {fallidos}'))
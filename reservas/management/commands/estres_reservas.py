@@ -0,0 +1,402 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from reservas.rendimiento import base_de_datos_temporal, percentiles
+
+
+DIAS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Mensajes de reservar → motivo de rechazo
+MOTIVOS = [
+    ('Este horario ya está reservado', 'ocupado'),
+    ('Este horario no está disponible', 'bloqueado'),
+    ('Este bloque no corresponde al día', 'dia_incorrecto'),
+    ('No puedes reservar más de', 'limite_horas'),
+    ('No puedes tener más de', 'limite_activas'),
+    ('No puedes reservar con más de', 'fuera_de_ventana'),
+    ('No puedes reservar en fechas pasadas', 'fecha_pasada'),
+    ('Fecha inválida', 'fecha_invalida'),
+]
+
+
+def clasificar(respuesta):
+    """Traduce la respuesta de reservar a (resultado, motivo)"""
+    if respuesta.status_code >= 500:
+        exc_info = getattr(respuesta, 'exc_info', None)
+        return 'error', exc_info[0].__name__ if exc_info else f'http_{respuesta.status_code}'
+    if respuesta.status_code != 302:
+        return 'error', f'http_{respuesta.status_code}'
+    if respuesta.url == reverse('reservas:mis_reservas'):
+        return 'reservada', None
+    for mensaje in get_messages(respuesta.wsgi_request):
+        for prefijo, motivo in MOTIVOS:
+            if str(mensaje).startswith(prefijo):
+                return 'rechazada', motivo
+    return 'rechazada', 'otro'
+
+
+def simular_sesion(sesion, inicio, reintentos):
+    """
+    Un usuario que recorre su lista de bloques preferidos intentando reservar.
+
+    Si el servidor responde con error (500) vuelve a intentar el mismo bloque
+    con espera exponencial, como lo haría alguien que vuelve a presionar el botón.
+    """
+    from django.contrib.auth.models import User
+
+    cliente = Client(raise_request_exception=False)
+    cliente.force_login(User.objects.get(pk=sesion['user_id']))
+    eventos = []
+
+    # Todos parten al mismo tiempo: se "abre" la ventana de reservas
+    espera = inicio - time.time()
+    if espera > 0:
+        time.sleep(espera)
+
+    try:
+        for sala_id, bloque_id in sesion['preferencias']:
+            url = reverse('reservas:reservar', args=[sala_id, bloque_id, sesion['fecha']])
+            for intento in range(reintentos + 1):
+                t0 = time.perf_counter()
+                respuesta = cliente.post(url)
+                duracion = time.perf_counter() - t0
+                resultado, motivo = clasificar(respuesta)
+                eventos.append({
+                    'resultado': resultado,
+                    'motivo': motivo,
+                    'duracion': duracion,
+                    'reintento': intento > 0,
+                })
+                if resultado != 'error':
+                    break
+                time.sleep(0.01 * 2 ** intento)
+            if resultado == 'reservada' and sesion['se_detiene_al_reservar']:
+                break
+    finally:
+        connection.close()
+
+    return eventos
+
+
+def ejecutar_sesiones(sesiones, hilos, inicio, reintentos):
+    """Corre las sesiones en un pool de hilos (dentro de un proceso)"""
+    eventos = []
+    candado = threading.Lock()
+    pendientes = list(sesiones)
+
+    def trabajador():
+        while True:
+            with candado:
+                if not pendientes:
+                    return
+                sesion = pendientes.pop()
+            resultado = simular_sesion(sesion, inicio, reintentos)
+            with candado:
+                eventos.extend(resultado)
+
+    trabajadores = [threading.Thread(target=trabajador) for _ in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return eventos
+
+
+def proceso_trabajador(argumentos):
+    """Punto de entrada de cada proceso (multiprocessing con spawn)"""
+    import django
+    django.setup()
+
+    nombre_bd, opciones, ajustes, sesiones, hilos, inicio, reintentos = argumentos
+    connections['default'].settings_dict['NAME'] = nombre_bd
+    if opciones is not None:
+        connections['default'].settings_dict['OPTIONS'] = opciones
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    with override_settings(**ajustes):
+        return ejecutar_sesiones(sesiones, hilos, inicio, reintentos)
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula la apertura de la ventana de reservas: muchos usuarios reservando '
+        'los mismos bloques a la vez (hilos y/o procesos)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=200,
+                            help='Usuarios simulados (default: 200)')
+        parser.add_argument('--hilos', type=int, default=16,
+                            help='Hilos por proceso (default: 16)')
+        parser.add_argument('--procesos', type=int, default=0,
+                            help='Procesos adicionales; 0 = solo hilos en este proceso (default: 0)')
+        parser.add_argument('--salas', type=int, default=10,
+                            help='Salas en los datos de prueba (default: 10)')
+        parser.add_argument('--preferencias', type=int, default=5,
+                            help='Bloques que intenta cada usuario (default: 5)')
+        parser.add_argument('--sesiones-por-usuario', type=int, default=2,
+                            help='Sesiones simultáneas por usuario, ej. doble clic o dos pestañas (default: 2)')
+        parser.add_argument('--reintentos', type=int, default=2,
+                            help='Reintentos ante errores del servidor (default: 2)')
+        parser.add_argument('--semilla', type=int, default=42,
+                            help='Semilla aleatoria (default: 42)')
+        parser.add_argument('--sqlite', choices=['desarrollo', 'produccion', 'comparar'],
+                            help='Perfil de SQLite: el de Django por defecto, el de producción '
+                                 '(WAL, pragmas, BEGIN IMMEDIATE) o ambos para comparar '
+                                 '(default: el de settings)')
+        parser.add_argument('--oleada', action='store_true',
+                            help='Activar el modo oleada (asignación por lotes) durante la prueba')
+        parser.add_argument('--salida',
+                            help='Archivo JSON donde guardar los resultados')
+
+    def handle(self, *args, **kwargs):
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        perfiles = {None: None}
+        if kwargs['sqlite']:
+            if connection.vendor != 'sqlite':
+                raise CommandError('--sqlite solo aplica cuando la base de datos es SQLite')
+            perfiles = {
+                'desarrollo': {},
+                'produccion': settings.SQLITE_OPCIONES_PRODUCCION,
+            }
+            if kwargs['sqlite'] != 'comparar':
+                perfiles = {kwargs['sqlite']: perfiles[kwargs['sqlite']]}
+
+        resumenes = {}
+        problemas = []
+        for perfil, opciones in perfiles.items():
+            if perfil:
+                self.stdout.write(self.style.WARNING(f'\n▶ SQLite perfil "{perfil}"'))
+            resumen = self.correr(kwargs, opciones)
+            resumenes[perfil or 'actual'] = resumen
+            problemas += resumen['inconsistencias']
+
+        if len(resumenes) > 1:
+            self.comparar(resumenes)
+
+        if kwargs['salida']:
+            salida = resumenes if len(resumenes) > 1 else next(iter(resumenes.values()))
+            with open(kwargs['salida'], 'w', encoding='utf-8') as archivo:
+                json.dump(salida, archivo, indent=2, ensure_ascii=False)
+
+        if problemas:
+            raise CommandError(f'Se encontraron {len(problemas)} inconsistencia(s)')
+
+    def correr(self, kwargs, opciones=None):
+        """Una corrida completa sobre una base nueva; `opciones` reemplaza OPTIONS de la conexión"""
+        self.rng = random.Random(kwargs['semilla'])
+
+        # SQLite necesita un archivo (no memoria) para compartir la base entre hilos
+        # y procesos; va en un directorio propio, que se lleva también -wal y -shm
+        nombre = directorio = None
+        if connection.vendor == 'sqlite':
+            directorio = tempfile.TemporaryDirectory(prefix='estres_')
+            nombre = os.path.join(directorio.name, 'estres.sqlite3')
+
+        opciones_originales = connection.settings_dict.get('OPTIONS', {})
+        if opciones is not None:
+            connection.settings_dict['OPTIONS'] = opciones
+        # Todas las sesiones salen de la misma IP: sin límite de solicitudes
+        ajustes = {
+            'DEBUG': False, 'ALLOWED_HOSTS': ['testserver'],
+            'RESERVAS_LIMITE_IP_POR_MINUTO': None, 'RESERVAS_LIMITE_USUARIO_POR_MINUTO': None,
+        }
+        if kwargs['oleada']:
+            # La fecha de la prueba es la que recién se abre; el día completo cuenta como oleada
+            ajustes.update(RESERVAS_OLEADA=True, RESERVAS_OLEADA_MINUTOS=24 * 60)
+        try:
+            with override_settings(**ajustes):
+                with base_de_datos_temporal(nombre=nombre) as conexion:
+                    call_command(
+                        'generar_datos', stdout=StringIO(),
+                        usuarios=kwargs['usuarios'], reservas=0, salas=kwargs['salas'],
+                        dias=0, bloqueos=0,
+                    )
+                    fecha, sesiones = self.preparar(kwargs)
+                    nombre_bd = conexion.settings_dict['NAME']
+                    connections.close_all()
+
+                    eventos, duracion = self.ejecutar(nombre_bd, opciones, ajustes, sesiones, kwargs)
+                    problemas = self.verificar(fecha)
+        finally:
+            connection.settings_dict['OPTIONS'] = opciones_originales
+            if directorio:
+                directorio.cleanup()
+
+        return self.informe(eventos, duracion, problemas, kwargs)
+
+    def preparar(self, kwargs):
+        """Arma las sesiones: todos apuntan a la fecha que recién se abre"""
+        from django.contrib.auth.models import User
+        from reservas.models import ReservationRules, Room, TimeBlock
+
+        reglas = ReservationRules.objects.first()
+        fecha = timezone.now().date() + timedelta(days=reglas.max_days_in_advance)
+        while not TimeBlock.objects.filter(day_of_week=DIAS[fecha.weekday()], is_active=True).exists():
+            fecha -= timedelta(days=1)
+
+        salas = list(Room.objects.filter(is_public=True, is_active=True).values_list('pk', flat=True))
+        bloques = list(
+            TimeBlock.objects.filter(day_of_week=DIAS[fecha.weekday()], is_active=True)
+            .order_by('start_time').values_list('pk', flat=True)
+        )
+        # Las primeras salas y bloques del mediodía son los más pedidos
+        bloques_sala = [(s, b) for s in salas for b in bloques]
+        pesos = [
+            1.0 / (salas.index(s) + 1) * (2.0 if 1 <= bloques.index(b) <= 3 else 1.0)
+            for s, b in bloques_sala
+        ]
+
+        sesiones = []
+        for user_id in User.objects.filter(username__startswith='gen_').values_list('pk', flat=True):
+            preferencias = []
+            while len(preferencias) < min(kwargs['preferencias'], len(bloques_sala)):
+                elegido = self.rng.choices(bloques_sala, weights=pesos)[0]
+                if elegido not in preferencias:
+                    preferencias.append(elegido)
+            for numero in range(kwargs['sesiones_por_usuario']):
+                sesiones.append({
+                    'user_id': user_id,
+                    'fecha': fecha.isoformat(),
+                    # Cada sesión extra parte desde otra preferencia (otra pestaña, otro bloque)
+                    'preferencias': preferencias[numero:] + preferencias[:numero],
+                    'se_detiene_al_reservar': True,
+                })
+        self.rng.shuffle(sesiones)
+        return fecha, sesiones
+
+    def ejecutar(self, nombre_bd, opciones, ajustes, sesiones, kwargs):
+        procesos = kwargs['procesos']
+        hilos = kwargs['hilos']
+        reintentos = kwargs['reintentos']
+        inicio = time.time() + (3 if procesos else 0.5)
+
+        if not procesos:
+            eventos = ejecutar_sesiones(sesiones, hilos, inicio, reintentos)
+        else:
+            partes = [sesiones[i::procesos] for i in range(procesos)]
+            contexto = multiprocessing.get_context('spawn')
+            with contexto.Pool(procesos) as pool:
+                resultados = pool.map(
+                    proceso_trabajador,
+                    [(nombre_bd, opciones, ajustes, parte, hilos, inicio, reintentos) for parte in partes],
+                )
+            eventos = [e for resultado in resultados for e in resultado]
+
+        return eventos, time.time() - inicio
+
+    def verificar(self, fecha):
+        """
+        Invariantes: un bloque = una reserva activa; nadie supera su límite
+        diario; los contadores por usuario coinciden con las reservas
+        """
+        from reservas.contadores import reconciliar
+        from reservas.models import Reservation, ReservationRules
+
+        problemas = []
+
+        duplicadas = (
+            Reservation.objects.filter(status__in=['pending', 'confirmed'])
+            .values('room_id', 'date', 'time_block_id')
+            .annotate(n=Count('id')).filter(n__gt=1)
+        )
+        for fila in duplicadas:
+            problemas.append(
+                f'Bloque con {fila["n"]} reservas activas: sala {fila["room_id"]}, '
+                f'{fila["date"]}, bloque {fila["time_block_id"]}'
+            )
+
+        reglas = ReservationRules.objects.first()
+        horas = Counter()
+        maximo = {}
+        activas = Reservation.objects.filter(
+            date=fecha, status__in=['pending', 'confirmed']
+        ).select_related('time_block', 'user__profile__role')
+        for reserva in activas:
+            horas[reserva.user_id] += reserva.time_block.duration_hours()
+            role = reserva.user.profile.role
+            maximo[reserva.user_id] = role.max_hours_override or reglas.max_hours_per_day
+        for user_id, total in horas.items():
+            if total > maximo[user_id]:
+                problemas.append(f'Usuario {user_id} con {total}h reservadas (máximo {maximo[user_id]}h)')
+
+        for user_id, fecha_contador, guardado, real in reconciliar(corregir=False):
+            problemas.append(
+                f'Contador de usuario {user_id} el {fecha_contador}: {guardado} (reservas, minutos), '
+                f'real {real}'
+            )
+
+        return problemas
+
+    def informe(self, eventos, duracion, problemas, kwargs):
+        resultados = Counter(e['resultado'] for e in eventos)
+        motivos = Counter(f'{e["resultado"]}:{e["motivo"]}' for e in eventos if e['motivo'])
+        reintentos = sum(1 for e in eventos if e['reintento'])
+        latencia = percentiles([e['duracion'] for e in eventos])
+        por_segundo = resultados['reservada'] / duracion if duracion else 0
+
+        resumen = {
+            'motor': connection.vendor,
+            'usuarios': kwargs['usuarios'],
+            'procesos': kwargs['procesos'],
+            'hilos': kwargs['hilos'],
+            'oleada': kwargs['oleada'],
+            'solicitudes': len(eventos),
+            'duracion_s': round(duracion, 3),
+            'reservas_por_segundo': round(por_segundo, 2),
+            'resultados': dict(resultados),
+            'motivos': dict(motivos),
+            'reintentos': reintentos,
+            'latencia': latencia,
+            'inconsistencias': problemas,
+        }
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(f'Solicitudes: {len(eventos)} en {duracion:.2f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Reservas: {resultados["reservada"]} ({por_segundo:.1f}/s)'
+        ))
+        self.stdout.write(self.style.WARNING(f'↻ Rechazadas: {resultados["rechazada"]}'))
+        self.stdout.write(self.style.ERROR(f'✗ Errores: {resultados["error"]} (reintentos: {reintentos})'))
+        for motivo, cantidad in motivos.most_common():
+            self.stdout.write(f'   {motivo}: {cantidad}')
+        if latencia:
+            self.stdout.write(
+                f'Latencia: p50={latencia["p50_ms"]}ms p95={latencia["p95_ms"]}ms '
+                f'p99={latencia["p99_ms"]}ms max={latencia["max_ms"]}ms'
+            )
+        for problema in problemas:
+            self.stdout.write(self.style.ERROR(f'✗ {problema}'))
+        if not problemas:
+            self.stdout.write(self.style.SUCCESS('✓ Sin reservas duplicadas, usuarios sobre su límite ni contadores desfasados'))
+        self.stdout.write('='*50)
+        return resumen
+
+    def comparar(self, resumenes):
+        self.stdout.write(f'\n{"Perfil":<12} {"reservas/s":>11} {"errores":>8} {"reintentos":>11} {"p95 ms":>9}')
+        for perfil, resumen in resumenes.items():
+            self.stdout.write(
+                f'{perfil:<12} {resumen["reservas_por_segundo"]:>11} '
+                f'{resumen["resultados"].get("error", 0):>8} {resumen["reintentos"]:>11} '
+                f'{resumen["latencia"].get("p95_ms", 0):>9}'
+            )
@@ -0,0 +1,381 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from reservas.cache import invalidar_todo
+from reservas.contadores import reconciliar
+from reservas.instantaneas import diferir, reconstruir
+from reservas.management.commands.crear_bloques import BLOQUES_LUN_VIE, BLOQUES_SABADO, DIAS_SEMANA
+from reservas.management.commands.crear_roles import ROLES_DATA
+from reservas.models import (
+    Material, Reservation, ReservationRules, Role, Room, RoomUnavailability, TimeBlock, UserProfile,
+)
+
+
+DIAS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Prefijos para identificar (y poder borrar) los datos generados
+PREFIJO_USUARIO = 'gen_'
+PREFIJO_SALA = '[G] '
+PREFIJO_MATERIAL = '[G] '
+
+# Distribución de roles entre los usuarios generados
+PESOS_ROLES = {
+    'estudiante': 85,
+    'profesor': 10,
+    'personal': 4,
+    'administrador': 1,
+}
+
+# Popularidad relativa de los bloques según hora de inicio (mediodía y tarde más pedidos)
+PESOS_HORA = {9: 0.5, 10: 0.7, 11: 1.0, 12: 0.9, 13: 0.9, 15: 1.0, 17: 0.7, 19: 0.3}
+
+MATERIALES = ['Proyector', 'Pizarra', 'Notebook', 'Parlantes', 'Cámara web',
+              'Micrófono', 'Alargador', 'Plumones', 'Televisor', 'Adaptador HDMI']
+
+
+@contextmanager
+def fechas_explicitas(modelo):
+    """Desactiva auto_now/auto_now_add para poder insertar fechas históricas"""
+    campos = [
+        (f, f.auto_now, f.auto_now_add)
+        for f in modelo._meta.concrete_fields
+        if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)
+    ]
+    for campo, _, _ in campos:
+        campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, auto_now, auto_now_add in campos:
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Genera un set de datos sintético (reproducible) para pruebas de carga'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1000,
+                            help='Cantidad de usuarios con perfil (default: 1000)')
+        parser.add_argument('--reservas', type=int, default=20000,
+                            help='Cantidad aproximada de reservas (default: 20000)')
+        parser.add_argument('--salas', type=int, default=20,
+                            help='Cantidad de salas (default: 20)')
+        parser.add_argument('--materiales', type=int, default=len(MATERIALES),
+                            help=f'Cantidad de materiales (default: {len(MATERIALES)})')
+        parser.add_argument('--dias', type=int, default=90,
+                            help='Días de historial hacia atrás (default: 90)')
+        parser.add_argument('--bloqueos', type=float, default=0.01,
+                            help='Fracción de bloques sala/fecha bloqueados (default: 0.01)')
+        parser.add_argument('--semilla', type=int, default=42,
+                            help='Semilla aleatoria, para obtener siempre los mismos datos (default: 42)')
+        parser.add_argument('--lote', type=int, default=5000,
+                            help='Filas por bulk_create (default: 5000)')
+        parser.add_argument('--limpiar', action='store_true',
+                            help='Eliminar antes los datos generados previamente')
+
+    def handle(self, *args, **kwargs):
+        self.rng = random.Random(kwargs['semilla'])
+        self.lote = kwargs['lote']
+
+        if kwargs['limpiar']:
+            self.limpiar()
+        elif User.objects.filter(username__startswith=PREFIJO_USUARIO).exists():
+            raise CommandError('Ya existen datos generados. Usa --limpiar para regenerarlos.')
+
+        inicio = timezone.now()
+
+        roles = self.crear_roles()
+        bloques = self.crear_bloques()
+        reglas = self.crear_reglas()
+        materiales = self.crear_materiales(kwargs['materiales'])
+        salas = self.crear_salas(kwargs['salas'], materiales)
+        usuarios = self.crear_usuarios(kwargs['usuarios'], roles)
+        self.crear_reservas(
+            kwargs['reservas'], kwargs['dias'], kwargs['bloqueos'],
+            reglas, salas, bloques, usuarios,
+        )
+        # bulk_create no dispara las señales que invalidan el caché ni las
+        # que mantienen la disponibilidad precalculada y los contadores
+        invalidar_todo()
+        reconstruir()
+        reconciliar()
+
+        duracion = (timezone.now() - inicio).total_seconds()
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(self.style.SUCCESS(f'🎉 Datos generados en {duracion:.1f}s'))
+        self.stdout.write('='*50)
+
+    # ========================================
+    # Limpieza
+    # ========================================
+    def limpiar(self):
+        # La disponibilidad se reconstruye completa al final
+        with diferir():
+            self._limpiar()
+        self.stdout.write(self.style.WARNING('Datos generados anteriormente eliminados'))
+
+    def _limpiar(self):
+        Reservation.objects.filter(user__username__startswith=PREFIJO_USUARIO).delete()
+        RoomUnavailability.objects.filter(room__name__startswith=PREFIJO_SALA).delete()
+        User.objects.filter(username__startswith=PREFIJO_USUARIO).delete()
+        Room.objects.filter(name__startswith=PREFIJO_SALA).delete()
+        Material.objects.filter(name__startswith=PREFIJO_MATERIAL).delete()
+
+    # ========================================
+    # Catálogos
+    # ========================================
+    def crear_roles(self):
+        for role_data in ROLES_DATA:
+            Role.objects.get_or_create(name=role_data['name'], defaults=role_data)
+        roles = {r.name: r for r in Role.objects.filter(name__in=PESOS_ROLES)}
+        self.stdout.write(self.style.SUCCESS(f'✓ Roles: {len(roles)}'))
+        return roles
+
+    def crear_bloques(self):
+        """Usa el mismo horario que crear_bloques (sin borrar los existentes)"""
+        nuevos = [
+            TimeBlock(name=b['nombre'], day_of_week=dia, start_time=b['inicio'], end_time=b['fin'])
+            for dia in DIAS_SEMANA for b in BLOQUES_LUN_VIE
+        ] + [
+            TimeBlock(name=b['nombre'], day_of_week='saturday', start_time=b['inicio'], end_time=b['fin'])
+            for b in BLOQUES_SABADO
+        ]
+        TimeBlock.objects.bulk_create(nuevos, ignore_conflicts=True)
+
+        # Bloques activos agrupados por día, con su peso de popularidad
+        bloques = {}
+        for bloque in TimeBlock.objects.filter(is_active=True).order_by('start_time'):
+            peso = PESOS_HORA.get(bloque.start_time.hour, 0.5)
+            bloques.setdefault(bloque.day_of_week, []).append((bloque, peso))
+        self.stdout.write(self.style.SUCCESS(f'✓ Bloques: {sum(len(b) for b in bloques.values())}'))
+        return bloques
+
+    def crear_reglas(self):
+        reglas = ReservationRules.objects.first()
+        if not reglas:
+            reglas = ReservationRules.objects.create()
+        return reglas
+
+    def crear_materiales(self, cantidad):
+        Material.objects.bulk_create([
+            Material(name=f'{PREFIJO_MATERIAL}{MATERIALES[i % len(MATERIALES)]} {i + 1}')
+            for i in range(cantidad)
+        ])
+        materiales = list(Material.objects.filter(name__startswith=PREFIJO_MATERIAL))
+        self.stdout.write(self.style.SUCCESS(f'✓ Materiales: {len(materiales)}'))
+        return materiales
+
+    def crear_salas(self, cantidad, materiales):
+        Room.objects.bulk_create([
+            Room(
+                name=f'{PREFIJO_SALA}Sala {i + 1:04d}',
+                capacity=self.rng.choice([4, 6, 8, 10, 20]),
+                location=f'Piso {i % 5 + 1}',
+                # ~10% de salas de uso interno
+                is_public=self.rng.random() > 0.1,
+            )
+            for i in range(cantidad)
+        ])
+        salas = list(Room.objects.filter(name__startswith=PREFIJO_SALA).order_by('name'))
+
+        SalaMaterial = Room.available_materials.through
+        relaciones = []
+        for sala in salas:
+            for material in self.rng.sample(materiales, min(len(materiales), self.rng.randint(0, 3))):
+                relaciones.append(SalaMaterial(room_id=sala.pk, material_id=material.pk))
+        SalaMaterial.objects.bulk_create(relaciones, batch_size=self.lote)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Salas: {len(salas)}'))
+        return salas
+
+    def crear_usuarios(self, cantidad, roles):
+        # Hashear una sola vez: es lo más lento de crear usuarios
+        password = make_password('cambiar123')
+        nombres_roles = list(PESOS_ROLES)
+        pesos_roles = list(PESOS_ROLES.values())
+
+        for desde in range(0, cantidad, self.lote):
+            hasta = min(desde + self.lote, cantidad)
+            with transaction.atomic():
+                User.objects.bulk_create([
+                    User(
+                        username=f'{PREFIJO_USUARIO}{i:07d}',
+                        email=f'{PREFIJO_USUARIO}{i:07d}@example.com',
+                        first_name='Usuario',
+                        last_name=f'{i:07d}',
+                        password=password,
+                    )
+                    for i in range(desde, hasta)
+                ])
+                # Se releen los ids: no todos los motores los devuelven en bulk_create
+                ids = User.objects.filter(
+                    username__gte=f'{PREFIJO_USUARIO}{desde:07d}',
+                    username__lt=f'{PREFIJO_USUARIO}{hasta:07d}',
+                ).order_by('username').values_list('pk', flat=True)
+
+                elegidos = self.rng.choices(nombres_roles, weights=pesos_roles, k=hasta - desde)
+                UserProfile.objects.bulk_create([
+                    UserProfile(user_id=user_id, role=roles[rol], department='Generado')
+                    for user_id, rol in zip(ids, elegidos)
+                ])
+            self.stdout.write(f'  usuarios {hasta}/{cantidad}')
+
+        ids = list(
+            User.objects.filter(username__startswith=PREFIJO_USUARIO)
+            .order_by('username')
+            .values_list('pk', flat=True)
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Usuarios: {len(ids)}'))
+        return ids
+
+    # ========================================
+    # Reservas y bloqueos
+    # ========================================
+    def crear_reservas(self, cantidad, dias, fraccion_bloqueos, reglas, salas, bloques, usuarios):
+        hoy = timezone.now().date()
+        fechas = [hoy - timedelta(days=d) for d in range(dias, 0, -1)]
+        fechas += [hoy + timedelta(days=d) for d in range(0, reglas.max_days_in_advance + 1)]
+
+        # Popularidad de las salas con sesgo tipo Zipf (pocas salas concentran la demanda)
+        orden = list(range(len(salas)))
+        self.rng.shuffle(orden)
+        peso_sala = {salas[pos].pk: 1.0 / (rango + 1) for rango, pos in enumerate(orden)}
+        salas_publicas = [s for s in salas if s.is_public]
+
+        # Escala para que la suma de probabilidades (con tope 1) se acerque a `cantidad`
+        escala = self.calcular_escala(cantidad, fechas, salas_publicas, bloques, peso_sala)
+
+        # Los usuarios también tienen sesgo: algunos reservan mucho más que otros
+        acumulado = []
+        total = 0
+        for i in range(len(usuarios)):
+            total += 1.0 / (i + 1) ** 0.5
+            acumulado.append(total)
+
+        materiales_por_sala = {}
+        for room_id, material_id in Room.available_materials.through.objects.filter(
+            room__in=salas
+        ).values_list('room_id', 'material_id'):
+            materiales_por_sala.setdefault(room_id, []).append(material_id)
+
+        zona = timezone.get_current_timezone()
+        pendientes = []
+        bloqueos = []
+        creadas = 0
+        bloqueadas = 0
+
+        for fecha in fechas:
+            bloques_dia = bloques.get(DIAS[fecha.weekday()], [])
+            usados = set()  # un bloque por usuario por día (respeta las 2h/día)
+
+            for sala in salas_publicas:
+                for bloque, peso in bloques_dia:
+                    if self.rng.random() < fraccion_bloqueos:
+                        bloqueos.append(RoomUnavailability(
+                            room_id=sala.pk, date=fecha, time_block_id=bloque.pk,
+                            reason='Mantenimiento (generado)',
+                        ))
+                        bloqueadas += 1
+                        continue
+
+                    if self.rng.random() >= min(1.0, escala * peso_sala[sala.pk] * peso):
+                        continue
+
+                    user_id = None
+                    for _ in range(5):
+                        candidato = self.rng.choices(usuarios, cum_weights=acumulado)[0]
+                        if candidato not in usados:
+                            user_id = candidato
+                            break
+                    if user_id is None:
+                        continue
+                    usados.add(user_id)
+
+                    if self.rng.random() < 0.1:
+                        estado = 'cancelled'
+                    else:
+                        estado = 'completed' if fecha < hoy else 'confirmed'
+
+                    # Creada entre 0 y max_days_in_advance días antes del bloque
+                    creada = datetime.combine(
+                        fecha - timedelta(days=self.rng.randint(0, reglas.max_days_in_advance)),
+                        bloque.start_time,
+                        tzinfo=zona,
+                    ) - timedelta(hours=self.rng.randint(1, 12))
+
+                    pendientes.append((
+                        Reservation(
+                            user_id=user_id, room_id=sala.pk, date=fecha,
+                            time_block_id=bloque.pk, status=estado,
+                            created_at=creada, updated_at=creada,
+                        ),
+                        self.elegir_materiales(materiales_por_sala.get(sala.pk, [])),
+                    ))
+
+                    if len(pendientes) >= self.lote:
+                        creadas += self.guardar_reservas(pendientes)
+                        pendientes = []
+                        self.stdout.write(f'  reservas {creadas}/~{cantidad}')
+
+            if len(bloqueos) >= self.lote:
+                RoomUnavailability.objects.bulk_create(bloqueos, ignore_conflicts=True)
+                bloqueos = []
+
+        if pendientes:
+            creadas += self.guardar_reservas(pendientes)
+        if bloqueos:
+            RoomUnavailability.objects.bulk_create(bloqueos, ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Reservas: {creadas}'))
+        self.stdout.write(self.style.SUCCESS(f'✓ Bloqueos: {bloqueadas}'))
+
+    def calcular_escala(self, cantidad, fechas, salas, bloques, peso_sala):
+        """Búsqueda binaria del factor que lleva el total esperado a `cantidad`"""
+        pesos = [
+            peso_sala[s.pk] * peso
+            for fecha in fechas
+            for s in salas
+            for _, peso in bloques.get(DIAS[fecha.weekday()], [])
+        ]
+        if not pesos:
+            raise CommandError('No hay salas públicas ni bloques para generar reservas')
+        if cantidad >= len(pesos):
+            self.stdout.write(self.style.WARNING(
+                f'⚠ Solo hay {len(pesos)} bloques sala/fecha: usa más --salas o --dias'
+            ))
+            return float('inf')
+
+        bajo, alto = 0.0, 1.0
+        while sum(min(1.0, alto * p) for p in pesos) < cantidad:
+            alto *= 2
+        for _ in range(30):
+            medio = (bajo + alto) / 2
+            if sum(min(1.0, medio * p) for p in pesos) < cantidad:
+                bajo = medio
+            else:
+                alto = medio
+        return alto
+
+    def elegir_materiales(self, disponibles):
+        # ~20% de las reservas piden algún material de la sala
+        if disponibles and self.rng.random() < 0.2:
+            return [self.rng.choice(disponibles)]
+        return []
+
+    def guardar_reservas(self, pendientes):
+        ReservaMaterial = Reservation.requested_materials.through
+        with transaction.atomic(), fechas_explicitas(Reservation):
+            reservas = Reservation.objects.bulk_create([r for r, _ in pendientes])
+            ReservaMaterial.objects.bulk_create([
+                ReservaMaterial(reservation_id=reserva.pk, material_id=material_id)
+                for reserva, (_, materiales) in zip(reservas, pendientes)
+                for material_id in materiales
+            ])
+        return len(reservas)
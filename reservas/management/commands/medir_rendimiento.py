@@ -0,0 +1,376 @@
+import csv
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from reservas.models import Reservation, Room, RoomUnavailability, TimeBlock
+from reservas.rendimiento import ContadorConsultas, base_de_datos_temporal, percentiles
+
+
+# Tamaños de datos predefinidos (argumentos de generar_datos)
+TAMANOS = {
+    'chico': {'usuarios': 300, 'reservas': 1500, 'salas': 20, 'dias': 30},
+    'mediano': {'usuarios': 5000, 'reservas': 50000, 'salas': 120, 'dias': 180},
+    'grande': {'usuarios': 100000, 'reservas': 1000000, 'salas': 1200, 'dias': 365},
+}
+
+DIAS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Modelos cuyo listado del admin se mide
+ADMIN_CHANGELISTS = ['reservation', 'reservationarchive', 'room', 'material', 'timeblock', 'role', 'userprofile']
+
+
+class Command(BaseCommand):
+    help = 'Mide latencia, consultas y memoria de las vistas principales sobre datos generados'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanos',
+            default='chico',
+            help=f'Tamaños de datos separados por coma: {", ".join(TAMANOS)} (default: chico)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=30,
+            help='Repeticiones por escenario (default: 30)'
+        )
+        parser.add_argument(
+            '--salida',
+            default='benchmark.json',
+            help='Archivo JSON con los resultados (default: benchmark.json)'
+        )
+        parser.add_argument(
+            '--comparar',
+            help='Archivo JSON de una ejecución anterior para detectar regresiones'
+        )
+        parser.add_argument(
+            '--tolerancia',
+            type=float,
+            default=0.25,
+            help='Aumento relativo del p95 tolerado al comparar (default: 0.25 = 25%%)'
+        )
+
+    def handle(self, *args, **kwargs):
+        tamanos = [t.strip() for t in kwargs['tamanos'].split(',') if t.strip()]
+        for tamano in tamanos:
+            if tamano not in TAMANOS:
+                raise CommandError(f'Tamaño desconocido: {tamano}')
+
+        self.repeticiones = kwargs['repeticiones']
+        resultados = {
+            'fecha': timezone.now().isoformat(),
+            'commit': self.commit_actual(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'motor': connection.vendor,
+            'repeticiones': self.repeticiones,
+            'tamanos': {},
+        }
+
+        # DEBUG apagado como en producción (con DEBUG Django guarda cada consulta)
+        # y sin límite de solicitudes (todo sale de la misma IP)
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'],
+                               RESERVAS_LIMITE_IP_POR_MINUTO=None, RESERVAS_LIMITE_USUARIO_POR_MINUTO=None):
+            for tamano in tamanos:
+                self.stdout.write(self.style.WARNING(f'\n▶ Tamaño "{tamano}": {TAMANOS[tamano]}'))
+                with base_de_datos_temporal():
+                    call_command('generar_datos', stdout=StringIO(), **TAMANOS[tamano])
+                    resultados['tamanos'][tamano] = self.medir_todo()
+
+        with open(kwargs['salida'], 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f'\n✓ Resultados guardados en {kwargs["salida"]}'))
+
+        if kwargs['comparar']:
+            self.comparar(resultados, kwargs['comparar'], kwargs['tolerancia'])
+
+    # ========================================
+    # Escenarios
+    # ========================================
+    def medir_todo(self):
+        hoy = timezone.now().date()
+        fecha = hoy + timedelta(days=1)
+        while not TimeBlock.objects.filter(day_of_week=DIAS[fecha.weekday()], is_active=True).exists():
+            fecha += timedelta(days=1)
+
+        admin = User.objects.create_superuser('bench_admin', 'bench@example.com', 'bench')
+        frecuente = (
+            Reservation.objects.values('user').annotate(n=Count('id'))
+            .order_by('-n').values_list('user', flat=True).first()
+        )
+        usuario_frecuente = User.objects.get(pk=frecuente)
+
+        resultados = {}
+
+        cliente = Client()
+        resultados['disponibilidad'] = self.medir(
+            'disponibilidad', cliente, 'get',
+            lambda i: reverse('reservas:disponibilidad') + f'?fecha={fecha.isoformat()}',
+        )
+
+        cliente.force_login(usuario_frecuente)
+        resultados['mis_reservas'] = self.medir(
+            'mis_reservas', cliente, 'get', lambda i: reverse('reservas:mis_reservas'),
+        )
+        resultados['sesiones'] = self.medir_sesiones(usuario_frecuente)
+
+        # Para reservar se necesitan bloques libres y usuarios sin reservas ese día
+        libres = self.bloques_libres(fecha)
+        usuarios = list(
+            User.objects.filter(profile__role__name='estudiante')
+            .exclude(reservations__date=fecha)
+            .order_by('pk')[:len(libres)]
+        )
+        pares = list(zip(usuarios, libres))
+        if len(pares) < self.repeticiones:
+            self.stdout.write(self.style.WARNING(
+                f'⚠ Solo hay {len(pares)} bloques libres para medir reservar/cancelar'
+            ))
+
+        def url_reservar(i):
+            _, (sala_id, bloque_id) = pares[i]
+            return reverse('reservas:reservar', args=[sala_id, bloque_id, fecha.isoformat()])
+
+        resultados['reservar_get'] = self.medir(
+            'reservar (GET)', cliente, 'get', url_reservar, usuarios=pares, total=len(pares),
+        )
+        resultados['reservar_post'] = self.medir(
+            'reservar (POST)', cliente, 'post', url_reservar, usuarios=pares, total=len(pares),
+            memoria=False,
+        )
+
+        creadas = list(
+            Reservation.objects.filter(date=fecha, user__in=[u for u, _ in pares], status='confirmed')
+            .select_related('user').order_by('pk')
+        )
+        resultados['cancelar_reserva'] = self.medir(
+            'cancelar_reserva', cliente, 'post',
+            lambda i: reverse('reservas:cancelar_reserva', args=[creadas[i].pk]),
+            usuarios=[(r.user, None) for r in creadas], total=len(creadas), memoria=False,
+        )
+
+        cliente.force_login(admin)
+        for modelo in ADMIN_CHANGELISTS:
+            resultados[f'admin_{modelo}'] = self.medir(
+                f'admin {modelo}', cliente, 'get',
+                lambda i, modelo=modelo: reverse(f'admin:reservas_{modelo}_changelist'),
+            )
+
+        resultados['cargar_usuarios'] = self.medir_cargar_usuarios()
+        return resultados
+
+    def bloques_libres(self, fecha):
+        ocupados = set(
+            Reservation.objects.filter(date=fecha, status__in=['pending', 'confirmed'])
+            .values_list('room_id', 'time_block_id')
+        )
+        salas_bloqueadas = set(
+            RoomUnavailability.objects.filter(date=fecha, time_block__isnull=True)
+            .values_list('room_id', flat=True)
+        )
+        ocupados |= set(
+            RoomUnavailability.objects.filter(date=fecha, time_block__isnull=False)
+            .values_list('room_id', 'time_block_id')
+        )
+        bloques = TimeBlock.objects.filter(day_of_week=DIAS[fecha.weekday()], is_active=True)
+        return [
+            (sala.pk, bloque.pk)
+            for sala in Room.objects.filter(is_active=True, is_public=True)
+            for bloque in bloques
+            if sala.pk not in salas_bloqueadas and (sala.pk, bloque.pk) not in ocupados
+        ]
+
+    def medir(self, nombre, cliente, metodo, url, usuarios=None, total=None, memoria=True):
+        """
+        Ejecuta una vista `repeticiones` veces y resume latencia, consultas y memoria.
+
+        La memoria se mide aparte con tracemalloc, porque activarlo distorsiona
+        la latencia.
+        """
+        total = min(self.repeticiones, total if total is not None else self.repeticiones)
+        tiempos = []
+        consultas = []
+        errores = 0
+
+        for i in range(total):
+            if usuarios:
+                cliente.force_login(usuarios[i][0])
+            contador = ContadorConsultas()
+            with connection.execute_wrapper(contador):
+                inicio = time.perf_counter()
+                respuesta = getattr(cliente, metodo)(url(i))
+                tiempos.append(time.perf_counter() - inicio)
+            consultas.append(contador.consultas)
+            if respuesta.status_code >= 400:
+                errores += 1
+
+        resumen = percentiles(tiempos)
+        resumen['consultas'] = sorted(consultas)[len(consultas) // 2] if consultas else 0
+        resumen['errores'] = errores
+
+        if memoria and total:
+            tracemalloc.start()
+            picos = []
+            for i in range(min(total, 5)):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                getattr(cliente, metodo)(url(i))
+                picos.append(tracemalloc.get_traced_memory()[1] - base)
+            tracemalloc.stop()
+            resumen['memoria_pico_kb'] = round(max(picos) / 1024, 1)
+
+        self.stdout.write(
+            f'  {nombre:<28} p50={resumen.get("p50_ms", 0):>8.2f}ms '
+            f'p95={resumen.get("p95_ms", 0):>8.2f}ms consultas={resumen["consultas"]:>4} '
+            f'memoria={resumen.get("memoria_pico_kb", "-")}kb errores={errores}'
+        )
+        return resumen
+
+    def medir_sesiones(self, usuario):
+        """
+        Consultas por solicitud con sesiones en la base y mensajes en la sesión
+        (lo que trae Django) frente a la configuración del proyecto, en un
+        recorrido típico: un intento rechazado (deja un mensaje), la página que
+        lo muestra y mis reservas.
+        """
+        configuraciones = {
+            'db': {
+                'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+                'MESSAGE_STORAGE': 'django.contrib.messages.storage.session.SessionStorage',
+            },
+            'proyecto': {
+                'SESSION_ENGINE': settings.SESSION_ENGINE,
+                'MESSAGE_STORAGE': settings.MESSAGE_STORAGE,
+            },
+        }
+        sala = Room.objects.filter(is_active=True).first()
+        bloque = TimeBlock.objects.filter(is_active=True).first()
+        recorrido = [
+            reverse('reservas:reservar', args=[sala.pk, bloque.pk, '2000-01-01']),
+            reverse('reservas:index'),
+            reverse('reservas:mis_reservas'),
+        ]
+
+        resumen = {}
+        for nombre, configuracion in configuraciones.items():
+            with override_settings(**configuracion):
+                cliente = Client()
+                cliente.force_login(usuario)
+                total = ContadorConsultas()
+                de_sesion = ContadorConsultas()
+
+                def separar(execute, sql, params, many, context):
+                    if 'django_session' in sql:
+                        return de_sesion(execute, sql, params, many, context)
+                    return execute(sql, params, many, context)
+
+                solicitudes = 0
+                with connection.execute_wrapper(total), connection.execute_wrapper(separar):
+                    for _ in range(self.repeticiones):
+                        for url in recorrido:
+                            cliente.get(url)
+                            solicitudes += 1
+
+            resumen[nombre] = {
+                'configuracion': configuracion,
+                'consultas_por_solicitud': round(total.consultas / solicitudes, 2),
+                'consultas_sesion_por_solicitud': round(de_sesion.consultas / solicitudes, 2),
+            }
+            self.stdout.write(
+                f'  {"sesiones (" + nombre + ")":<28} consultas/solicitud='
+                f'{resumen[nombre]["consultas_por_solicitud"]:>6} '
+                f'de sesión={resumen[nombre]["consultas_sesion_por_solicitud"]:>5}'
+            )
+
+        resumen['ahorro_por_solicitud'] = round(
+            resumen['db']['consultas_por_solicitud'] - resumen['proyecto']['consultas_por_solicitud'], 2
+        )
+        self.stdout.write(f'  {"sesiones (ahorro)":<28} {resumen["ahorro_por_solicitud"]} consultas por solicitud')
+        return resumen
+
+    def medir_cargar_usuarios(self, filas=20):
+        """Carga un CSV de `filas` usuarios nuevos (el hash de contraseñas domina el tiempo)"""
+        tiempos = []
+        consultas = []
+        for intento in range(3):
+            with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+                writer = csv.writer(archivo)
+                writer.writerow(['username', 'email', 'first_name', 'last_name', 'role', 'department'])
+                for i in range(filas):
+                    writer.writerow([f'csv_{intento}_{i}', f'csv_{intento}_{i}@example.com',
+                                     'Carga', 'CSV', 'estudiante', 'Bench'])
+            try:
+                contador = ContadorConsultas()
+                with connection.execute_wrapper(contador):
+                    inicio = time.perf_counter()
+                    call_command('cargar_usuarios', archivo.name, stdout=StringIO())
+                    tiempos.append(time.perf_counter() - inicio)
+                consultas.append(contador.consultas)
+            finally:
+                os.unlink(archivo.name)
+
+        resumen = percentiles(tiempos)
+        resumen['filas'] = filas
+        resumen['consultas'] = sorted(consultas)[len(consultas) // 2]
+        resumen['errores'] = 0
+        self.stdout.write(
+            f'  {"cargar_usuarios (" + str(filas) + ")":<28} p50={resumen["p50_ms"]:>8.2f}ms '
+            f'consultas={resumen["consultas"]:>4}'
+        )
+        return resumen
+
+    # ========================================
+    # Comparación con una ejecución anterior
+    # ========================================
+    def comparar(self, actuales, ruta, tolerancia):
+        with open(ruta, encoding='utf-8') as archivo:
+            anteriores = json.load(archivo)
+
+        regresiones = []
+        for tamano, escenarios in actuales['tamanos'].items():
+            for escenario, actual in escenarios.items():
+                anterior = anteriores.get('tamanos', {}).get(tamano, {}).get(escenario)
+                if not anterior or 'p95_ms' not in actual:
+                    continue
+                if actual['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+                    regresiones.append(
+                        f'{tamano}/{escenario}: p95 {anterior["p95_ms"]}ms → {actual["p95_ms"]}ms'
+                    )
+                if actual['consultas'] > anterior['consultas']:
+                    regresiones.append(
+                        f'{tamano}/{escenario}: consultas {anterior["consultas"]} → {actual["consultas"]}'
+                    )
+
+        if regresiones:
+            for regresion in regresiones:
+                self.stdout.write(self.style.ERROR(f'✗ {regresion}'))
+            raise CommandError(f'{len(regresiones)} regresión(es) respecto a {ruta}')
+        self.stdout.write(self.style.SUCCESS(f'✓ Sin regresiones respecto a {ruta}'))
+
+    def commit_actual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
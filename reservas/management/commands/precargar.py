@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from reservas.cache import precargar
+
+
+class Command(BaseCommand):
+    help = 'Precarga el caché (reglas, horario, salas) y compila las plantillas, informando el tiempo de cada paso'
+
+    def handle(self, *args, **kwargs):
+        tiempos = precargar()
+        total = tiempos.pop('total')
+        for paso, ms in tiempos.items():
+            self.stdout.write(f'{paso:<12} {ms:>8.2f} ms')
+        self.stdout.write(self.style.SUCCESS(f'✓ Precarga completa en {total:.2f} ms'))
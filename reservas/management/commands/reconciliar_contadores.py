@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservas.contadores import reconciliar
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los contadores por usuario (reservas activas y minutos por día) '
+        'desde las reservas y corrige los desfases'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--desde',
+            type=str,
+            default=None,
+            help='Solo fechas desde esta (AAAA-MM-DD, default: hoy)'
+        )
+        parser.add_argument(
+            '--solo-verificar',
+            action='store_true',
+            help='Reporta las diferencias sin corregirlas'
+        )
+
+    def handle(self, *args, **kwargs):
+        desde = None
+        if kwargs['desde']:
+            try:
+                desde = datetime.strptime(kwargs['desde'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Fecha inválida, use AAAA-MM-DD')
+
+        corregir = not kwargs['solo_verificar']
+        diferencias = reconciliar(desde=desde, corregir=corregir)
+
+        for user_id, fecha, guardado, real in diferencias:
+            self.stdout.write(
+                f'  usuario {user_id} {fecha}: '
+                f'{guardado[0]} reservas / {guardado[1]} min → {real[0]} reservas / {real[1]} min'
+            )
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS('✓ Contadores al día'))
+        elif corregir:
+            self.stdout.write(self.style.SUCCESS(f'✓ Contadores corregidos: {len(diferencias)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'⚠ Contadores con diferencias: {len(diferencias)}'))
@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservas.analitica import ocupacion_por_sala, reconstruir, refrescar
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresca la analítica de utilización (por sala, bloque y día, y por sala y semana) '
+        'con las reservas que cambiaron desde el último refresco'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Rehace las tablas desde cero en vez de refrescar lo que cambió'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Bloques (sala, fecha, bloque) recalculados por transacción (default: 500)'
+        )
+        parser.add_argument(
+            '--informe',
+            type=int,
+            default=0,
+            metavar='SEMANAS',
+            help='Muestra la ocupación por sala de las últimas N semanas'
+        )
+
+    def handle(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        if kwargs['reconstruir']:
+            bloques = reconstruir()
+            accion = 'reconstruida'
+        else:
+            bloques = refrescar(lote=kwargs['lote'])
+            accion = 'refrescada'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Analítica {accion}: {bloques} bloques en {(time.perf_counter() - inicio) * 1000:.0f} ms'
+        ))
+
+        if kwargs['informe']:
+            self.informe(kwargs['informe'])
+
+    def informe(self, semanas):
+        hasta = timezone.localdate()
+        desde = hasta - timedelta(weeks=semanas)
+        inicio = time.perf_counter()
+        filas = ocupacion_por_sala(desde, hasta)
+        duracion = (time.perf_counter() - inicio) * 1000
+
+        self.stdout.write(f'\nOcupación desde {desde} ({semanas} semanas)')
+        self.stdout.write(f'{"Sala":<30} {"Reservas":>9} {"Cancel.":>8} {"Complet.":>9} {"Ocupación":>10}')
+        for fila in sorted(filas, key=lambda f: -f['ocupacion']):
+            self.stdout.write(
+                f'{fila["room__name"][:30]:<30} {fila["reservas"]:>9} {fila["canceladas"]:>8} '
+                f'{fila["completadas"]:>9} {fila["ocupacion"]:>9.1%}'
+            )
+        self.stdout.write(f'({len(filas)} salas en {duracion:.1f} ms)')
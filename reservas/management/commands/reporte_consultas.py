@@ -0,0 +1,118 @@
+import json
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+ORDENES = {
+    'total': lambda g: g['total_ms'],
+    'veces': lambda g: g['veces'],
+    'max': lambda g: g['max_ms'],
+    'media': lambda g: g['media_ms'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Resume el registro de consultas lentas: las N huellas con más tiempo total'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'archivos',
+            nargs='*',
+            help='Archivos de registro (default: RESERVAS_CONSULTAS_LOG)'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Cantidad de consultas a mostrar (default: 20)'
+        )
+        parser.add_argument(
+            '--orden',
+            choices=list(ORDENES),
+            default='total',
+            help='Criterio de orden (default: total)'
+        )
+        parser.add_argument(
+            '--desde',
+            help='Solo entradas desde esta fecha (AAAA-MM-DD)'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Imprimir el resultado como JSON'
+        )
+
+    def handle(self, *args, **kwargs):
+        archivos = kwargs['archivos'] or [getattr(settings, 'RESERVAS_CONSULTAS_LOG')]
+        desde = None
+        if kwargs['desde']:
+            try:
+                desde = datetime.strptime(kwargs['desde'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Fecha inválida, use AAAA-MM-DD')
+
+        grupos, leidas, invalidas = self.agrupar(archivos, desde)
+        ranking = sorted(grupos.values(), key=ORDENES[kwargs['orden']], reverse=True)[:kwargs['top']]
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(ranking, indent=2, ensure_ascii=False))
+            return
+
+        self.stdout.write(f'Entradas leídas: {leidas} ({invalidas} inválidas), huellas distintas: {len(grupos)}\n')
+        for posicion, grupo in enumerate(ranking, 1):
+            self.stdout.write(self.style.WARNING(
+                f'#{posicion}  total≈{grupo["total_ms"]:.1f}ms  veces≈{grupo["veces"]:.0f}  '
+                f'media={grupo["media_ms"]:.1f}ms  max={grupo["max_ms"]:.1f}ms  '
+                f'lentas={grupo["lentas"]}  params={grupo["parametros"]}'
+            ))
+            self.stdout.write(f'    {grupo["huella"]}')
+            for sitio, veces in grupo['sitios']:
+                self.stdout.write(f'    ↳ {sitio or "(fuera de reservas)"} ×{veces}')
+            self.stdout.write('')
+
+    def agrupar(self, archivos, desde):
+        """
+        Agrupa por huella. Los totales se estiman con el peso de cada línea: una
+        consulta de la muestra representa 1/muestreo consultas.
+        """
+        grupos = {}
+        leidas = invalidas = 0
+        for ruta in archivos:
+            try:
+                archivo = open(ruta, encoding='utf-8')
+            except OSError as error:
+                raise CommandError(f'No se pudo abrir {ruta}: {error}')
+            with archivo:
+                for linea in archivo:
+                    try:
+                        entrada = json.loads(linea)
+                        huella = entrada['huella']
+                        duracion = float(entrada['duracion_ms'])
+                    except (ValueError, KeyError, TypeError):
+                        invalidas += 1
+                        continue
+                    if desde and datetime.fromisoformat(entrada['fecha']).astimezone(
+                            timezone.get_current_timezone()).date() < desde:
+                        continue
+                    leidas += 1
+
+                    peso = float(entrada.get('peso', 1))
+                    grupo = grupos.setdefault(huella, {
+                        'huella': huella, 'veces': 0.0, 'total_ms': 0.0, 'max_ms': 0.0,
+                        'lentas': 0, 'parametros': entrada.get('parametros'), 'sitios': Counter(),
+                    })
+                    grupo['veces'] += peso
+                    grupo['total_ms'] += duracion * peso
+                    grupo['max_ms'] = max(grupo['max_ms'], duracion)
+                    if entrada.get('motivo') == 'lenta':
+                        grupo['lentas'] += 1
+                    grupo['sitios'][entrada.get('sitio')] += 1
+
+        for grupo in grupos.values():
+            grupo['media_ms'] = grupo['total_ms'] / grupo['veces'] if grupo['veces'] else 0.0
+            grupo['sitios'] = grupo['sitios'].most_common(3)
+        return grupos, leidas, invalidas
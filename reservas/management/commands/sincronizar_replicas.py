@@ -0,0 +1,51 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copia la base SQLite principal a las réplicas SQLite (para probar el '
+        'enrutamiento de lecturas en local; con PostgreSQL la replicación es del servidor)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=0,
+            help='Si es mayor que 0, repite la copia cada N segundos (simula el atraso de una réplica)'
+        )
+
+    def handle(self, *args, **kwargs):
+        principal = connections['default'].settings_dict
+        if principal['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Solo aplica a SQLite: en PostgreSQL la réplica se alimenta por streaming')
+
+        destinos = [
+            connections[alias].settings_dict['NAME']
+            for alias in getattr(settings, 'RESERVAS_REPLICAS', [])
+        ]
+        if not destinos:
+            raise CommandError('No hay réplicas configuradas (DB_REPLICAS)')
+
+        while True:
+            for destino in destinos:
+                self.copiar(principal['NAME'], destino)
+            if kwargs['intervalo'] <= 0:
+                break
+            time.sleep(kwargs['intervalo'])
+
+    def copiar(self, origen, destino):
+        # API de backup de SQLite: copia consistente aunque haya escrituras en curso
+        inicio = time.perf_counter()
+        with sqlite3.connect(origen) as fuente, sqlite3.connect(destino) as copia:
+            fuente.backup(copia)
+        fuente.close()
+        copia.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {origen} → {destino} ({(time.perf_counter() - inicio) * 1000:.0f} ms)'
+        ))
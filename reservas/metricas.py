@@ -0,0 +1,252 @@
+"""
+Métricas de tráfico en formato Prometheus (endpoint /metrics).
+
+Cada proceso acumula sus métricas en memoria y las vuelca cada poco tiempo a
+un archivo propio dentro de RESERVAS_METRICAS_DIR. Al hacer scrape se suman los
+archivos de todos los procesos (workers de gunicorn, etc.), sin tocar la base
+de datos. Si RESERVAS_METRICAS_DIR es None solo se exponen las del proceso actual.
+
+Los archivos de procesos que ya terminaron no se acumulan: el scrape que los
+encuentra los suma a su propio registro (así los contadores no retroceden) y
+los borra.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# nombre → (tipo, descripción)
+METRICAS = {
+    'reservas_creadas_total': ('counter', 'Reservas creadas'),
+    'reservas_canceladas_total': ('counter', 'Reservas canceladas por el usuario'),
+    'reservas_rechazadas_total': ('counter', 'Intentos de reserva rechazados, por motivo'),
+    'http_solicitudes_total': ('counter', 'Solicitudes atendidas, por vista y código de estado'),
+    'http_latencia_segundos': ('histogram', 'Latencia de las solicitudes, por vista'),
+    'db_consultas_total': ('counter', 'Consultas SQL ejecutadas, por vista'),
+    'db_reintentos_total': ('counter', 'Escrituras reintentadas por base de datos bloqueada'),
+    'limite_solicitudes_total': ('counter', 'Solicitudes rechazadas con 429 por exceder el límite, por acción'),
+    'oleada_lotes_total': ('counter', 'Lotes asignados en modo oleada'),
+    'oleada_solicitudes_total': ('counter', 'Solicitudes de reserva asignadas en modo oleada'),
+    'notificaciones_enviadas_total': ('counter', 'Correos enviados desde la bandeja de salida'),
+    'notificaciones_fallidas_total': ('counter', 'Envíos de correo fallidos, por si fueron definitivos'),
+    'exportaciones_total': ('counter', 'Exportaciones de reservas, por formato'),
+    'cache_consultas_total': ('counter', 'Lecturas de caché, por caché y resultado (acierto/fallo)'),
+}
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted(etiquetas.items()))
+
+
+def _sumar(contadores, histogramas, dato):
+    """Suma un registro serializado a los dict de contadores e histogramas"""
+    for nombre, etiquetas, valor in dato['contadores']:
+        clave = _clave(nombre, etiquetas)
+        contadores[clave] = contadores.get(clave, 0) + valor
+    for nombre, etiquetas, h in dato['histogramas']:
+        clave = _clave(nombre, etiquetas)
+        if clave not in histogramas:
+            histogramas[clave] = {'buckets': list(h['buckets']), 'conteos': [0] * len(h['buckets']),
+                                  'suma': 0.0, 'total': 0}
+        total = histogramas[clave]
+        total['conteos'] = [a + b for a, b in zip(total['conteos'], h['conteos'])]
+        total['suma'] += h['suma']
+        total['total'] += h['total']
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # existe, pero es de otro usuario
+    return True
+
+
+class Registro:
+    """Métricas de un proceso (contadores e histogramas con etiquetas)"""
+
+    def __init__(self, directorio=None, intervalo=1.0):
+        self.pid = os.getpid()
+        self.directorio = Path(directorio) if directorio else None
+        self.intervalo = intervalo
+        self.archivo = None
+        if self.directorio:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            # pid + instante de inicio: un pid reutilizado no pisa el archivo anterior
+            self.archivo = self.directorio / f'{self.pid}-{int(time.time() * 1000)}.json'
+            atexit.register(self.guardar)
+        self._candado = threading.Lock()
+        self._candado_archivo = threading.Lock()
+        self._ultimo_guardado = 0.0
+        self.contadores = {}
+        self.histogramas = {}
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self._candado:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+        self._guardar_si_corresponde()
+
+    def observar(self, nombre, valor, buckets=BUCKETS_LATENCIA, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self._candado:
+            histograma = self.histogramas.get(clave)
+            if histograma is None:
+                histograma = self.histogramas[clave] = {
+                    'buckets': list(buckets), 'conteos': [0] * len(buckets), 'suma': 0.0, 'total': 0,
+                }
+            for i, limite in enumerate(histograma['buckets']):
+                if valor <= limite:
+                    histograma['conteos'][i] += 1
+                    break
+            histograma['suma'] += valor
+            histograma['total'] += 1
+        self._guardar_si_corresponde()
+
+    # ========================================
+    # Persistencia entre procesos
+    # ========================================
+    def _serializar(self):
+        with self._candado:
+            return {
+                'contadores': [[n, dict(e), v] for (n, e), v in self.contadores.items()],
+                'histogramas': [[n, dict(e), dict(h, conteos=list(h['conteos']))]
+                                for (n, e), h in self.histogramas.items()],
+            }
+
+    def _guardar_si_corresponde(self):
+        if self.archivo and time.monotonic() - self._ultimo_guardado >= self.intervalo:
+            self.guardar()
+
+    def guardar(self):
+        if not self.archivo:
+            return
+        with self._candado_archivo:
+            self._ultimo_guardado = time.monotonic()
+            temporal = self.archivo.with_suffix('.tmp')
+            temporal.write_text(json.dumps(self._serializar()), encoding='utf-8')
+            os.replace(temporal, self.archivo)
+
+    def absorber_terminados(self):
+        """
+        Suma a este registro los archivos de procesos que ya no existen y los
+        borra. Cada archivo se toma renombrándolo: si dos procesos hacen scrape
+        a la vez, solo uno lo suma.
+        """
+        if not self.directorio:
+            return
+        absorbidos = []
+        for archivo in self.directorio.glob('*.json'):
+            pid = archivo.stem.partition('-')[0]
+            if archivo == self.archivo or not pid.isdigit() or _proceso_vivo(int(pid)):
+                continue
+            tomado = archivo.with_suffix('.terminado')
+            try:
+                os.rename(archivo, tomado)
+                dato = json.loads(tomado.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue  # lo tomó otro proceso, o quedó a medio escribir
+            with self._candado:
+                _sumar(self.contadores, self.histogramas, dato)
+            absorbidos.append(tomado)
+        if absorbidos:
+            # Primero se guardan los valores sumados, después se borran los originales
+            self.guardar()
+            for tomado in absorbidos:
+                tomado.unlink(missing_ok=True)
+
+    def combinar(self):
+        """Suma las métricas de todos los procesos (incluido el actual, en vivo)"""
+        self.absorber_terminados()
+        datos = [self._serializar()]
+        if self.directorio:
+            for archivo in self.directorio.glob('*.json'):
+                if archivo == self.archivo:
+                    continue
+                try:
+                    datos.append(json.loads(archivo.read_text(encoding='utf-8')))
+                except (OSError, ValueError):
+                    continue  # archivo a medio escribir o borrado
+
+        contadores = {}
+        histogramas = {}
+        for dato in datos:
+            _sumar(contadores, histogramas, dato)
+        return contadores, histogramas
+
+    # ========================================
+    # Formato de texto de Prometheus
+    # ========================================
+    def exportar(self):
+        contadores, histogramas = self.combinar()
+        lineas = []
+
+        for nombre, (tipo, descripcion) in METRICAS.items():
+            lineas.append(f'# HELP {nombre} {descripcion}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            if tipo == 'counter':
+                for (n, etiquetas), valor in sorted(contadores.items()):
+                    if n == nombre:
+                        lineas.append(f'{nombre}{_etiquetas(etiquetas)} {valor}')
+            else:
+                for (n, etiquetas), h in sorted(histogramas.items()):
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, conteo in zip(h['buckets'], h['conteos']):
+                        acumulado += conteo
+                        lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", str(limite)),))} {acumulado}')
+                    lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", "+Inf"),))} {h["total"]}')
+                    lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {h["suma"]}')
+                    lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {h["total"]}')
+
+        return '\n'.join(lineas) + '\n'
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    valores = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in etiquetas
+    )
+    return '{' + valores + '}'
+
+
+_registro = None
+_candado_registro = threading.Lock()
+
+
+def obtener_registro():
+    """Registro del proceso actual (se recrea tras un fork)"""
+    global _registro
+    if _registro is None or _registro.pid != os.getpid():
+        with _candado_registro:
+            if _registro is None or _registro.pid != os.getpid():
+                _registro = Registro(
+                    directorio=getattr(settings, 'RESERVAS_METRICAS_DIR', None),
+                    intervalo=getattr(settings, 'RESERVAS_METRICAS_INTERVALO', 1.0),
+                )
+    return _registro
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    obtener_registro().incrementar(nombre, valor, **etiquetas)
+
+
+def observar(nombre, valor, **etiquetas):
+    obtener_registro().observar(nombre, valor, **etiquetas)
+
+
+def registrar_cache(cache, acierto):
+    """Registra una lectura de caché (para la tasa de aciertos)"""
+    incrementar('cache_consultas_total', cache=cache, resultado='acierto' if acierto else 'fallo')
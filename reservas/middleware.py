@@ -0,0 +1,214 @@
+"""
+Middlewares de instrumentación de la aplicación reservas.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.template import base as template_base
+from django.urls import Resolver404, resolve
+
+from . import metricas
+from .perfil import perfilar
+from .rendimiento import ContadorConsultas
+
+
+logger = logging.getLogger('reservas.rendimiento')
+
+class _Medicion:
+    """Tiempos de la solicitud en curso que se acumulan desde Template.render"""
+    __slots__ = ('contador', 'plantillas', 'bd_en_plantillas')
+
+    def __init__(self, contador):
+        self.contador = contador
+        self.plantillas = 0.0
+        # Consultas de querysets perezosos evaluados durante el render: ya van
+        # en contador.tiempo, no se cuentan dos veces
+        self.bd_en_plantillas = 0.0
+
+
+# Medición de la solicitud en curso (None = no se mide)
+_medicion = contextvars.ContextVar('medicion', default=None)
+_profundidad_plantillas = contextvars.ContextVar('profundidad_plantillas', default=0)
+
+
+def instrumentar_plantillas():
+    """Envuelve Template.render una sola vez para medir el render de plantillas"""
+    if getattr(template_base.Template.render, '_reservas_instrumentado', False):
+        return
+    render_original = template_base.Template.render
+
+    def render(self, context):
+        medicion = _medicion.get()
+        if medicion is None:
+            return render_original(self, context)
+        # Solo se mide la plantilla exterior ({% extends %} e {% include %} van dentro)
+        profundidad = _profundidad_plantillas.get()
+        token = _profundidad_plantillas.set(profundidad + 1)
+        inicio = time.perf_counter()
+        bd_inicio = medicion.contador.tiempo
+        try:
+            return render_original(self, context)
+        finally:
+            _profundidad_plantillas.reset(token)
+            if profundidad == 0:
+                medicion.plantillas += time.perf_counter() - inicio
+                medicion.bd_en_plantillas += medicion.contador.tiempo - bd_inicio
+
+    render._reservas_instrumentado = True
+    template_base.Template.render = render
+
+
+class ServerTimingMiddleware:
+    """
+    Mide cada solicitud: consultas, tiempo en BD, en plantillas y en la vista.
+
+    Agrega la cabecera `Server-Timing` (visible en las herramientas del navegador)
+    y escribe una línea JSON en el logger `reservas.rendimiento` cuando la
+    solicitud supera el umbral. Configuración en settings:
+
+        RESERVAS_TIMING_MUESTREO   fracción de solicitudes medidas (0 a 1)
+        RESERVAS_TIMING_UMBRAL_MS  solo se registran las más lentas que esto
+        RESERVAS_TIMING_CABECERA   agregar o no la cabecera Server-Timing
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.muestreo = getattr(settings, 'RESERVAS_TIMING_MUESTREO', 1.0)
+        self.umbral_ms = getattr(settings, 'RESERVAS_TIMING_UMBRAL_MS', 500)
+        self.cabecera = getattr(settings, 'RESERVAS_TIMING_CABECERA', True)
+        instrumentar_plantillas()
+
+    def __call__(self, request):
+        if self.muestreo < 1 and random.random() >= self.muestreo:
+            return self.get_response(request)
+
+        contador = ContadorConsultas()
+        tiempos = _Medicion(contador)
+        token = _medicion.set(tiempos)
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(contador))
+                response = self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        total = time.perf_counter() - inicio
+
+        # Partes disjuntas que suman el total: BD (también la del render),
+        # plantillas sin sus consultas y el resto (vista, middlewares)
+        plantillas = max(0.0, tiempos.plantillas - tiempos.bd_en_plantillas)
+        medicion = {
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(contador.tiempo * 1000, 2),
+            'consultas': contador.consultas,
+            'plantillas_ms': round(plantillas * 1000, 2),
+            'vista_ms': round(max(0.0, total - contador.tiempo - plantillas) * 1000, 2),
+        }
+
+        if self.cabecera:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={medicion["db_ms"]};desc="{medicion["consultas"]} consultas"',
+                f'tpl;dur={medicion["plantillas_ms"]};desc="Plantillas"',
+                f'vista;dur={medicion["vista_ms"]};desc="Python"',
+                f'total;dur={medicion["total_ms"]}',
+            ])
+
+        if medicion['total_ms'] >= self.umbral_ms:
+            match = getattr(request, 'resolver_match', None)
+            logger.info(json.dumps({
+                'metodo': request.method,
+                'ruta': request.path,
+                'vista': match.view_name if match else None,
+                'estado': response.status_code,
+                **medicion,
+            }))
+
+        return response
+
+
+class MetricasMiddleware:
+    """
+    Alimenta las métricas de /metrics: solicitudes, latencia y consultas por vista.
+
+    Las rutas que no resuelven a una vista se agrupan como "sin_ruta" para no
+    crear una serie por cada URL inventada.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        contador = ContadorConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(contador))
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        match = getattr(request, 'resolver_match', None)
+        vista = match.view_name if match else 'sin_ruta'
+        if vista == 'metricas':
+            return response
+
+        metricas.observar('http_latencia_segundos', duracion, vista=vista)
+        metricas.incrementar('http_solicitudes_total', vista=vista, estado=response.status_code)
+        if contador.consultas:
+            metricas.incrementar('db_consultas_total', contador.consultas, vista=vista)
+        return response
+
+
+class PerfilMiddleware:
+    """
+    Perfilado bajo demanda para usuarios staff.
+
+    Agregando `?_profile=1` a cualquier URL de reservas o del admin, la vista se
+    ejecuta bajo cProfile registrando cada consulta SQL, y en lugar de la página
+    se devuelve el informe (funciones más costosas, consultas con sus tiempos y
+    consultas repetidas). El informe queda guardado en RESERVAS_PERFIL_DIR.
+
+    Debe ir después de AuthenticationMiddleware.
+    """
+    PARAMETRO = '_profile'
+    NAMESPACES = {'reservas', 'admin'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.corresponde(request):
+            return self.get_response(request)
+
+        # Se quita el parámetro para que la vista no lo vea (el admin lo
+        # interpretaría como un filtro del listado)
+        request.GET = request.GET.copy()
+        del request.GET[self.PARAMETRO]
+        request.META['QUERY_STRING'] = request.GET.urlencode()
+
+        response, perfil = perfilar(f'{request.method} {request.path}', self.get_response, request)
+        archivos = perfil.guardar()
+        logger.info('Perfil de %s guardado en %s', request.path, archivos[0].with_suffix(''))
+
+        informe = HttpResponse(perfil.html(archivos=archivos))
+        informe['X-Perfil-Estado'] = response.status_code
+        return informe
+
+    def corresponde(self, request):
+        if not request.GET.get(self.PARAMETRO):
+            return False
+        user = getattr(request, 'user', None)
+        if not (user and user.is_staff):
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return bool(self.NAMESPACES.intersection(match.namespaces))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0005_reservation_reserva_activa_unica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('confirmed', 'Confirmada'), ('cancelled', 'Cancelada'), ('completed', 'Completada')], max_length=20, verbose_name='Estado')),
+                ('notes', models.TextField(blank=True, verbose_name='Notas adicionales')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Archivada el')),
+                ('requested_materials', models.ManyToManyField(blank=True, related_name='archived_reservations', to='reservas.material', verbose_name='Materiales solicitados')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to='reservas.room', verbose_name='Sala')),
+                ('time_block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservas.timeblock', verbose_name='Bloque horario')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Reserva archivada',
+                'verbose_name_plural': 'Reservas archivadas',
+                'ordering': ['-date', 'time_block'],
+                'indexes': [models.Index(fields=['user', 'date'], name='reserva_archivo_user_idx')],
+            },
+        ),
+    ]
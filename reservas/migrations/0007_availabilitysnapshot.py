@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def construir(apps, schema_editor):
+    """Disponibilidad de las reservas y bloqueos existentes desde hoy"""
+    Reservation = apps.get_model('reservas', 'Reservation')
+    RoomUnavailability = apps.get_model('reservas', 'RoomUnavailability')
+    AvailabilitySnapshot = apps.get_model('reservas', 'AvailabilitySnapshot')
+
+    hoy = timezone.localdate()
+    estados = {}
+    reservados = Reservation.objects.filter(
+        date__gte=hoy, status__in=['pending', 'confirmed'],
+    ).values_list('room_id', 'date', 'time_block_id')
+    for room_id, fecha, bloque_id in reservados.iterator():
+        estados.setdefault((room_id, fecha), {})[str(bloque_id)] = 'R'
+    bloqueados = RoomUnavailability.objects.filter(date__gte=hoy).values_list('room_id', 'date', 'time_block_id')
+    for room_id, fecha, bloque_id in bloqueados.iterator():
+        estados.setdefault((room_id, fecha), {})['*' if bloque_id is None else str(bloque_id)] = 'B'
+
+    AvailabilitySnapshot.objects.bulk_create(
+        [AvailabilitySnapshot(room_id=room_id, date=fecha, states=e) for (room_id, fecha), e in estados.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0006_reservationarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilitySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('states', models.JSONField(blank=True, default=dict, help_text='{"<id de bloque>": "R" | "B", "*": "B"} solo con los bloques no disponibles', verbose_name='Estados por bloque')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_snapshots', to='reservas.room', verbose_name='Sala')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad precalculada',
+                'verbose_name_plural': 'Disponibilidad precalculada',
+                'constraints': [models.UniqueConstraint(fields=('date', 'room'), name='disponibilidad_fecha_sala')],
+            },
+        ),
+        migrations.RunPython(construir, migrations.RunPython.noop),
+    ]
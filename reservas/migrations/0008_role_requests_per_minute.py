@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0007_availabilitysnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='requests_per_minute',
+            field=models.PositiveIntegerField(blank=True, help_text='Máximo de solicitudes a reservar/cancelar por minuto de cada usuario. Deja vacío para usar el límite global.', null=True, verbose_name='Solicitudes de reserva por minuto (opcional)'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def construir(apps, schema_editor):
+    """Contadores de las reservas existentes desde hoy (las completadas solo suman minutos)"""
+    Reservation = apps.get_model('reservas', 'Reservation')
+    TimeBlock = apps.get_model('reservas', 'TimeBlock')
+    ReservationCounter = apps.get_model('reservas', 'ReservationCounter')
+
+    # Los modelos históricos no tienen duration_hours()
+    minutos = {}
+    for bloque_id, inicio, fin in TimeBlock.objects.values_list('id', 'start_time', 'end_time'):
+        minutos[bloque_id] = (fin.hour * 60 + fin.minute) - (inicio.hour * 60 + inicio.minute)
+
+    totales = {}
+    reservas = (
+        Reservation.objects.filter(date__gte=timezone.localdate(), status__in=['pending', 'confirmed', 'completed'])
+        .values('user_id', 'date', 'time_block_id', 'status')
+        .annotate(n=Count('id'))
+        .values_list('user_id', 'date', 'time_block_id', 'status', 'n')
+    )
+    for user_id, fecha, bloque_id, estado, n in reservas.iterator():
+        total = totales.setdefault((user_id, fecha), [0, 0])
+        if estado != 'completed':
+            total[0] += n
+        total[1] += n * minutos[bloque_id]
+
+    ReservationCounter.objects.bulk_create(
+        [
+            ReservationCounter(user_id=user_id, date=fecha, active_reservations=reservas, reserved_minutes=m)
+            for (user_id, fecha), (reservas, m) in totales.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0008_role_requests_per_minute'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('active_reservations', models.IntegerField(default=0, verbose_name='Reservas activas')),
+                ('reserved_minutes', models.IntegerField(default=0, verbose_name='Minutos reservados')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_counters', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Contador de reservas',
+                'verbose_name_plural': 'Contadores de reservas',
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='contador_usuario_fecha')],
+            },
+        ),
+        migrations.RunPython(construir, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0009_reservationcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Resumen')),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True, verbose_name='Marca')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Marca de refresco',
+                'verbose_name_plural': 'Marcas de refresco',
+            },
+        ),
+        migrations.CreateModel(
+            name='UtilizationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('bookings', models.PositiveIntegerField(default=0, verbose_name='Reservas')),
+                ('cancelled', models.PositiveIntegerField(default=0, verbose_name='Canceladas')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='Completadas')),
+                ('active', models.PositiveIntegerField(default=0, verbose_name='Activas')),
+                ('occupied', models.BooleanField(default=False, help_text='Con una reserva activa o completada', verbose_name='Ocupado')),
+                ('pending_refresh', models.BooleanField(default=False, help_text='Se borró una reserva del bloque (el refresco por updated_at no lo vería)', verbose_name='Pendiente de recalcular')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Utilización por bloque',
+                'verbose_name_plural': 'Utilización por bloque',
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyUtilization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField(help_text='Lunes de la semana', verbose_name='Semana')),
+                ('bookings', models.PositiveIntegerField(default=0, verbose_name='Reservas')),
+                ('cancelled', models.PositiveIntegerField(default=0, verbose_name='Canceladas')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='Completadas')),
+                ('occupied_slots', models.PositiveIntegerField(default=0, verbose_name='Bloques ocupados')),
+                ('offered_slots', models.PositiveIntegerField(default=0, help_text='Bloques activos del horario en la semana', verbose_name='Bloques ofrecidos')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Utilización semanal',
+                'verbose_name_plural': 'Utilización semanal',
+                'ordering': ['-week', 'room'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['updated_at'], name='reserva_actualizada_idx'),
+        ),
+        migrations.AddField(
+            model_name='utilizationsummary',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='utilization_summaries', to='reservas.room', verbose_name='Sala'),
+        ),
+        migrations.AddField(
+            model_name='utilizationsummary',
+            name='time_block',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservas.timeblock', verbose_name='Bloque horario'),
+        ),
+        migrations.AddField(
+            model_name='weeklyutilization',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_utilizations', to='reservas.room', verbose_name='Sala'),
+        ),
+        migrations.AddIndex(
+            model_name='utilizationsummary',
+            index=models.Index(condition=models.Q(('pending_refresh', True)), fields=['pending_refresh'], name='utilizacion_pendiente_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='utilizationsummary',
+            constraint=models.UniqueConstraint(fields=('room', 'date', 'time_block'), name='utilizacion_sala_fecha_bloque'),
+        ),
+        migrations.AddConstraint(
+            model_name='weeklyutilization',
+            constraint=models.UniqueConstraint(fields=('week', 'room'), name='utilizacion_semana_sala'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0010_utilizationsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('reserva_confirmada', 'Reserva confirmada'), ('reserva_cancelada', 'Reserva cancelada'), ('sala_bloqueada', 'Sala bloqueada')], max_length=30, verbose_name='Evento')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='Destinatario')),
+                ('subject', models.CharField(max_length=200, verbose_name='Asunto')),
+                ('body', models.TextField(verbose_name='Mensaje')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('sent', 'Enviado'), ('failed', 'Fallido')], default='pending', max_length=10, verbose_name='Estado')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Intentos')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Próximo intento')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Enviado el')),
+            ],
+            options={
+                'verbose_name': 'Notificación',
+                'verbose_name_plural': 'Notificaciones',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='notificacion_pendiente_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0011_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='usuario:<id> o ip:<dirección>', max_length=100, verbose_name='Clave')),
+                ('window', models.BigIntegerField(help_text='Minutos desde 1970', verbose_name='Minuto')),
+                ('used', models.PositiveIntegerField(default=0, verbose_name='Solicitudes')),
+            ],
+            options={
+                'verbose_name': 'Balde de solicitudes',
+                'verbose_name_plural': 'Baldes de solicitudes',
+                'indexes': [models.Index(fields=['window'], name='balde_minuto_idx')],
+                'constraints': [models.UniqueConstraint(fields=('key', 'window'), name='balde_clave_minuto')],
+            },
+        ),
+    ]
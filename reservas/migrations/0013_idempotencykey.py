@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-19 06:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0012_requestbucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, verbose_name='Token')),
+                ('response', models.JSONField(blank=True, help_text='Redirección y mensajes del primer envío (vacía mientras está en curso)', null=True, verbose_name='Respuesta')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Token de idempotencia',
+                'verbose_name_plural': 'Tokens de idempotencia',
+                'indexes': [models.Index(fields=['created_at'], name='idempotencia_creado_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'token'), name='idempotencia_usuario_token')],
+            },
+        ),
+    ]
@@ -250,6 +250,12 @@ class Role(models.Model):
         verbose_name="Horas máximas por día (opcional)",
         help_text="Deja vacío para usar la regla global. Si defines un valor, sobrescribe la regla global para este rol."
     )
+    requests_per_minute = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Solicitudes de reserva por minuto (opcional)",
+        help_text="Máximo de solicitudes a reservar/cancelar por minuto de cada usuario. Deja vacío para usar el límite global."
+    )
     priority = models.PositiveIntegerField(
         default=0,
         verbose_name="Prioridad",
@@ -321,11 +327,16 @@ class UserProfile(models.Model):
         if self.role.max_hours_override:
             return self.role.max_hours_override
         
-        rules = ReservationRules.objects.first()
+        from .cache import obtener_reglas
+        rules = obtener_reglas()
         return rules.max_hours_per_day if rules else 2
 # ========================================
 # MODELO: Reservation (Reserva)
 # ========================================
+# Estados que ocupan el bloque (el resto es historial)
+ACTIVE_STATUSES = ['pending', 'confirmed']
+
+
 class Reservation(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pendiente'),
@@ -380,8 +391,28 @@ class Reservation(models.Model):
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
         ordering = ['-date', 'time_block']
-        unique_together = ['room', 'date', 'time_block', 'status']
-        # Evitar reservas duplicadas activas para la misma sala/fecha/bloque
+        constraints = [
+            # Evitar reservas duplicadas activas para la misma sala/fecha/bloque
+            # (las canceladas/completadas pueden repetirse sin conflicto)
+            models.UniqueConstraint(
+                fields=['room', 'date', 'time_block'],
+                condition=models.Q(status__in=ACTIVE_STATUSES),
+                name='reserva_activa_unica',
+            ),
+        ]
+        indexes = [
+            # Índice parcial: solo cubre las reservas activas (pendientes/confirmadas)
+            models.Index(
+                fields=['date'],
+                condition=models.Q(status__in=ACTIVE_STATUSES),
+                name='reserva_activa_fecha_idx',
+            ),
+            # Refresco incremental de la analítica (ver reservas/analitica.py)
+            models.Index(fields=['updated_at'], name='reserva_actualizada_idx'),
+            # Versión de los calendarios por usuario y por sala (ver reservas/calendario.py)
+            models.Index(fields=['user', 'date'], name='reserva_usuario_fecha_idx'),
+            models.Index(fields=['room', 'date'], name='reserva_sala_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.room.name} - {self.date} ({self.time_block})"
@@ -401,4 +432,362 @@ class Reservation(models.Model):
         """Verifica si la reserva es del pasado"""
         from datetime import datetime
         reservation_datetime = datetime.combine(self.date, self.time_block.start_time)
-        return reservation_datetime < timezone.now()
\ No newline at end of file
+        return reservation_datetime < timezone.now()
+
+# ========================================
+# MODELO: ReservationArchive (Reservas Archivadas)
+# ========================================
+# Historial antiguo movido fuera de la tabla de reservas (ver reservas/archivo.py)
+class ReservationArchive(models.Model):
+    # Se conserva el id original de la reserva
+    id = models.BigIntegerField(primary_key=True)
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Usuario",
+        related_name="archived_reservations"
+    )
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        verbose_name="Sala",
+        related_name="archived_reservations"
+    )
+    date = models.DateField(verbose_name="Fecha")
+    time_block = models.ForeignKey(
+        TimeBlock,
+        on_delete=models.CASCADE,
+        verbose_name="Bloque horario"
+    )
+    requested_materials = models.ManyToManyField(
+        Material,
+        blank=True,
+        verbose_name="Materiales solicitados",
+        related_name="archived_reservations"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Reservation.STATUS_CHOICES,
+        verbose_name="Estado"
+    )
+    notes = models.TextField(
+        blank=True,
+        verbose_name="Notas adicionales"
+    )
+
+    # Fechas originales de la reserva
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Archivada el")
+
+    class Meta:
+        verbose_name = "Reserva archivada"
+        verbose_name_plural = "Reservas archivadas"
+        ordering = ['-date', 'time_block']
+        indexes = [
+            models.Index(fields=['user', 'date'], name='reserva_archivo_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.room.name} - {self.date} ({self.time_block})"
+
+
+# ========================================
+# MODELO: AvailabilitySnapshot (Disponibilidad precalculada)
+# ========================================
+# Una fila por (fecha, sala) con el estado de los bloques ocupados; la
+# mantienen las señales de Reservation/RoomUnavailability (ver reservas/instantaneas.py)
+class AvailabilitySnapshot(models.Model):
+    # Códigos de estado por bloque (los bloques ausentes están disponibles)
+    RESERVED = 'R'
+    BLOCKED = 'B'
+    # Clave de `states` para un bloqueo de todo el día
+    WHOLE_DAY = '*'
+
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        verbose_name="Sala",
+        related_name="availability_snapshots"
+    )
+    date = models.DateField(verbose_name="Fecha")
+    states = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Estados por bloque",
+        help_text='{"<id de bloque>": "R" | "B", "*": "B"} solo con los bloques no disponibles'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Disponibilidad precalculada"
+        verbose_name_plural = "Disponibilidad precalculada"
+        constraints = [
+            # Fecha primero: el grid lee un día completo con un rango del índice
+            models.UniqueConstraint(fields=['date', 'room'], name='disponibilidad_fecha_sala'),
+        ]
+
+    def __str__(self):
+        return f"{self.room_id} - {self.date}: {self.states}"
+
+    def state_for(self, block_id):
+        """'B' (bloqueado), 'R' (reservado) o None (disponible)"""
+        if self.states.get(self.WHOLE_DAY) == self.BLOCKED:
+            return self.BLOCKED
+        return self.states.get(str(block_id))
+
+
+# ========================================
+# MODELO: ReservationCounter (Contadores por usuario y día)
+# ========================================
+# Reservas activas y minutos reservados (activas y completadas) de cada usuario
+# por fecha, mantenidos con F() al crear, cancelar y completar (ver
+# reservas/contadores.py)
+class ReservationCounter(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Usuario",
+        related_name="reservation_counters"
+    )
+    date = models.DateField(verbose_name="Fecha")
+    active_reservations = models.IntegerField(default=0, verbose_name="Reservas activas")
+    reserved_minutes = models.IntegerField(default=0, verbose_name="Minutos reservados")
+
+    class Meta:
+        verbose_name = "Contador de reservas"
+        verbose_name_plural = "Contadores de reservas"
+        constraints = [
+            # Usuario primero: las reservas activas de la ventana se leen con un rango del índice
+            models.UniqueConstraint(fields=['user', 'date'], name='contador_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.date}: {self.active_reservations} activas, {self.reserved_minutes} min"
+
+
+# ========================================
+# MODELO: UtilizationSummary (Analítica por sala, bloque y día)
+# ========================================
+# Totales por (sala, bloque, fecha) de reservas y archivadas, refrescados en
+# forma incremental desde updated_at (ver reservas/analitica.py)
+class UtilizationSummary(models.Model):
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        verbose_name="Sala",
+        related_name="utilization_summaries"
+    )
+    time_block = models.ForeignKey(
+        TimeBlock,
+        on_delete=models.CASCADE,
+        verbose_name="Bloque horario"
+    )
+    date = models.DateField(verbose_name="Fecha")
+    bookings = models.PositiveIntegerField(default=0, verbose_name="Reservas")
+    cancelled = models.PositiveIntegerField(default=0, verbose_name="Canceladas")
+    completed = models.PositiveIntegerField(default=0, verbose_name="Completadas")
+    active = models.PositiveIntegerField(default=0, verbose_name="Activas")
+    occupied = models.BooleanField(
+        default=False,
+        verbose_name="Ocupado",
+        help_text="Con una reserva activa o completada"
+    )
+    pending_refresh = models.BooleanField(
+        default=False,
+        verbose_name="Pendiente de recalcular",
+        help_text="Se borró una reserva del bloque (el refresco por updated_at no lo vería)"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Utilización por bloque"
+        verbose_name_plural = "Utilización por bloque"
+        constraints = [
+            # Sala primero: los tableros de una sala leen un rango de fechas del índice
+            models.UniqueConstraint(fields=['room', 'date', 'time_block'], name='utilizacion_sala_fecha_bloque'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['pending_refresh'],
+                condition=models.Q(pending_refresh=True),
+                name='utilizacion_pendiente_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.room_id} - {self.date} - {self.time_block_id}: {self.bookings} reservas"
+
+
+# ========================================
+# MODELO: WeeklyUtilization (Analítica por sala y semana)
+# ========================================
+# Suma semanal de UtilizationSummary por sala, para tableros de varios años
+class WeeklyUtilization(models.Model):
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        verbose_name="Sala",
+        related_name="weekly_utilizations"
+    )
+    week = models.DateField(verbose_name="Semana", help_text="Lunes de la semana")
+    bookings = models.PositiveIntegerField(default=0, verbose_name="Reservas")
+    cancelled = models.PositiveIntegerField(default=0, verbose_name="Canceladas")
+    completed = models.PositiveIntegerField(default=0, verbose_name="Completadas")
+    occupied_slots = models.PositiveIntegerField(default=0, verbose_name="Bloques ocupados")
+    offered_slots = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Bloques ofrecidos",
+        help_text="Bloques activos del horario en la semana"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Utilización semanal"
+        verbose_name_plural = "Utilización semanal"
+        ordering = ['-week', 'room']
+        constraints = [
+            # Semana primero: los tableros de todas las salas leen un rango de semanas
+            models.UniqueConstraint(fields=['week', 'room'], name='utilizacion_semana_sala'),
+        ]
+
+    def __str__(self):
+        return f"{self.room_id} - semana del {self.week}: {self.occupied_slots}/{self.offered_slots}"
+
+    def occupancy_ratio(self):
+        """Bloques ocupados / ofrecidos (0 a 1)"""
+        return self.occupied_slots / self.offered_slots if self.offered_slots else 0
+
+
+# ========================================
+# MODELO: SummaryWatermark (Marca de refresco)
+# ========================================
+# Hasta qué updated_at de Reservation se refrescó cada resumen
+class SummaryWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True, verbose_name="Resumen")
+    high_water_mark = models.DateTimeField(null=True, blank=True, verbose_name="Marca")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Marca de refresco"
+        verbose_name_plural = "Marcas de refresco"
+
+    def __str__(self):
+        return f"{self.name}: {self.high_water_mark}"
+
+
+# ========================================
+# MODELO: OutboxMessage (Notificaciones pendientes)
+# ========================================
+# Correos de eventos de reserva escritos en la misma transacción que el evento;
+# los envía el comando enviar_notificaciones (ver reservas/notificaciones.py)
+class OutboxMessage(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (SENT, 'Enviado'),
+        (FAILED, 'Fallido'),
+    ]
+
+    EVENT_CHOICES = [
+        ('reserva_confirmada', 'Reserva confirmada'),
+        ('reserva_cancelada', 'Reserva cancelada'),
+        ('sala_bloqueada', 'Sala bloqueada'),
+    ]
+
+    event = models.CharField(max_length=30, choices=EVENT_CHOICES, verbose_name="Evento")
+    recipient = models.EmailField(verbose_name="Destinatario")
+    subject = models.CharField(max_length=200, verbose_name="Asunto")
+    body = models.TextField(verbose_name="Mensaje")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name="Estado"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Próximo intento")
+    last_error = models.TextField(blank=True, verbose_name="Último error")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Enviado el")
+
+    class Meta:
+        verbose_name = "Notificación"
+        verbose_name_plural = "Notificaciones"
+        ordering = ['-created_at']
+        indexes = [
+            # Índice parcial: el worker solo busca pendientes por próximo intento
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='pending'),
+                name='notificacion_pendiente_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()} → {self.recipient} ({self.get_status_display()})"
+
+
+# ========================================
+# MODELO: RequestBucket (Límite de solicitudes)
+# ========================================
+# Solicitudes a reservar/cancelar de un usuario o IP en un minuto, compartidas
+# por todos los procesos (ver reservas/limites.py)
+class RequestBucket(models.Model):
+    key = models.CharField(max_length=100, verbose_name="Clave", help_text="usuario:<id> o ip:<dirección>")
+    window = models.BigIntegerField(verbose_name="Minuto", help_text="Minutos desde 1970")
+    used = models.PositiveIntegerField(default=0, verbose_name="Solicitudes")
+
+    class Meta:
+        verbose_name = "Balde de solicitudes"
+        verbose_name_plural = "Baldes de solicitudes"
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'window'], name='balde_clave_minuto'),
+        ]
+        indexes = [
+            # Para borrar los minutos que ya pasaron
+            models.Index(fields=['window'], name='balde_minuto_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} @ {self.window}: {self.used}"
+
+
+# ========================================
+# MODELO: IdempotencyKey (Reenvíos del formulario de confirmación)
+# ========================================
+# Token de un solo uso del formulario: el primer envío lo toma con un INSERT
+# (la clave única lo hace atómico) y guarda su respuesta para los reenvíos
+# (ver reservas/idempotencia.py)
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Usuario",
+        related_name="idempotency_keys"
+    )
+    token = models.CharField(max_length=64, verbose_name="Token")
+    response = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="Respuesta",
+        help_text="Redirección y mensajes del primer envío (vacía mientras está en curso)"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Token de idempotencia"
+        verbose_name_plural = "Tokens de idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'token'], name='idempotencia_usuario_token'),
+        ]
+        indexes = [
+            # Para borrar los vencidos
+            models.Index(fields=['created_at'], name='idempotencia_creado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.token}"
@@ -0,0 +1,235 @@
+"""
+Notificaciones por correo de los eventos de reserva, con una bandeja de salida
+(OutboxMessage).
+
+Enviar por SMTP dentro de `reservar`, `cancelar_reserva` o el admin sumaría la
+latencia del servidor de correo a cada solicitud. En vez de eso:
+
+- signals.py encola el mensaje (un INSERT) en la misma transacción que el
+  evento: si la reserva se deshace, el correo también; si se confirma, el
+  correo queda escrito.
+- El comando enviar_notificaciones toma lotes de pendientes, los envía por
+  una sola conexión SMTP y reintenta los que fallan con espera exponencial
+  hasta RESERVAS_NOTIFICACIONES_MAX_INTENTOS.
+
+Cada lote se "reclama" moviendo su próximo intento ARRIENDO hacia adelante en
+una transacción corta, con un UPDATE por mensaje condicionado a que siga
+vencido: dos workers no reclaman el mismo mensaje, también en SQLite. El lote
+se envía fuera de esa transacción (sin bloquear la base mientras habla con el
+servidor de correo). Si el worker muere a mitad de un lote, esos
+mensajes vuelven a quedar disponibles al vencer el arriendo: la entrega es "al
+menos una vez".
+
+Con EMAIL_BACKEND de locmem o de archivos se prueba sin servidor de correo.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metricas
+from .horarios import horario
+from .models import ACTIVE_STATUSES, OutboxMessage, Reservation
+from .transacciones import reintentar_si_bloqueada
+
+
+# Cuánto tiene un worker para enviar un lote reclamado antes de que otro lo retome
+ARRIENDO = timedelta(minutes=5)
+
+
+def _ajuste(nombre, defecto):
+    return getattr(settings, f'RESERVAS_NOTIFICACIONES_{nombre}', defecto)
+
+
+# ========================================
+# Encolado (dentro de la transacción del evento)
+# ========================================
+def _detalle(sala, fecha, bloque_id):
+    bloque = horario().bloque(bloque_id)
+    horas = f' de {bloque.start_time.strftime("%H:%M")} a {bloque.end_time.strftime("%H:%M")}' if bloque else ''
+    return f'{sala} el {fecha.strftime("%d/%m/%Y")}{horas}'
+
+
+def _mensaje(evento, destinatario, asunto, cuerpo):
+    return OutboxMessage(event=evento, recipient=destinatario, subject=asunto, body=cuerpo)
+
+
+def reserva_confirmada(reserva):
+    if not reserva.user.email:
+        return
+    detalle = _detalle(reserva.room.name, reserva.date, reserva.time_block_id)
+    _mensaje(
+        'reserva_confirmada', reserva.user.email,
+        f'Reserva confirmada: {detalle}',
+        f'Hola {reserva.user.get_full_name() or reserva.user.username},\n\n'
+        f'Tu reserva de {detalle} está confirmada.\n'
+        f'Si no la vas a usar, cancélala desde "Mis Reservas" para liberar la sala.\n',
+    ).save()
+
+
+def _cancelada(email, nombre, sala, fecha, bloque_id):
+    detalle = _detalle(sala, fecha, bloque_id)
+    return _mensaje(
+        'reserva_cancelada', email,
+        f'Reserva cancelada: {detalle}',
+        f'Hola {nombre},\n\n'
+        f'Tu reserva de {detalle} fue cancelada.\n',
+    )
+
+
+def reserva_cancelada(reserva):
+    if not reserva.user.email:
+        return
+    _cancelada(
+        reserva.user.email, reserva.user.get_full_name() or reserva.user.username,
+        reserva.room.name, reserva.date, reserva.time_block_id,
+    ).save()
+
+
+def reservas_canceladas(ids):
+    """Avisa las cancelaciones hechas con update() (sin señales), con una consulta"""
+    filas = Reservation.objects.filter(pk__in=ids).exclude(user__email='').values_list(
+        'user__email', 'user__first_name', 'user__last_name', 'user__username',
+        'room__name', 'date', 'time_block_id',
+    )
+    OutboxMessage.objects.bulk_create([
+        _cancelada(email, f'{nombres} {apellidos}'.strip() or usuario, sala, fecha, bloque_id)
+        for email, nombres, apellidos, usuario, sala, fecha, bloque_id in filas
+    ])
+
+
+def sala_bloqueada(bloqueo):
+    """Avisa a quienes tenían reservas activas en la sala y fecha (o bloque) bloqueados"""
+    afectadas = Reservation.objects.filter(
+        room_id=bloqueo.room_id,
+        date=bloqueo.date,
+        status__in=ACTIVE_STATUSES,
+    ).exclude(user__email='')
+    if bloqueo.time_block_id is not None:
+        afectadas = afectadas.filter(time_block_id=bloqueo.time_block_id)
+
+    mensajes = []
+    for user_id, email, nombres, apellidos, usuario, sala, bloque_id in afectadas.values_list(
+        'user_id', 'user__email', 'user__first_name', 'user__last_name', 'user__username',
+        'room__name', 'time_block_id',
+    ):
+        detalle = _detalle(sala, bloqueo.date, bloque_id)
+        motivo = f'Motivo: {bloqueo.reason}\n' if bloqueo.reason else ''
+        mensajes.append(_mensaje(
+            'sala_bloqueada', email,
+            f'Sala no disponible: {detalle}',
+            f'Hola {f"{nombres} {apellidos}".strip() or usuario},\n\n'
+            f'La sala de tu reserva de {detalle} no estará disponible.\n{motivo}'
+            f'Revisa "Mis Reservas" y busca otro horario en la disponibilidad.\n',
+        ))
+    OutboxMessage.objects.bulk_create(mensajes)
+
+
+# ========================================
+# Envío (comando enviar_notificaciones)
+# ========================================
+def espera(intentos):
+    """Espera antes del siguiente intento: exponencial con algo de azar, con tope"""
+    base = _ajuste('ESPERA_SEGUNDOS', 60)
+    tope = _ajuste('ESPERA_MAXIMA_SEGUNDOS', 3600)
+    segundos = min(tope, base * 2 ** (intentos - 1))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+@reintentar_si_bloqueada
+@transaction.atomic
+def _reclamar_ids(lote):
+    ahora = timezone.now()
+    ids = list(
+        OutboxMessage.objects.select_for_update(skip_locked=True)
+        .filter(status=OutboxMessage.PENDING, next_attempt_at__lte=ahora)
+        .order_by('next_attempt_at', 'pk')
+        .values_list('pk', flat=True)[:lote]
+    )
+    return [
+        pk for pk in ids
+        if OutboxMessage.objects.filter(
+            pk=pk, status=OutboxMessage.PENDING, next_attempt_at__lte=ahora,
+        ).update(attempts=F('attempts') + 1, next_attempt_at=ahora + ARRIENDO)
+    ]
+
+
+def reclamar(lote):
+    """
+    Toma hasta `lote` mensajes vencidos y corre su próximo intento ARRIENDO
+    adelante. Retorna solo los que este worker reclamó.
+
+    skip_locked reparte los lotes entre workers en PostgreSQL, pero en SQLite
+    no existe: dos workers pueden leer los mismos ids. Por eso cada mensaje se
+    reclama con un UPDATE condicionado a que siga vencido; si otro worker lo
+    tomó primero, el UPDATE no cambia ninguna fila y el mensaje no se envía.
+    """
+    return list(OutboxMessage.objects.filter(pk__in=_reclamar_ids(lote)).order_by('pk'))
+
+
+def _fallo(mensaje, error):
+    """Programa el reintento o, agotados los intentos, lo marca fallido"""
+    agotado = mensaje.attempts >= _ajuste('MAX_INTENTOS', 5)
+    OutboxMessage.objects.filter(pk=mensaje.pk).update(
+        status=OutboxMessage.FAILED if agotado else OutboxMessage.PENDING,
+        next_attempt_at=timezone.now() + espera(mensaje.attempts),
+        last_error=f'{type(error).__name__}: {error}'[:1000],
+    )
+    metricas.incrementar('notificaciones_fallidas_total', definitivo='si' if agotado else 'no')
+    return agotado
+
+
+def enviar_lote(lote=100):
+    """
+    Envía un lote por una sola conexión. Retorna (enviados, reintentos,
+    fallidos); (0, 0, 0) si no había pendientes.
+    """
+    mensajes = reclamar(lote)
+    if not mensajes:
+        return 0, 0, 0
+
+    remitente = settings.DEFAULT_FROM_EMAIL
+    conexion = get_connection(fail_silently=False)
+    try:
+        conexion.open()
+    except Exception as error:
+        # Sin servidor de correo: todo el lote espera su reintento
+        agotados = sum(_fallo(mensaje, error) for mensaje in mensajes)
+        return 0, len(mensajes) - agotados, agotados
+
+    enviados, reintentos, fallidos = [], 0, 0
+    try:
+        for mensaje in mensajes:
+            correo = EmailMessage(
+                mensaje.subject, mensaje.body, remitente, [mensaje.recipient], connection=conexion,
+            )
+            try:
+                correo.send()
+            except Exception as error:
+                if _fallo(mensaje, error):
+                    fallidos += 1
+                else:
+                    reintentos += 1
+            else:
+                enviados.append(mensaje.pk)
+    finally:
+        conexion.close()
+        OutboxMessage.objects.filter(pk__in=enviados).update(
+            status=OutboxMessage.SENT, sent_at=timezone.now(), last_error='',
+        )
+
+    metricas.incrementar('notificaciones_enviadas_total', len(enviados))
+    return len(enviados), reintentos, fallidos
+
+
+def purgar(dias):
+    """Borra los enviados hace más de `dias` días; retorna cuántos"""
+    borrados, _ = OutboxMessage.objects.filter(
+        status=OutboxMessage.SENT,
+        sent_at__lt=timezone.now() - timedelta(days=dias),
+    ).delete()
+    return borrados
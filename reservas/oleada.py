@@ -0,0 +1,217 @@
+"""
+Modo oleada: asignación por lotes cuando se abre un día nuevo de reservas.
+
+Al pasar la medianoche entra a la ventana (max_days_in_advance) un día nuevo y
+cientos de usuarios piden los mismos bloques a la vez. En vez de que cada
+solicitud valide y compita por su cuenta, durante los primeros
+RESERVAS_OLEADA_MINUTOS los POST a `reservar` de ese día se encolan:
+
+- La primera solicitud que llega a un lote vacío es la "líder": espera
+  RESERVAS_OLEADA_LOTE_MS juntando las demás y asigna el lote completo en
+  una sola transacción: las reglas de validacion.py con un solo `Datos`
+  (tres consultas) para todo el lote.
+- Si varios piden el mismo bloque gana el de rol con mayor `Role.priority`;
+  entre iguales, al azar. Los demás reciben la respuesta al terminar el lote.
+- El proceso recuerda por RECORDAR_SEGUNDOS los bloques que ya vio ocupados o
+  bloqueados y rechaza al instante, sin tocar la base, a quien los pida después.
+- Entre procesos distintos sigue decidiendo la restricción única de la base.
+
+El lote se arma dentro de un proceso, así que sirve con workers de varios
+hilos (gunicorn --threads, ASGI); con workers de un solo hilo cada lote tiene
+una solicitud y se comporta como el flujo normal.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import instantaneas, metricas, validacion
+from .cache import datos_de_rol_usuario, obtener_reglas
+from .models import Reservation
+from .transacciones import reintentar_si_bloqueada
+
+
+# Cuánto se recuerda que un bloque está tomado (si se cancela, vuelve a ofrecerse después)
+RECORDAR_SEGUNDOS = 30
+
+# Rechazos que dependen del bloque y no del usuario: se pueden recordar
+MOTIVOS_DEL_BLOQUE = {'ocupado', 'bloqueado'}
+
+
+def activa(fecha):
+    """La fecha es la que acaba de entrar a la ventana y no pasaron los primeros minutos"""
+    if not getattr(settings, 'RESERVAS_OLEADA', False):
+        return False
+    reglas = obtener_reglas()
+    max_dias = reglas.max_days_in_advance if reglas else 2
+    # La medianoche es la local (TIME_ZONE), no la de UTC
+    ahora = timezone.localtime()
+    minutos = ahora.hour * 60 + ahora.minute
+    return (
+        fecha == ahora.date() + timedelta(days=max_dias)
+        and minutos < getattr(settings, 'RESERVAS_OLEADA_MINUTOS', 10)
+    )
+
+
+class Resultado:
+    """Reserva creada, o el Rechazo de validacion.py"""
+    __slots__ = ('reserva', 'rechazo')
+
+    def __init__(self, reserva=None, rechazo=None):
+        self.reserva = reserva
+        self.rechazo = rechazo
+
+
+class Pedido:
+    """Una solicitud en cola, con lo que necesita para crear la reserva"""
+    __slots__ = ('solicitud', 'notas', 'materiales_ids', 'resultado', 'error', 'listo')
+
+    def __init__(self, solicitud, notas, materiales_ids):
+        self.solicitud = solicitud
+        self.notas = notas
+        self.materiales_ids = materiales_ids
+        self.resultado = None
+        self.error = None
+        self.listo = threading.Event()
+
+    @property
+    def clave(self):
+        return (self.solicitud.sala.pk, self.solicitud.fecha, self.solicitud.bloque.id)
+
+
+class Asignador:
+    """Junta las solicitudes concurrentes del proceso en lotes"""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._pendientes = []
+        self._hay_lider = False
+        # (sala, fecha, bloque) → (Rechazo, instante en que se olvida)
+        self._tomados = {}
+
+    def solicitar(self, pedido):
+        with self._candado:
+            tomado = self._tomados.get(pedido.clave)
+            if tomado and tomado[1] > time.monotonic():
+                return Resultado(rechazo=tomado[0])
+            self._pendientes.append(pedido)
+            lider = not self._hay_lider
+            self._hay_lider = True
+
+        if lider:
+            time.sleep(getattr(settings, 'RESERVAS_OLEADA_LOTE_MS', 25) / 1000)
+            with self._candado:
+                lote, self._pendientes = self._pendientes, []
+                # Lo que llegue desde ahora arma el lote siguiente
+                self._hay_lider = False
+            try:
+                for pendiente, resultado in zip(lote, asignar(lote)):
+                    pendiente.resultado = resultado
+                self._recordar(lote)
+            except Exception as error:
+                for pendiente in lote:
+                    pendiente.error = error
+            finally:
+                for pendiente in lote:
+                    pendiente.listo.set()
+
+        pedido.listo.wait()
+        if pedido.error is not None:
+            raise pedido.error
+        return pedido.resultado
+
+    def _recordar(self, lote):
+        ahora = time.monotonic()
+        with self._candado:
+            self._tomados = {clave: tomado for clave, tomado in self._tomados.items() if tomado[1] > ahora}
+            for pedido in lote:
+                rechazo = pedido.resultado.rechazo
+                if rechazo is None:
+                    # Una reserva creada deja el bloque ocupado
+                    rechazo = validacion.ocupado()
+                elif rechazo.motivo not in MOTIVOS_DEL_BLOQUE:
+                    continue
+                self._tomados[pedido.clave] = (rechazo, ahora + RECORDAR_SEGUNDOS)
+
+
+_asignador = Asignador()
+
+
+def solicitar(solicitud, notas='', materiales_ids=()):
+    """Encola la solicitud (ya validada sin base) y espera el resultado de su lote"""
+    return _asignador.solicitar(Pedido(solicitud, notas, materiales_ids))
+
+
+def asignar(lote):
+    """
+    Asigna un lote de pedidos en una transacción. Retorna un Resultado por
+    pedido, en el mismo orden.
+    """
+    # Fuera de _asignar: si la transacción se reintenta, el lote se cuenta una vez
+    metricas.incrementar('oleada_lotes_total')
+    metricas.incrementar('oleada_solicitudes_total', len(lote))
+    return _asignar(lote)
+
+
+@reintentar_si_bloqueada
+@transaction.atomic
+def _asignar(lote):
+    # Filas de los usuarios bloqueadas (en orden, sin deadlocks) antes de leer
+    # sus contadores, igual que _crear_reserva en las vistas
+    usuarios = sorted({pedido.solicitud.user.pk for pedido in lote})
+    list(User.objects.select_for_update().filter(pk__in=usuarios).order_by('pk').values_list('pk', flat=True))
+
+    datos = validacion.Datos([pedido.solicitud for pedido in lote])
+
+    def prioridad(indice):
+        return datos_de_rol_usuario(lote[indice].solicitud.user.pk).get('prioridad') or 0
+
+    # Candidatos por bloque: mayor prioridad primero; entre iguales, al azar
+    por_bloque = defaultdict(list)
+    for indice, pedido in enumerate(lote):
+        por_bloque[pedido.clave].append(indice)
+
+    resultados = [None] * len(lote)
+    with instantaneas.diferir():
+        for indices in por_bloque.values():
+            random.shuffle(indices)
+            indices.sort(key=lambda i: -prioridad(i))
+
+            for indice in indices:
+                pedido = lote[indice]
+                solicitud = pedido.solicitud
+                # El primero que pasa ocupa el bloque y los demás reciben "ocupado"
+                rechazo = validacion.validar_con_datos(solicitud, datos)
+                if rechazo:
+                    resultados[indice] = Resultado(rechazo=rechazo)
+                    continue
+
+                try:
+                    # Punto de guardado: si otro proceso tomó el bloque solo se
+                    # deshace esta reserva, no el lote
+                    with transaction.atomic():
+                        reserva = Reservation.objects.create(
+                            user=solicitud.user,
+                            room=solicitud.sala,
+                            date=solicitud.fecha,
+                            time_block_id=solicitud.bloque.id,
+                            status='confirmed',
+                            notes=pedido.notas,
+                        )
+                        if pedido.materiales_ids:
+                            reserva.requested_materials.set(pedido.materiales_ids)
+                except IntegrityError:
+                    resultados[indice] = Resultado(rechazo=validacion.ocupado())
+                    datos.ocupados.add(pedido.clave)
+                    continue
+
+                datos.reservar(solicitud)
+                resultados[indice] = Resultado(reserva=reserva)
+
+    return resultados
@@ -0,0 +1,151 @@
+"""
+Perfilado de una solicitud: cProfile + consultas SQL con tiempos y repetidas.
+
+Lo usa `reservas.middleware.PerfilMiddleware` (parámetro `?_profile=1`). Cada
+informe se guarda en RESERVAS_PERFIL_DIR con tres archivos del mismo nombre:
+
+    .prof  estadísticas de cProfile (abrir con snakeviz para ver el flame graph)
+    .txt   resumen en texto, fácil de comparar con diff
+    .html  el mismo informe que ve el usuario en el navegador
+"""
+import cProfile
+import io
+import pstats
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .rendimiento import huella_sql
+
+
+# Funciones que se muestran en el resumen de cProfile
+LIMITE_FUNCIONES = 40
+
+
+class RegistroConsultas:
+    """Execute wrapper que guarda cada consulta con su duración y huella"""
+
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': repr(params)[:300],
+                'duracion_ms': round((time.perf_counter() - inicio) * 1000, 3),
+                'huella': huella_sql(sql),
+            })
+
+
+class Perfil:
+    """Resultado de perfilar una llamada"""
+
+    def __init__(self, nombre, perfilador, consultas, duracion):
+        self.nombre = nombre
+        self.perfilador = perfilador
+        self.consultas = consultas
+        self.duracion_ms = round(duracion * 1000, 2)
+        self.fecha = timezone.now()
+
+    @property
+    def tiempo_sql_ms(self):
+        return round(sum(c['duracion_ms'] for c in self.consultas), 2)
+
+    def repetidas(self):
+        """
+        Consultas con la misma huella ejecutadas más de una vez, de la más costosa
+        a la menos. Muchas repeticiones de una misma huella suelen ser un N+1.
+        """
+        grupos = defaultdict(list)
+        for consulta in self.consultas:
+            grupos[consulta['huella']].append(consulta)
+
+        resultado = []
+        for huella, consultas in grupos.items():
+            if len(consultas) < 2:
+                continue
+            # Mismo SQL y mismos parámetros: resultados que se podrían reutilizar
+            exactas = Counter((c['sql'], c['params']) for c in consultas)
+            resultado.append({
+                'huella': huella,
+                'veces': len(consultas),
+                'identicas': sum(n for n in exactas.values() if n > 1),
+                'total_ms': round(sum(c['duracion_ms'] for c in consultas), 3),
+            })
+        return sorted(resultado, key=lambda g: (g['total_ms'], g['veces']), reverse=True)
+
+    def funciones(self, orden='cumulative', limite=LIMITE_FUNCIONES):
+        salida = io.StringIO()
+        estadisticas = pstats.Stats(self.perfilador, stream=salida)
+        estadisticas.strip_dirs().sort_stats(orden).print_stats(limite)
+        return salida.getvalue()
+
+    # ========================================
+    # Informes
+    # ========================================
+    def texto(self):
+        lineas = [
+            f'Perfil: {self.nombre}',
+            f'Fecha: {self.fecha.isoformat()}',
+            f'Duración total: {self.duracion_ms} ms',
+            f'Consultas SQL: {len(self.consultas)} ({self.tiempo_sql_ms} ms)',
+            '',
+            '== Consultas repetidas ==',
+        ]
+        for grupo in self.repetidas():
+            lineas.append(f'{grupo["veces"]:>5}x {grupo["total_ms"]:>9.3f} ms  {grupo["huella"]}')
+        lineas += ['', '== Consultas ==']
+        for consulta in self.consultas:
+            lineas.append(f'{consulta["duracion_ms"]:>9.3f} ms [{consulta["alias"]}] {consulta["sql"]}')
+        lineas += ['', '== cProfile (tiempo acumulado) ==', self.funciones()]
+        return '\n'.join(lineas)
+
+    def html(self, archivos=None):
+        return render_to_string('reservas/perfil.html', {
+            'perfil': self,
+            'repetidas': self.repetidas(),
+            'funciones': self.funciones(),
+            'archivos': archivos or [],
+        })
+
+    def guardar(self, directorio=None):
+        """Guarda .prof, .txt y .html; devuelve la lista de rutas"""
+        directorio = Path(directorio or getattr(settings, 'RESERVAS_PERFIL_DIR'))
+        directorio.mkdir(parents=True, exist_ok=True)
+        nombre = re.sub(r'[^\w-]+', '_', self.nombre).strip('_') or 'solicitud'
+        base = directorio / f'{self.fecha:%Y%m%d-%H%M%S}-{nombre}'
+
+        rutas = [base.with_suffix('.prof'), base.with_suffix('.txt'), base.with_suffix('.html')]
+        self.perfilador.dump_stats(rutas[0])
+        rutas[1].write_text(self.texto(), encoding='utf-8')
+        rutas[2].write_text(self.html(archivos=rutas), encoding='utf-8')
+        return rutas
+
+
+def perfilar(nombre, funcion, *args, **kwargs):
+    """Ejecuta `funcion` bajo cProfile registrando las consultas; devuelve (resultado, Perfil)"""
+    registro = RegistroConsultas()
+    perfilador = cProfile.Profile()
+    inicio = time.perf_counter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(registro))
+        perfilador.enable()
+        try:
+            resultado = funcion(*args, **kwargs)
+        finally:
+            perfilador.disable()
+    duracion = time.perf_counter() - inicio
+    return resultado, Perfil(nombre, perfilador, registro.consultas, duracion)
@@ -0,0 +1,97 @@
+"""
+Utilidades para medir rendimiento (benchmarks y pruebas de carga).
+"""
+import re
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+def percentiles(muestras):
+    """Resumen de una lista de duraciones en segundos, expresado en milisegundos"""
+    if not muestras:
+        return {}
+    ordenadas = sorted(muestras)
+
+    def p(q):
+        return ordenadas[min(len(ordenadas) - 1, int(round(q * (len(ordenadas) - 1))))] * 1000
+
+    return {
+        'n': len(ordenadas),
+        'media_ms': round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+        'p50_ms': round(p(0.50), 3),
+        'p90_ms': round(p(0.90), 3),
+        'p95_ms': round(p(0.95), 3),
+        'p99_ms': round(p(0.99), 3),
+        'max_ms': round(ordenadas[-1] * 1000, 3),
+    }
+
+
+_CADENAS = re.compile(r"'(?:[^']|'')*'")
+_NUMEROS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTAS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_MARCADORES = re.compile(r'%s|\?')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def huella_sql(sql):
+    """
+    Normaliza una consulta para agrupar las que solo difieren en los valores.
+
+    Reemplaza literales y marcadores por `?` y colapsa las listas de IN, así
+    `... WHERE id IN (%s, %s, %s)` y `... WHERE id IN (4, 9)` dan la misma huella.
+    """
+    sql = _CADENAS.sub('?', sql)
+    sql = _NUMEROS.sub('?', sql)
+    sql = _MARCADORES.sub('?', sql)
+    sql = _LISTAS.sub('(...)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+class ContadorConsultas:
+    """
+    Execute wrapper que cuenta consultas y su tiempo total.
+
+    Uso:
+        contador = ContadorConsultas()
+        with connection.execute_wrapper(contador):
+            ...
+    """
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tiempo += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+@contextmanager
+def base_de_datos_temporal(alias='default', nombre=None):
+    """
+    Crea una base de datos de prueba vacía (con migraciones) y la elimina al salir.
+
+    Se usa la misma configuración que el test runner de Django, así que nunca
+    toca la base real. `nombre` permite forzar un archivo para SQLite (necesario
+    si otros procesos deben abrir la misma base).
+    """
+    from .cache import invalidar_todo
+
+    connection = connections[alias]
+    if nombre:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = nombre
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    # El caché de reglas, horario y salas corresponde a la otra base
+    invalidar_todo()
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        invalidar_todo()
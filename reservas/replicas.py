@@ -0,0 +1,111 @@
+"""
+Lecturas en réplicas de solo lectura.
+
+Las vistas marcadas con `@solo_lectura` leen de una de las réplicas de
+RESERVAS_REPLICAS; todo lo demás (y cualquier escritura) va a la base principal.
+Como las réplicas van un poco atrasadas, después de que un usuario escribe
+`PrimariaTrasEscrituraMiddleware` le deja una cookie que durante
+RESERVAS_REPLICA_FIJAR_SEGUNDOS manda también sus lecturas a la principal, así
+ve de inmediato su propia reserva.
+
+Configuración en settings:
+
+    DATABASE_ROUTERS = ['reservas.replicas.ReplicaRouter']
+    RESERVAS_REPLICAS = ['replica1', ...]     alias de DATABASES
+    RESERVAS_REPLICA_FIJAR_SEGUNDOS = 10
+"""
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+COOKIE_PRIMARIA = 'reservas_primaria'
+
+# La vista en curso solo lee (decorador solo_lectura)
+_solo_lectura = contextvars.ContextVar('solo_lectura', default=False)
+# [bool] de la solicitud en curso: se escribió en la base (lo marca el router)
+_escrituras = contextvars.ContextVar('escrituras', default=None)
+
+# Tablas que siempre se leen de la principal: una sesión recién creada todavía
+# no está en la réplica y el usuario quedaría deslogueado
+APPS_SOLO_PRIMARIA = {'sessions'}
+
+
+def replicas():
+    return getattr(settings, 'RESERVAS_REPLICAS', [])
+
+
+def solo_lectura(vista):
+    """Envía las lecturas de la vista a una réplica, salvo que el usuario acabe de escribir"""
+    @functools.wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if request.COOKIES.get(COOKIE_PRIMARIA):
+            return vista(request, *args, **kwargs)
+        token = _solo_lectura.set(True)
+        try:
+            return vista(request, *args, **kwargs)
+        finally:
+            _solo_lectura.reset(token)
+    return envoltura
+
+
+class ReplicaRouter:
+    """Lecturas de vistas @solo_lectura a una réplica al azar; escrituras a la principal"""
+
+    def db_for_read(self, model, **hints):
+        disponibles = replicas()
+        if not disponibles or not _solo_lectura.get():
+            return None
+        if model._meta.app_label in APPS_SOLO_PRIMARIA:
+            return DEFAULT_DB_ALIAS
+        return random.choice(disponibles)
+
+    def db_for_write(self, model, **hints):
+        escrituras = _escrituras.get()
+        if escrituras is not None:
+            escrituras[0] = True
+        # Explícito: un objeto leído de una réplica se guarda en la principal
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        grupo = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in grupo and obj2._state.db in grupo:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas se alimentan de la principal, nunca se migran directo
+        if db in replicas():
+            return False
+        return None
+
+
+class PrimariaTrasEscrituraMiddleware:
+    """
+    Si la solicitud escribió en la base, fija las lecturas del usuario a la
+    principal por unos segundos (lo que tarda en ponerse al día la réplica).
+
+    Debe ir antes de SessionMiddleware para detectar también el guardado de la sesión.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.segundos = getattr(settings, 'RESERVAS_REPLICA_FIJAR_SEGUNDOS', 10)
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        escrituras = [False]
+        token = _escrituras.set(escrituras)
+        try:
+            response = self.get_response(request)
+        finally:
+            _escrituras.reset(token)
+
+        if escrituras[0]:
+            response.set_cookie(COOKIE_PRIMARIA, '1', max_age=self.segundos, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,178 @@
+"""
+Invalidación del caché (cache.py y horarios.py) al modificar reglas, bloques,
+salas (o sus materiales), roles o perfiles; actualización de la disponibilidad precalculada
+(instantaneas.py) al escribir reservas o bloqueos, de los contadores por
+usuario (contadores.py) y de las versiones de los calendarios (calendario.py)
+al escribir reservas, marcas para la analítica (analitica.py) al borrarlas y
+notificaciones en la bandeja de salida (notificaciones.py).
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import archivo, calendario, contadores, horarios, instantaneas, notificaciones
+from .cache import CLAVE_REGLAS, CLAVE_ROLES, CLAVE_SALAS, clave_rol_usuario
+from .models import (
+    ACTIVE_STATUSES,
+    Material,
+    ReservationRules,
+    Reservation,
+    Role,
+    Room,
+    RoomUnavailability,
+    TimeBlock,
+    UserProfile,
+    UtilizationSummary,
+)
+
+
+def invalidar(clave):
+    # Después del commit: antes, otra solicitud podría volver a cachear el valor viejo
+    transaction.on_commit(lambda: cache.delete(clave))
+
+
+@receiver([post_save, post_delete], sender=ReservationRules)
+def invalidar_reglas(sender, **kwargs):
+    invalidar(CLAVE_REGLAS)
+
+
+@receiver([post_save, post_delete], sender=TimeBlock)
+def invalidar_horario(sender, **kwargs):
+    transaction.on_commit(horarios.invalidar)
+
+
+@receiver([post_save, post_delete], sender=Room)
+@receiver([post_save, post_delete], sender=Material)
+@receiver(m2m_changed, sender=Room.available_materials.through)
+def invalidar_salas(sender, **kwargs):
+    # Las salas se cachean con sus materiales
+    invalidar(CLAVE_SALAS)
+
+
+@receiver(post_save, sender=Room)
+def invalidar_calendario_sala(sender, instance, **kwargs):
+    # El nombre y la ubicación van en su calendario
+    calendario.invalidar(salas=[instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Role)
+def invalidar_roles(sender, **kwargs):
+    invalidar(CLAVE_ROLES)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidar_rol_usuario(sender, instance, **kwargs):
+    invalidar(clave_rol_usuario(instance.user_id))
+
+
+CAMPOS_ANTERIORES = {
+    Reservation: ('room_id', 'date', 'user_id', 'time_block_id', 'status'),
+    RoomUnavailability: ('room_id', 'date', 'time_block_id'),
+}
+
+
+def borrado_por(origin, modelo):
+    """El borrado viene en cascada desde `modelo` (instancia o queryset)"""
+    return isinstance(origin, modelo) or getattr(origin, 'model', None) is modelo
+
+
+@receiver(pre_save, sender=Reservation)
+@receiver(pre_save, sender=RoomUnavailability)
+def recordar_anterior(sender, instance, **kwargs):
+    # Al editar hay que descontar lo anterior (otra sala, fecha, estado...)
+    instance._anterior = None
+    if instance.pk:
+        instance._anterior = (
+            sender.objects.filter(pk=instance.pk).values(*CAMPOS_ANTERIORES[sender]).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+@receiver([post_save, post_delete], sender=RoomUnavailability)
+def actualizar_disponibilidad(sender, instance, origin=None, **kwargs):
+    # Al borrar una sala sus filas de disponibilidad se van en cascada
+    if borrado_por(origin, Room):
+        return
+    # Misma transacción que la escritura: el grid nunca ve una reserva sin su estado
+    actual = (instance.room_id, instance.date)
+    anterior = getattr(instance, '_anterior', None)
+    if anterior and (anterior['room_id'], anterior['date']) != actual:
+        instantaneas.programar(anterior['room_id'], anterior['date'])
+    instantaneas.programar(*actual)
+
+
+@receiver(post_save, sender=Reservation)
+def actualizar_contadores(sender, instance, **kwargs):
+    # Completar una reserva le quita una activa al día pero no sus minutos
+    ahora = (instance.user_id, instance.date)
+    reservas, minutos = contadores.aporte(instance.status, instance.time_block_id)
+    anterior = getattr(instance, '_anterior', None)
+    if anterior:
+        reservas_antes, minutos_antes = contadores.aporte(anterior['status'], anterior['time_block_id'])
+        antes = (anterior['user_id'], anterior['date'])
+        if antes == ahora:
+            reservas, minutos = reservas - reservas_antes, minutos - minutos_antes
+        else:
+            contadores.ajustar(*antes, -reservas_antes, -minutos_antes)
+    contadores.ajustar(*ahora, reservas, minutos)
+
+
+@receiver(post_delete, sender=Reservation)
+def descontar_reserva_borrada(sender, instance, origin=None, **kwargs):
+    # Al borrar un usuario sus contadores se van en cascada; las archivadas son
+    # de días pasados
+    if borrado_por(origin, User) or archivo.archivando():
+        return
+    reservas, minutos = contadores.aporte(instance.status, instance.time_block_id)
+    contadores.ajustar(instance.user_id, instance.date, -reservas, -minutos)
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidar_calendarios(sender, instance, **kwargs):
+    # archivar_lote invalida una vez por lote
+    if archivo.archivando():
+        return
+    usuarios, salas = {instance.user_id}, {instance.room_id}
+    anterior = getattr(instance, '_anterior', None)
+    if anterior:
+        usuarios.add(anterior['user_id'])
+        salas.add(anterior['room_id'])
+    calendario.invalidar(usuarios, salas)
+
+
+@receiver(post_save, sender=Reservation)
+def notificar_reserva(sender, instance, raw=False, **kwargs):
+    # En la misma transacción: el correo sale solo si la reserva se confirma
+    if raw:
+        return
+    anterior = getattr(instance, '_anterior', None)
+    estado_anterior = anterior['status'] if anterior else None
+    if instance.status == 'confirmed' and estado_anterior != 'confirmed':
+        notificaciones.reserva_confirmada(instance)
+    elif instance.status == 'cancelled' and estado_anterior in ACTIVE_STATUSES:
+        notificaciones.reserva_cancelada(instance)
+
+
+@receiver(post_save, sender=RoomUnavailability)
+def notificar_bloqueo(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_anterior', None)
+    # Solo si el bloqueo es nuevo o cambió de sala, fecha o bloque (no al editar el motivo)
+    actual = (instance.room_id, instance.date, instance.time_block_id)
+    if raw or (anterior and (anterior['room_id'], anterior['date'], anterior['time_block_id']) == actual):
+        return
+    notificaciones.sala_bloqueada(instance)
+
+
+@receiver(post_delete, sender=Reservation)
+def marcar_analitica(sender, instance, origin=None, **kwargs):
+    # Un borrado no deja updated_at que ver: el próximo refresco recalcula el
+    # bloque (las archivadas se siguen contando desde el archivo)
+    if borrado_por(origin, Room) or borrado_por(origin, TimeBlock) or archivo.archivando():
+        return
+    UtilizationSummary.objects.filter(
+        room_id=instance.room_id,
+        date=instance.date,
+        time_block_id=instance.time_block_id,
+    ).update(pending_refresh=True)
@@ -1,3 +1,846 @@
-from django.test import TestCase
+import atexit
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (
+    archivo,
+    calendario,
+    contadores,
+    horarios,
+    instantaneas,
+    limites,
+    metricas,
+    notificaciones,
+    oleada,
+    perfil,
+    validacion,
+)
+from .horarios import DIAS
+from .consultas import ConsultasLentas
+from .idempotencia import CAMPO, nuevo_token, reclamar
+from .replicas import COOKIE_PRIMARIA, ReplicaRouter, solo_lectura
+from .models import (
+    AvailabilitySnapshot,
+    IdempotencyKey,
+    Material,
+    OutboxMessage,
+    Reservation,
+    ReservationCounter,
+    ReservationArchive,
+    ReservationRules,
+    Role,
+    Room,
+    RoomUnavailability,
+    TimeBlock,
+    UserProfile,
+    UtilizationSummary,
+)
+
+
+# Lunes a mediodía: los bloques de la mañana ya terminaron
+AHORA = datetime(2026, 10, 19, 12, 30, tzinfo=dt_timezone.utc)
+
+
+class Escenario(TestCase):
+    """Una sala con tres bloques hoy y un usuario con sesión iniciada"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ReservationRules.objects.create(max_hours_per_day=4, max_days_in_advance=7, max_active_reservations=5)
+        cls.sala = Room.objects.create(name='Sala 1', capacity=6, location='Piso 1')
+        dia = DIAS[AHORA.date().weekday()]
+        cls.bloques = [
+            TimeBlock.objects.create(name=f'Bloque {n}', day_of_week=dia, start_time=time(inicio), end_time=time(inicio + 2))
+            for n, inicio in enumerate([8, 10, 14], start=1)
+        ]
+        cls.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+
+    def setUp(self):
+        # Reglas, horario y límites se cachean en memoria (y on_commit no corre en TestCase)
+        cache.clear()
+        horarios.invalidar()
+        reloj = mock.patch('django.utils.timezone.now', return_value=AHORA)
+        self.reloj = reloj.start()
+        self.addCleanup(reloj.stop)
+        self.client.force_login(self.usuario)
+
+    def reservar(self, bloque):
+        return self.client.post(
+            reverse('reservas:reservar', args=[self.sala.pk, bloque.pk, AHORA.date().isoformat()])
+        )
+
+
+class LimiteHorasTests(Escenario):
+    """Las reservas completadas siguen contando para las horas del día"""
+
+    def test_completar_no_libera_horas_del_dia(self):
+        # Reservadas en la mañana, completadas a mediodía
+        self.reloj.return_value = AHORA.replace(hour=7)
+        self.reservar(self.bloques[0])
+        self.reservar(self.bloques[1])
+        self.assertEqual(Reservation.objects.filter(status='confirmed').count(), 2)
+
+        self.reloj.return_value = AHORA
+        call_command('completar_reservas', pausa=0, stdout=StringIO())
+        self.assertEqual(Reservation.objects.filter(status='completed').count(), 2)
+        contador = ReservationCounter.objects.get(user=self.usuario, date=AHORA.date())
+        self.assertEqual((contador.active_reservations, contador.reserved_minutes), (0, 240))
+
+        # 4 horas completadas + 2 nuevas > max_hours_per_day
+        self.reservar(self.bloques[2])
+        self.assertFalse(Reservation.objects.filter(time_block=self.bloques[2]).exists())
+
+
+class ContadoresTests(Escenario):
+    """Los contadores por usuario y fecha siguen a las reservas"""
+
+    def contador(self, fecha=AHORA.date()):
+        fila = ReservationCounter.objects.filter(user=self.usuario, date=fecha).first()
+        return (fila.active_reservations, fila.reserved_minutes) if fila else None
+
+    def test_bloque_creado_en_la_misma_transaccion(self):
+        horarios.horario()  # cargado antes de que exista el bloque
+        with transaction.atomic():
+            bloque = TimeBlock.objects.create(
+                name='Bloque 4', day_of_week=DIAS[AHORA.date().weekday()], start_time=time(16), end_time=time(17, 30)
+            )
+            Reservation.objects.create(
+                user=self.usuario, room=self.sala, time_block=bloque, date=AHORA.date(), status='confirmed',
+            )
+        self.assertEqual(self.contador(), (1, 90))
+
+    def test_reconciliar_corrige_los_desfases(self):
+        manana = AHORA.date() + timedelta(days=1)
+        Reservation.objects.bulk_create([
+            Reservation(user=self.usuario, room=self.sala, time_block=self.bloques[2], date=AHORA.date(), status='confirmed'),
+            Reservation(user=self.usuario, room=self.sala, time_block=self.bloques[0], date=AHORA.date(), status='completed'),
+        ])
+        # bulk_create no dispara señales: hoy falta el contador y mañana sobra uno
+        ReservationCounter.objects.create(user=self.usuario, date=manana, active_reservations=2, reserved_minutes=240)
+        ReservationCounter.objects.create(
+            user=self.usuario, date=AHORA.date() - timedelta(days=3), active_reservations=1, reserved_minutes=60,
+        )
+
+        salida = StringIO()
+        call_command('reconciliar_contadores', solo_verificar=True, stdout=salida)
+        self.assertIn('Contadores con diferencias: 2', salida.getvalue())
+        self.assertIsNone(self.contador())
+
+        call_command('reconciliar_contadores', stdout=StringIO())
+        self.assertEqual(self.contador(), (1, 240))
+        self.assertIsNone(self.contador(manana))
+        # Los de fechas pasadas se borran
+        self.assertEqual(ReservationCounter.objects.count(), 1)
+        self.assertEqual(contadores.reconciliar(), [])
+
+
+class BloqueTerminadoTests(Escenario):
+    """Hoy, un bloque que ya terminó no se puede reservar aunque quede libre"""
+
+    def test_no_se_reserva_un_bloque_terminado(self):
+        respuesta = self.reservar(self.bloques[0])
+        self.assertRedirects(respuesta, reverse('reservas:disponibilidad'), fetch_redirect_response=False)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_el_grid_lo_muestra_terminado(self):
+        respuesta = self.client.get(reverse('reservas:disponibilidad'), {'fecha': AHORA.date().isoformat()})
+        estados = [slot['estado'] for slot in respuesta.context['disponibilidad_grid'][0]['bloques']]
+        self.assertEqual(estados, ['pasado', 'pasado', 'disponible'])
+
+
+class ArchivoTests(Escenario):
+    """Archivar mueve solo reservas pasadas que ya no ocupan su bloque"""
+
+    def pasada(self, semanas, bloque, estado):
+        return Reservation.objects.create(
+            user=self.usuario, room=self.sala, time_block=self.bloques[bloque],
+            date=AHORA.date() - timedelta(weeks=semanas), status=estado,
+        )
+
+    def archivar(self, **opciones):
+        call_command('archivar_reservas', stdout=StringIO(), **opciones)
+
+    def test_archiva_solo_pasadas_completadas_o_canceladas(self):
+        completada = self.pasada(2, 0, 'completed')
+        cancelada = self.pasada(2, 1, 'cancelled')
+        activa = self.pasada(2, 2, 'confirmed')
+        self.reservar(self.bloques[2])
+
+        self.archivar(dias=1)
+        self.assertEqual(
+            set(ReservationArchive.objects.values_list('pk', flat=True)), {completada.pk, cancelada.pk}
+        )
+        self.assertEqual(Reservation.objects.filter(pk=activa.pk).count(), 1)
+        self.assertEqual(Reservation.objects.filter(date=AHORA.date()).count(), 1)
+
+    def test_dias_menor_que_uno_se_rechaza(self):
+        self.reservar(self.bloques[2])
+        for dias in (0, -3):
+            with self.assertRaises(CommandError):
+                self.archivar(dias=dias)
+        self.assertFalse(ReservationArchive.objects.exists())
+
+    def test_cada_lote_son_pocas_consultas(self):
+        UtilizationSummary.objects.create(
+            room=self.sala, time_block=self.bloques[0], date=AHORA.date() - timedelta(weeks=1), bookings=1,
+        )
+        consultas = []
+        for semanas in (1, 2):
+            ids = [self.pasada(semanas * 10 + n, n % 3, 'completed').pk for n in range(semanas * 3)]
+            with CaptureQueriesContext(connection) as capturadas:
+                self.assertEqual(archivo.archivar_lote(ids, AHORA.date()), len(ids))
+            consultas.append(len(capturadas))
+        # Las mismas consultas para 3 que para 6 reservas, y ninguna marca en la analítica
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertFalse(UtilizationSummary.objects.filter(pending_refresh=True).exists())
+
+    def test_mis_reservas_muestra_las_archivadas(self):
+        completada = self.pasada(3, 0, 'completed')
+        self.archivar(dias=7)
+        respuesta = self.client.get(reverse('reservas:mis_reservas'))
+        self.assertEqual([r.pk for r in respuesta.context['reservas_pasadas']], [completada.pk])
+        self.assertIsInstance(respuesta.context['reservas_pasadas'][0], ReservationArchive)
+
+
+class ServerTimingTests(Escenario):
+    """La cabecera Server-Timing reparte el total en partes que no se pisan"""
+
+    def test_partes_suman_el_total(self):
+        self.reservar(self.bloques[2])
+        # La lista de reservas se evalúa al renderizar: sus consultas van solo en db
+        respuesta = self.client.get(reverse('reservas:mis_reservas'))
+        partes = dict(re.findall(r'(\w+);dur=([\d.]+)', respuesta['Server-Timing']))
+        partes = {nombre: float(valor) for nombre, valor in partes.items()}
+        self.assertEqual(set(partes), {'db', 'tpl', 'vista', 'total'})
+        self.assertGreater(partes['db'], 0)
+        self.assertAlmostEqual(partes['db'] + partes['tpl'] + partes['vista'], partes['total'], delta=0.05)
+        self.assertRegex(respuesta['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* consultas"')
+
+
+class MetricasTests(SimpleTestCase):
+    """Cada proceso vuelca su registro a un archivo y el scrape los suma"""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+
+    def nuevo_registro(self):
+        registro = metricas.Registro(self.directorio)
+        # Se vuelca al salir del proceso, y el directorio ya no existirá
+        atexit.unregister(registro.guardar)
+        return registro
+
+    def registro_de(self, pid, creadas):
+        registro = self.nuevo_registro()
+        registro.pid = pid
+        registro.archivo = registro.archivo.with_name(f'{pid}-1.json')
+        registro.incrementar('reservas_creadas_total', creadas)
+        registro.observar('http_latencia_segundos', 0.02, vista='reservas:index')
+        registro.guardar()
+        return registro
+
+    def total(self, registro):
+        contadores, histogramas = registro.combinar()
+        return contadores[('reservas_creadas_total', ())], histogramas[
+            ('http_latencia_segundos', (('vista', 'reservas:index'),))
+        ]['total']
+
+    def test_suma_los_procesos_y_absorbe_los_terminados(self):
+        propio = self.nuevo_registro()
+        propio.incrementar('reservas_creadas_total', 1)
+        self.registro_de(os.getppid(), 2)
+        self.registro_de(999999, 4)
+
+        with mock.patch.object(metricas, '_proceso_vivo', lambda pid: pid != 999999):
+            self.assertEqual(self.total(propio), (7, 2))
+            # El archivo del proceso terminado ya no está, pero sus valores siguen
+            self.assertEqual(sorted(os.listdir(self.directorio)), sorted([
+                propio.archivo.name, f'{os.getppid()}-1.json',
+            ]))
+            self.assertEqual(self.total(propio), (7, 2))
+
+    def test_formato_prometheus(self):
+        registro = self.registro_de(os.getpid(), 3)
+        texto = registro.exportar()
+        self.assertIn('reservas_creadas_total 3\n', texto)
+        self.assertIn('http_latencia_segundos_bucket{vista="reservas:index",le="0.025"} 1\n', texto)
+        self.assertIn('http_latencia_segundos_count{vista="reservas:index"} 1\n', texto)
+
+
+class AccesoMetricasTests(TestCase):
+    """/metrics: con token lo exige; en producción sin token, solo staff"""
+
+    @override_settings(RESERVAS_METRICAS_TOKEN='secreto')
+    def test_con_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        respuesta = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(b'# TYPE reservas_creadas_total counter', respuesta.content)
+
+    @override_settings(RESERVAS_METRICAS_TOKEN=None, PRODUCCION=True)
+    def test_produccion_sin_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class PerfilTests(Escenario):
+    """?_profile=1 devuelve el informe al staff y lo guarda en RESERVAS_PERFIL_DIR"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajuste = override_settings(RESERVAS_PERFIL_DIR=directorio.name)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.directorio = directorio.name
+
+    def test_staff_recibe_el_informe(self):
+        User.objects.filter(pk=self.usuario.pk).update(is_staff=True)
+        respuesta = self.client.get(reverse('reservas:disponibilidad'), {'_profile': '1'})
+        self.assertEqual(respuesta['X-Perfil-Estado'], '200')
+        # Las consultas de la vista, con su SQL
+        self.assertContains(respuesta, 'reservas_availabilitysnapshot')
+        extensiones = sorted(os.path.splitext(nombre)[1] for nombre in os.listdir(self.directorio))
+        self.assertEqual(extensiones, ['.html', '.prof', '.txt'])
+
+    def test_sin_staff_se_ignora(self):
+        respuesta = self.client.get(reverse('reservas:disponibilidad'), {'_profile': '1'})
+        self.assertNotIn('X-Perfil-Estado', respuesta)
+        self.assertTemplateUsed(respuesta, 'reservas/disponibilidad.html')
+        self.assertEqual(os.listdir(self.directorio), [])
+
+    def test_agrupa_consultas_repetidas(self):
+        def n_mas_uno():
+            for sala_id in (1, 2, 3):
+                list(Room.objects.filter(pk=sala_id))
+            list(Room.objects.filter(pk=1))
+        _, resultado = perfil.perfilar('prueba', n_mas_uno)
+        [grupo] = resultado.repetidas()
+        self.assertEqual((grupo['veces'], grupo['identicas']), (4, 2))
+
+
+class ConsultasLentasTests(TestCase):
+    """Las consultas lentas se registran con su huella y el punto de llamada"""
+
+    def test_registra_las_lentas_con_el_sitio(self):
+        with self.assertLogs('reservas.consultas') as registro:
+            with connection.execute_wrapper(ConsultasLentas(umbral_ms=0)):
+                list(Room.objects.filter(name='Sala 1', capacity__gte=4))
+        entrada = json.loads(registro.records[0].getMessage())
+        self.assertEqual((entrada['motivo'], entrada['peso'], entrada['parametros']), ('lenta', 1.0, 2))
+        self.assertIn('"reservas_room"."name" = ?', entrada['huella'])
+        self.assertRegex(entrada['sitio'], r'^reservas/tests\.py:\d+ test_registra_las_lentas_con_el_sitio$')
+
+    def test_rapidas_sin_muestreo_no_se_registran(self):
+        with self.assertNoLogs('reservas.consultas'):
+            with connection.execute_wrapper(ConsultasLentas(umbral_ms=60000, muestreo=0.0)):
+                list(Room.objects.all())
+
+    def test_reporte_estima_con_el_peso(self):
+        lineas = [
+            {'fecha': AHORA.isoformat(), 'motivo': 'lenta', 'peso': 1.0, 'huella': 'SELECT ?',
+             'duracion_ms': 200.0, 'sitio': 'reservas/views.py:1 index'},
+            {'fecha': AHORA.isoformat(), 'motivo': 'muestra', 'peso': 10.0, 'huella': 'SELECT ?',
+             'duracion_ms': 2.0, 'sitio': 'reservas/views.py:1 index'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as archivo:
+            archivo.write('\n'.join(json.dumps(linea) for linea in lineas) + '\nno es json\n')
+        self.addCleanup(os.unlink, archivo.name)
+
+        salida = StringIO()
+        call_command('reporte_consultas', archivo.name, json=True, stdout=salida)
+        [grupo] = json.loads(salida.getvalue())
+        self.assertEqual((grupo['veces'], grupo['total_ms'], grupo['lentas']), (11.0, 220.0, 1))
+
+
+@override_settings(RESERVAS_REPLICAS=['replica1'], RESERVAS_REPLICA_FIJAR_SEGUNDOS=10)
+class ReplicasTests(Escenario):
+    """Las vistas @solo_lectura leen de una réplica, salvo justo después de escribir"""
+
+    def leer_con(self, cookies=None):
+        """Alias que el router elige para Room y Session dentro de una vista @solo_lectura"""
+        router = ReplicaRouter()
+
+        @solo_lectura
+        def vista(request):
+            return router.db_for_read(Room), router.db_for_read(Session)
+
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return vista(request)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(self.leer_con(), ('replica1', 'default'))
+        self.assertEqual(self.leer_con({COOKIE_PRIMARIA: '1'}), (None, None))
+        # Fuera de una vista @solo_lectura, y siempre al escribir, la principal
+        self.assertIsNone(router.db_for_read(Room))
+        self.assertEqual(router.db_for_write(Room), 'default')
+
+    def test_escribir_fija_la_principal(self):
+        reserva = Reservation.objects.create(
+            user=self.usuario, room=self.sala, time_block=self.bloques[2], date=AHORA.date(), status='confirmed',
+        )
+        respuesta = self.client.get(reverse('reservas:cancelar_reserva', args=[reserva.pk]))
+        self.assertEqual(respuesta.cookies[COOKIE_PRIMARIA]['max-age'], 10)
+
+    def test_leer_no_fija_la_principal(self):
+        respuesta = self.client.get('/metrics')
+        self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+
+class GridTests(Escenario):
+    """El grid no consulta la base por sala"""
+
+    def consultas_del_grid(self):
+        self.client.get(reverse('reservas:disponibilidad'))  # carga el caché
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(reverse('reservas:disponibilidad'))
+        return len(capturadas), respuesta
+
+    def test_materiales_desde_el_cache(self):
+        proyector, pizarra = Material.objects.create(name='Proyector'), Material.objects.create(name='Pizarra')
+        self.sala.available_materials.set([proyector, pizarra])
+        una_sala, _ = self.consultas_del_grid()
+
+        # Crear salas o asignarles materiales invalida el caché al confirmar
+        with self.captureOnCommitCallbacks(execute=True):
+            for numero in range(2, 5):
+                sala = Room.objects.create(name=f'Sala {numero}', capacity=4, location='Piso 2')
+                sala.available_materials.add(pizarra)
+        cuatro_salas, respuesta = self.consultas_del_grid()
+        self.assertEqual(cuatro_salas, una_sala)
+        self.assertContains(respuesta, '2 material(es)', count=1)
+        self.assertContains(respuesta, '1 material(es)', count=3)
+
+
+class InstantaneasTests(Escenario):
+    """La disponibilidad precalculada sigue a las reservas y bloqueos"""
+
+    def estados(self):
+        return {
+            (instantanea.room_id, instantanea.date): instantanea.states
+            for instantanea in AvailabilitySnapshot.objects.all()
+        }
+
+    def test_se_mantiene_al_escribir_y_se_reconstruye_igual(self):
+        hoy = AHORA.date()
+        self.reservar(self.bloques[2])
+        bloqueo = RoomUnavailability.objects.create(room=self.sala, date=hoy, reason='Evento')
+        esperado = {(self.sala.pk, hoy): {
+            str(self.bloques[2].pk): AvailabilitySnapshot.RESERVED,
+            AvailabilitySnapshot.WHOLE_DAY: AvailabilitySnapshot.BLOCKED,
+        }}
+        self.assertEqual(self.estados(), esperado)
+
+        AvailabilitySnapshot.objects.all().delete()
+        self.assertEqual(instantaneas.reconstruir(), 1)
+        self.assertEqual(self.estados(), esperado)
+
+        bloqueo.delete()
+        Reservation.objects.get().delete()
+        self.assertEqual(self.estados(), {(self.sala.pk, hoy): {}})
+
+    def test_lecturas_sin_orden_ni_joins(self):
+        solicitud = validacion.Solicitud(self.usuario, self.sala, AHORA.date(), self.bloques[2])
+        with CaptureQueriesContext(connection) as capturadas:
+            instantaneas.calcular(self.sala.pk, AHORA.date())
+            validacion.Datos([solicitud])
+        for consulta in capturadas:
+            self.assertNotIn('ORDER BY', consulta['sql'])
+            self.assertNotIn('JOIN', consulta['sql'])
+
+
+class OleadaTests(Escenario):
+    """Asignación por lotes del día que se abre a medianoche"""
+
+    def pedido(self, usuario, bloque, prioridad=None):
+        if prioridad is not None:
+            # Roles y perfiles se cachean: se invalidan al confirmar
+            with self.captureOnCommitCallbacks(execute=True):
+                rol = Role.objects.create(name=f'Rol {usuario}', priority=prioridad)
+                UserProfile.objects.create(user=usuario, role=rol)
+        solicitud = validacion.Solicitud(usuario, self.sala, AHORA.date(), bloque, max_horas=4)
+        return oleada.Pedido(solicitud, '', [])
+
+    def usuarios(self, *nombres):
+        return [User.objects.create_user(nombre, f'{nombre}@example.com') for nombre in nombres]
+
+    def test_un_bloque_por_lote(self):
+        beto, carla = self.usuarios('beto', 'carla')
+        lote = [
+            self.pedido(self.usuario, self.bloques[2]),
+            self.pedido(beto, self.bloques[2]),
+            self.pedido(carla, self.bloques[1]),
+        ]
+        resultados = oleada.asignar(lote)
+        ganadores = [r.reserva is not None for r in resultados[:2]]
+        self.assertEqual(sorted(ganadores), [False, True])
+        perdedor = resultados[ganadores.index(False)]
+        self.assertEqual(perdedor.rechazo.motivo, 'ocupado')
+        self.assertIsNotNone(resultados[2].reserva)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_gana_la_mayor_prioridad_y_el_azar_desempata(self):
+        beto, carla, diego = self.usuarios('beto', 'carla', 'diego')
+        for barajar in (lambda indices: None, list.reverse):
+            with mock.patch.object(oleada.random, 'shuffle', barajar):
+                resultados = oleada.asignar([
+                    self.pedido(self.usuario, self.bloques[2]),
+                    self.pedido(beto, self.bloques[2]),
+                ])
+            # Sin prioridades decide el orden que deja shuffle
+            ganador = beto if barajar is list.reverse else self.usuario
+            self.assertEqual([r.reserva.user for r in resultados if r.reserva], [ganador])
+            Reservation.objects.all().delete()
+
+        with mock.patch.object(oleada.random, 'shuffle', lambda indices: None):
+            resultados = oleada.asignar([
+                self.pedido(carla, self.bloques[2], prioridad=1),
+                self.pedido(diego, self.bloques[2], prioridad=5),
+            ])
+        self.assertEqual([r.reserva.user for r in resultados if r.reserva], [diego])
+
+    @override_settings(RESERVAS_OLEADA=True, RESERVAS_OLEADA_MINUTOS=10, TIME_ZONE='Etc/GMT+3')
+    def test_ventana_en_hora_local(self):
+        # max_days_in_advance=7: a medianoche local entra a la ventana el día 26
+        abierto = AHORA.date() + timedelta(days=7)
+        casos = [
+            (datetime(2026, 10, 19, 3, 0, tzinfo=dt_timezone.utc), True),    # 00:00 local
+            (datetime(2026, 10, 19, 3, 9, tzinfo=dt_timezone.utc), True),    # 00:09
+            (datetime(2026, 10, 19, 3, 10, tzinfo=dt_timezone.utc), False),  # 00:10
+            (datetime(2026, 10, 19, 0, 5, tzinfo=dt_timezone.utc), False),   # 21:05 del día anterior
+        ]
+        for ahora, esperado in casos:
+            self.reloj.return_value = ahora
+            self.assertIs(oleada.activa(abierto), esperado, ahora)
+        self.assertFalse(oleada.activa(abierto - timedelta(days=1)))
+
+
+@override_settings(RESERVAS_LIMITE_USUARIO_POR_MINUTO=2, RESERVAS_LIMITE_IP_POR_MINUTO=None)
+class LimitesTests(Escenario):
+    """Tras N solicitudes en el minuto se responde 429 hasta el minuto siguiente"""
+
+    def cancelar(self):
+        # Una reserva que no existe: 404 si pasa el límite
+        return self.client.get(reverse('reservas:cancelar_reserva', args=[999]))
+
+    def test_rechaza_y_se_rellena_al_minuto_siguiente(self):
+        for en_bd in (False, True):
+            cache.clear()
+            with self.subTest(en_bd=en_bd), override_settings(RESERVAS_LIMITES_EN_BD=en_bd), \
+                    mock.patch.object(limites.time, 'time', return_value=600 * 60 + 45.5) as reloj:
+                self.assertEqual([self.cancelar().status_code for _ in range(3)], [404, 404, 429])
+                respuesta = self.cancelar()
+                self.assertEqual((respuesta.status_code, respuesta['Retry-After']), (429, '15'))
+
+                reloj.return_value += 15
+                self.assertEqual(self.cancelar().status_code, 404)
+
+    def test_en_cache_no_consulta_la_base(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            for _ in range(3):
+                limites.consumir('usuario:1', 2)
+        self.assertEqual(len(capturadas), 0)
+
+
+class IdempotenciaTests(Escenario):
+    """Solo los tokens emitidos se guardan, y el límite se aplica antes de guardarlos"""
+
+    def enviar(self, token):
+        return self.client.post(
+            reverse('reservas:reservar', args=[self.sala.pk, self.bloques[2].pk, AHORA.date().isoformat()]),
+            {CAMPO: token},
+        )
+
+    def test_token_no_emitido_no_escribe(self):
+        otro = User.objects.create_user('beto', 'beto@example.com', 'clave')
+        for token in ('inventado', nuevo_token(otro.pk), nuevo_token(self.usuario.pk) + 'x'):
+            with self.subTest(token=token):
+                self.enviar(token)
+                self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_token_vencido_no_escribe(self):
+        token = nuevo_token(self.usuario.pk)
+        with mock.patch('time.time', return_value=AHORA.timestamp() + 601):
+            self.enviar(token)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(RESERVAS_LIMITE_USUARIO_POR_MINUTO=1)
+    def test_limite_antes_de_tomar_el_token_salvo_reenvios(self):
+        primero = nuevo_token(self.usuario.pk)
+        self.assertEqual(self.enviar(primero).status_code, 302)
+        # Sin fichas: un token nuevo recibe 429 sin llegar a la tabla
+        self.assertEqual(self.enviar(nuevo_token(self.usuario.pk)).status_code, 429)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        # El reenvío del primero se responde igual, sin gastar fichas ni escribir
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.enviar(primero)
+        self.assertRedirects(respuesta, reverse('reservas:mis_reservas'), fetch_redirect_response=False)
+        self.assertFalse([q for q in capturadas if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_vencidos_se_borran_en_el_barrido(self):
+        self.enviar(nuevo_token(self.usuario.pk))
+        self.reloj.return_value = AHORA + timedelta(seconds=601)
+        call_command('completar_reservas', pausa=0, stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ExportacionTests(Escenario):
+    """Exportación en streaming: solo staff, sin fórmulas en el CSV y con el archivo opcional"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('jefa', 'jefa@example.com', 'clave', is_staff=True))
+        self.proyector = Material.objects.create(name='Proyector')
+
+    def crear(self, bloque, fecha=AHORA.date(), estado='confirmed', notas=''):
+        reserva = Reservation.objects.create(
+            user=self.usuario, room=self.sala, time_block=bloque, date=fecha, status=estado, notes=notas,
+        )
+        reserva.requested_materials.add(self.proyector)
+        return reserva
+
+    def exportar(self, **parametros):
+        parametros = {'desde': '2026-01-01', 'hasta': '2026-12-31', **parametros}
+        return self.client.get(reverse('reservas:exportar_reservas'), parametros)
+
+    def contenido(self, respuesta):
+        return b''.join(respuesta.streaming_content).decode()
+
+    def test_solo_staff_y_parametros_validos(self):
+        self.client.force_login(self.usuario)
+        self.assertEqual(self.exportar().status_code, 302)
+
+        self.client.force_login(User.objects.get(username='jefa'))
+        self.assertEqual(self.exportar(desde='19/10/2026').status_code, 400)
+        self.assertEqual(self.exportar(formato='xlsx').status_code, 400)
+
+    def test_csv_neutraliza_formulas(self):
+        self.usuario.first_name = '+SUMA(1;1)'
+        self.usuario.save()
+        self.crear(self.bloques[2], notas='=HYPERLINK("http://x";"clic")')
+
+        respuesta = self.exportar()
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        filas = list(csv.DictReader(StringIO(self.contenido(respuesta).lstrip('\ufeff'))))
+        self.assertEqual(len(filas), 1)
+        self.assertEqual(filas[0]['notas'], '\'=HYPERLINK("http://x";"clic")')
+        self.assertEqual(filas[0]['nombre'], "'+SUMA(1;1)")
+        self.assertEqual((filas[0]['inicio'], filas[0]['materiales']), ('14:00', 'Proyector'))
+
+    def test_ndjson_con_archivadas(self):
+        self.crear(self.bloques[0], fecha=AHORA.date() - timedelta(weeks=2), estado='completed', notas='=1+1')
+        self.crear(self.bloques[2])
+        call_command('archivar_reservas', dias=1, stdout=StringIO())
+
+        actuales = self.contenido(self.exportar(formato='ndjson')).splitlines()
+        self.assertEqual(len(actuales), 1)
+
+        filas = [json.loads(linea) for linea in self.contenido(self.exportar(formato='ndjson', archivadas='1')).splitlines()]
+        self.assertEqual([fila['estado'] for fila in filas], ['Completada', 'Confirmada'])
+        # En JSON el texto va tal cual y los materiales como lista
+        self.assertEqual((filas[0]['notas'], filas[0]['materiales']), ('=1+1', ['Proyector']))
+
+    def test_consultas_no_crecen_con_las_filas(self):
+        def consultas():
+            with CaptureQueriesContext(connection) as capturadas:
+                self.contenido(self.exportar())
+            return len(capturadas)
+
+        self.crear(self.bloques[2])
+        una = consultas()
+        for semanas in (1, 2, 3):
+            self.crear(self.bloques[2], fecha=AHORA.date() - timedelta(weeks=semanas), estado='completed')
+        self.assertEqual(consultas(), una)
+
+
+class VersionCalendarioTests(Escenario):
+    """La versión del feed vive en el caché; la base se consulta solo si falta"""
+
+    def feed(self, **encabezados):
+        token = calendario.token_sala(self.sala.pk)
+        return self.client.get(reverse('reservas:calendario', args=[token]), **encabezados)
+
+    def test_sin_cache_se_recalcula_igual(self):
+        self.reservar(self.bloques[2])
+        antes = calendario.version(calendario.SALA, self.sala.pk)
+        cache.clear()
+        self.assertEqual(calendario.version(calendario.SALA, self.sala.pk), antes)
+
+    def test_304_sin_consultar_reservas(self):
+        self.reservar(self.bloques[2])
+        etag = self.feed()['ETag']
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertFalse([q for q in capturadas if 'reservas_reservation' in q['sql']])
+
+    def test_cancelar_cambia_la_version(self):
+        self.reservar(self.bloques[2])
+        antes = calendario.version(calendario.SALA, self.sala.pk)
+        reserva = Reservation.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('reservas:cancelar_reserva', args=[reserva.pk]))
+        self.assertNotEqual(calendario.version(calendario.SALA, self.sala.pk), antes)
+        self.assertEqual(self.feed(HTTP_IF_NONE_MATCH=f'"{antes}"').status_code, 200)
+
+    def test_completar_cambia_la_version(self):
+        self.reloj.return_value = AHORA.replace(hour=7)
+        self.reservar(self.bloques[0])
+        self.reloj.return_value = AHORA
+        antes = calendario.version(calendario.USUARIO, self.usuario.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('completar_reservas', pausa=0, stdout=StringIO())
+        self.assertNotEqual(calendario.version(calendario.USUARIO, self.usuario.pk), antes)
+
+
+class NotificacionesTests(Escenario):
+    """Cada cambio que afecta una reserva deja su correo en la bandeja de salida"""
+
+    def correos(self, evento):
+        return OutboxMessage.objects.filter(event=evento, recipient=self.usuario.email).count()
+
+    def test_pendiente_vencida_avisa_la_cancelacion(self):
+        Reservation.objects.create(
+            user=self.usuario, room=self.sala, time_block=self.bloques[0], date=AHORA.date(), status='pending',
+        )
+        call_command('completar_reservas', pausa=0, stdout=StringIO())
+        self.assertEqual(Reservation.objects.get().status, 'cancelled')
+        self.assertEqual(self.correos('reserva_cancelada'), 1)
+
+    def test_mover_bloqueo_a_otro_bloque_avisa(self):
+        self.reservar(self.bloques[2])
+        bloqueo = RoomUnavailability.objects.create(
+            room=self.sala, date=AHORA.date(), time_block=self.bloques[1], reason='Mantenimiento',
+        )
+        self.assertEqual(self.correos('sala_bloqueada'), 0)
+
+        bloqueo.time_block = self.bloques[2]
+        bloqueo.save()
+        self.assertEqual(self.correos('sala_bloqueada'), 1)
+
+        # Editar solo el motivo no vuelve a avisar
+        bloqueo.reason = 'Mantenimiento eléctrico'
+        bloqueo.save()
+        self.assertEqual(self.correos('sala_bloqueada'), 1)
+
+def en_paralelo(funcion, hilos):
+    """Ejecuta `funcion` en `hilos` hilos que arrancan a la vez; retorna sus resultados"""
+    barrera = threading.Barrier(hilos)
+    resultados = [None] * hilos
+
+    def correr(numero):
+        barrera.wait()
+        try:
+            resultados[numero] = funcion()
+        finally:
+            connection.close()
+
+    trabajadores = [threading.Thread(target=correr, args=(n,)) for n in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    return resultados
+
+
+class IdempotenciaConcurrenteTests(TransactionTestCase):
+    """Envíos simultáneos del mismo formulario: solo uno ejecuta la vista"""
+
+    def setUp(self):
+        cache.clear()
+        horarios.invalidar()
+        reloj = mock.patch('django.utils.timezone.now', return_value=AHORA)
+        reloj.start()
+        self.addCleanup(reloj.stop)
+        ReservationRules.objects.create(max_hours_per_day=4, max_days_in_advance=7, max_active_reservations=5)
+        self.sala = Room.objects.create(name='Sala 1', capacity=6, location='Piso 1')
+        self.bloque = TimeBlock.objects.create(
+            name='Bloque 1', day_of_week=DIAS[AHORA.date().weekday()], start_time=time(14), end_time=time(16)
+        )
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+
+    def test_un_solo_envio_toma_el_token(self):
+        tomados = en_paralelo(lambda: reclamar(self.usuario.pk, 'token'), 8)
+        self.assertEqual(tomados.count(True), 1)
+
+    def test_reenvios_simultaneos_repiten_la_respuesta(self):
+        self.client.force_login(self.usuario)
+        sesion = self.client.cookies
+        url = reverse('reservas:reservar', args=[self.sala.pk, self.bloque.pk, AHORA.date().isoformat()])
+        datos = {CAMPO: nuevo_token(self.usuario.pk)}
+
+        def enviar():
+            cliente = Client()
+            cliente.cookies = sesion
+            return cliente.post(url, datos)
+
+        respuestas = en_paralelo(enviar, 4)
+        self.assertEqual(Reservation.objects.count(), 1)
+        # Ninguno termina en "Este horario ya está reservado" (redirección a disponibilidad)
+        self.assertEqual({r.url for r in respuestas}, {reverse('reservas:mis_reservas')})
+
+
+class BandejaConcurrenteTests(TransactionTestCase):
+    """Workers de enviar_notificaciones en paralelo: cada mensaje lo reclama uno solo"""
+
+    def test_ningun_mensaje_se_reclama_dos_veces(self):
+        OutboxMessage.objects.bulk_create([
+            OutboxMessage(event='reserva_confirmada', recipient=f'u{n}@example.com', subject='s', body='b')
+            for n in range(40)
+        ])
+        lotes = en_paralelo(lambda: [mensaje.pk for mensaje in notificaciones.reclamar(25)], 4)
+        reclamados = [pk for lote in lotes for pk in lote]
+        self.assertEqual(len(reclamados), len(set(reclamados)))
+        self.assertEqual(len(reclamados), 40)
+        self.assertEqual(set(OutboxMessage.objects.values_list('attempts', flat=True)), {1})
+
+
+class OleadaReintentoTests(TransactionTestCase):
+    """Un lote cuya transacción se reintenta se cuenta una sola vez"""
+
+    @override_settings(RESERVAS_DB_ESPERA=0)
+    def test_metricas_una_vez_por_lote(self):
+        cache.clear()
+        horarios.invalidar()
+        sala = Room.objects.create(name='Sala 1', capacity=6, location='Piso 1')
+        bloque = TimeBlock.objects.create(name='Bloque 1', day_of_week=DIAS[0], start_time=time(14), end_time=time(16))
+        usuario = User.objects.create_user('ana', 'ana@example.com')
+        solicitud = validacion.Solicitud(usuario, sala, AHORA.date(), bloque, max_horas=4)
+
+        datos = validacion.Datos
+        intentos = iter([OperationalError('database is locked')])
+
+        def datos_bloqueados(solicitudes):
+            error = next(intentos, None)
+            if error:
+                raise error
+            return datos(solicitudes)
+
+        with mock.patch.object(oleada.validacion, 'Datos', datos_bloqueados), \
+                mock.patch.object(oleada.metricas, 'incrementar') as incrementar:
+            [resultado] = oleada.asignar([oleada.Pedido(solicitud, '', [])])
+        self.assertIsNotNone(resultado.reserva)
+        lotes = [c for c in incrementar.call_args_list if c.args[0] == 'oleada_lotes_total']
+        self.assertEqual(len(lotes), 1)
@@ -0,0 +1,53 @@
+"""
+Escrituras robustas frente a "database is locked".
+
+Con SQLite solo puede escribir una conexión a la vez; las demás esperan hasta
+`timeout` y luego fallan con OperationalError. `reintentar_si_bloqueada` vuelve
+a ejecutar la función completa (que debe abrir su propia transacción) con
+espera exponencial. Configuración en settings:
+
+    RESERVAS_DB_REINTENTOS  reintentos antes de propagar el error
+    RESERVAS_DB_ESPERA      espera base en segundos (se duplica en cada intento)
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+from . import metricas
+
+
+def es_bloqueo(error):
+    mensaje = str(error).lower()
+    return 'database is locked' in mensaje or 'database table is locked' in mensaje
+
+
+def reintentar_si_bloqueada(funcion):
+    """
+    Decorador para funciones de escritura:
+
+        @reintentar_si_bloqueada
+        @transaction.atomic
+        def crear_algo(...):
+            ...
+
+    No reintenta si ya se está dentro de una transacción externa: en ese caso
+    quien abrió la transacción debe decidir.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        intentos = getattr(settings, 'RESERVAS_DB_REINTENTOS', 4)
+        espera = getattr(settings, 'RESERVAS_DB_ESPERA', 0.05)
+        for intento in range(intentos + 1):
+            try:
+                return funcion(*args, **kwargs)
+            except OperationalError as error:
+                if (not es_bloqueo(error) or intento == intentos
+                        or transaction.get_connection().in_atomic_block):
+                    raise
+                metricas.incrementar('db_reintentos_total')
+                # Espera aleatoria para que los reintentos no choquen de nuevo
+                time.sleep(espera * 2 ** intento * random.uniform(0.5, 1.5))
+    return envoltura
@@ -9,4 +9,6 @@ urlpatterns = [
     path('reservar/<int:room_id>/<int:timeblock_id>/<str:date>/', views.reservar, name='reservar'),
     path('mis-reservas/', views.mis_reservas, name='mis_reservas'),
     path('cancelar/<int:reservation_id>/', views.cancelar_reserva, name='cancelar_reserva'),
+    path('exportar/', views.exportar_reservas, name='exportar_reservas'),
+    path('calendario/<str:token>.ics', views.calendario_ics, name='calendario'),
 ]
\ No newline at end of file
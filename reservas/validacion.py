@@ -0,0 +1,197 @@
+"""
+Validación de una solicitud de reserva, compartida por el GET de confirmación,
+el POST y la asignación por lotes del modo oleada.
+
+Las reglas se evalúan de la más barata a la más cara y la primera que falla
+corta la cadena con un `Rechazo` (motivo + mensaje + datos):
+
+1. Sin base de datos: fecha pasada (o bloque de hoy ya terminado), fuera de la ventana de anticipación,
+   bloque de otro día de la semana.
+2. Con `Datos`, que se cargan con tres consultas para una o para muchas
+   solicitudes a la vez: bloque ocupado, sala bloqueada, máximo de reservas
+   activas, límite de horas. Los dos topes salen de los contadores por usuario
+   (contadores.py), con una sola lectura del índice (usuario, fecha).
+
+Reglas, roles y horario salen del caché, así que validar cuesta a lo sumo esas
+tres consultas.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import contadores
+from .cache import max_horas_por_dia, obtener_reglas
+from .horarios import DIAS
+from .models import ACTIVE_STATUSES, Reservation, RoomUnavailability
+
+
+class Rechazo:
+    """Motivo de rechazo (para métricas y clientes), mensaje para el usuario y datos"""
+    __slots__ = ('motivo', 'mensaje', 'datos')
+
+    def __init__(self, motivo, mensaje, **datos):
+        self.motivo = motivo
+        self.mensaje = mensaje
+        self.datos = datos
+
+    def __repr__(self):
+        return f'<Rechazo {self.motivo}: {self.mensaje}>'
+
+
+class Rechazada(Exception):
+    """Para cortar una transacción con un rechazo (ej: límite de horas al crear)"""
+
+    def __init__(self, rechazo):
+        super().__init__(rechazo.mensaje)
+        self.rechazo = rechazo
+
+
+def ocupado():
+    return Rechazo('ocupado', 'Este horario ya está reservado')
+
+
+class Solicitud:
+    """Qué se quiere reservar; max_horas se calcula del rol si no se indica"""
+    __slots__ = ('user', 'sala', 'fecha', 'bloque', 'max_horas')
+
+    def __init__(self, user, sala, fecha, bloque, max_horas=None):
+        self.user = user
+        self.sala = sala
+        self.fecha = fecha
+        self.bloque = bloque
+        self.max_horas = max_horas if max_horas is not None else max_horas_por_dia(user.pk)
+
+
+# ========================================
+# Reglas sin base de datos
+# ========================================
+def fecha_pasada(solicitud):
+    ahora = timezone.localtime()
+    if solicitud.fecha < ahora.date():
+        return Rechazo('fecha_pasada', 'No puedes reservar en fechas pasadas')
+    # Hoy, un bloque que ya terminó (completar_reservas lo deja libre en el grid)
+    if solicitud.fecha == ahora.date() and solicitud.bloque.end_time <= ahora.time():
+        return Rechazo('fecha_pasada', 'Este bloque horario ya terminó')
+
+
+def fuera_de_ventana(solicitud):
+    reglas = obtener_reglas()
+    max_dias = reglas.max_days_in_advance if reglas else 2
+    if solicitud.fecha > timezone.now().date() + timedelta(days=max_dias):
+        return Rechazo(
+            'fuera_de_ventana',
+            f'No puedes reservar con más de {max_dias} días de anticipación',
+            max_dias=max_dias,
+        )
+
+
+def dia_del_bloque(solicitud):
+    if solicitud.bloque.day_of_week != DIAS[solicitud.fecha.weekday()]:
+        return Rechazo('dia_incorrecto', 'Este bloque no corresponde al día seleccionado')
+
+
+# ========================================
+# Reglas con Datos
+# ========================================
+class Datos:
+    """Reservas activas, bloqueos y contadores que tocan a un grupo de solicitudes"""
+    __slots__ = ('ocupados', 'bloqueados', 'horas', 'activas')
+
+    def __init__(self, solicitudes):
+        fechas = {s.fecha for s in solicitudes}
+        salas = {s.sala.pk for s in solicitudes}
+        usuarios = {s.user.pk for s in solicitudes}
+
+        # Conjuntos: sin el orden por defecto de los modelos, que agrega JOINs
+        self.ocupados = set(
+            Reservation.objects.filter(
+                room_id__in=salas,
+                date__in=fechas,
+                status__in=ACTIVE_STATUSES,
+            ).order_by().values_list('room_id', 'date', 'time_block_id')
+        )
+
+        # Reservas activas (desde hoy) y horas por día de cada usuario
+        self.horas = defaultdict(int)
+        self.activas = defaultdict(int)
+        for user_id, por_fecha in contadores.leer(usuarios).items():
+            for fecha, (reservas, minutos) in por_fecha.items():
+                self.activas[user_id] += reservas
+                self.horas[(user_id, fecha)] = minutos / 60
+
+        # (sala, fecha, None) = bloqueada todo el día
+        self.bloqueados = set(
+            RoomUnavailability.objects.filter(room_id__in=salas, date__in=fechas)
+            .order_by().values_list('room_id', 'date', 'time_block_id')
+        )
+
+    def reservar(self, solicitud):
+        """Anota una reserva recién creada (asignación por lotes)"""
+        self.ocupados.add((solicitud.sala.pk, solicitud.fecha, solicitud.bloque.id))
+        self.horas[(solicitud.user.pk, solicitud.fecha)] += solicitud.bloque.duration_hours()
+        self.activas[solicitud.user.pk] += 1
+
+
+def bloque_ocupado(solicitud, datos):
+    if (solicitud.sala.pk, solicitud.fecha, solicitud.bloque.id) in datos.ocupados:
+        return ocupado()
+
+
+def sala_bloqueada(solicitud, datos):
+    sala, fecha = solicitud.sala.pk, solicitud.fecha
+    if (sala, fecha, None) in datos.bloqueados or (sala, fecha, solicitud.bloque.id) in datos.bloqueados:
+        return Rechazo('bloqueado', 'Este horario no está disponible')
+
+
+def max_reservas_activas(solicitud, datos):
+    reglas = obtener_reglas()
+    max_activas = reglas.max_active_reservations if reglas else 5
+    if datos.activas[solicitud.user.pk] >= max_activas:
+        return Rechazo(
+            'limite_activas',
+            f'No puedes tener más de {max_activas} reservas activas',
+            max_activas=max_activas,
+        )
+
+
+def limite_horas(solicitud, datos):
+    horas_reservadas = datos.horas[(solicitud.user.pk, solicitud.fecha)]
+    if horas_reservadas + solicitud.bloque.duration_hours() > solicitud.max_horas:
+        return Rechazo(
+            'limite_horas',
+            f'No puedes reservar más de {solicitud.max_horas} horas por día. '
+            f'Ya tienes {horas_reservadas} horas reservadas.',
+            max_horas=solicitud.max_horas,
+            horas_reservadas=horas_reservadas,
+        )
+
+
+REGLAS_PREVIAS = [fecha_pasada, fuera_de_ventana, dia_del_bloque]
+REGLAS_CON_DATOS = [bloque_ocupado, sala_bloqueada, max_reservas_activas, limite_horas]
+
+
+def validar_previas(solicitud):
+    for regla in REGLAS_PREVIAS:
+        rechazo = regla(solicitud)
+        if rechazo:
+            return rechazo
+    return None
+
+
+def validar_con_datos(solicitud, datos):
+    for regla in REGLAS_CON_DATOS:
+        rechazo = regla(solicitud, datos)
+        if rechazo:
+            return rechazo
+    return None
+
+
+def validar(solicitud, datos=None):
+    """Primer Rechazo de la cadena, o None si la reserva es válida"""
+    rechazo = validar_previas(solicitud)
+    if rechazo:
+        return rechazo
+    if datos is None:
+        datos = Datos([solicitud])
+    return validar_con_datos(solicitud, datos)
@@ -1,57 +1,123 @@
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
 from django.contrib import messages
+from django.urls import reverse
 from django.utils import timezone
-from datetime import datetime, timedelta, date
-from django.db.models import Q
-from .models import Room, TimeBlock, Reservation, ReservationRules, RoomUnavailability
+from django.utils.cache import get_conditional_response
+from datetime import datetime, timedelta
+from .models import Room, Reservation, ReservationArchive
+from .archivo import historial_reservas
+from .cache import obtener_reglas, salas_publicas
+from .horarios import horario
+from .idempotencia import es_reenvio, idempotente, nuevo_token
+from .limites import limitar
+from . import calendario, exportacion, instantaneas, metricas as metricas_registro, oleada, validacion
+from .replicas import solo_lectura
+from .transacciones import reintentar_si_bloqueada
 
 
+def _rechazar(request, motivo, mensaje):
+    """Rechaza un intento de reserva: mensaje al usuario + métrica por motivo"""
+    metricas_registro.incrementar('reservas_rechazadas_total', motivo=motivo)
+    messages.error(request, mensaje)
+    return redirect('reservas:disponibilidad')
+
+
+def _reserva_confirmada(request, sala, fecha, bloque):
+    metricas_registro.incrementar('reservas_creadas_total')
+    messages.success(
+        request,
+        f'¡Reserva confirmada! {sala.name} el {fecha.strftime("%d/%m/%Y")} '
+        f'de {bloque.start_time.strftime("%H:%M")} a {bloque.end_time.strftime("%H:%M")}'
+    )
+    return redirect('reservas:mis_reservas')
+
+
+@reintentar_si_bloqueada
+@transaction.atomic
+def _crear_reserva(solicitud, notas, materiales_ids):
+    """Crea la reserva y sus materiales en una sola transacción"""
+    # Dos pestañas del mismo usuario pueden pasar la validación a la vez: los
+    # topes se revisan de nuevo dentro de la transacción, con la fila del usuario
+    # bloqueada (en SQLite lo serializa BEGIN IMMEDIATE; en PostgreSQL, el FOR UPDATE)
+    User.objects.select_for_update().filter(pk=solicitud.user.pk).exists()
+    datos = validacion.Datos([solicitud])
+    rechazo = (
+        validacion.max_reservas_activas(solicitud, datos)
+        or validacion.limite_horas(solicitud, datos)
+    )
+    if rechazo:
+        raise validacion.Rechazada(rechazo)
+
+    reserva = Reservation.objects.create(
+        user=solicitud.user,
+        room=solicitud.sala,
+        date=solicitud.fecha,
+        time_block_id=solicitud.bloque.id,
+        status='confirmed',
+        notes=notas
+    )
+    if materiales_ids:
+        reserva.requested_materials.set(materiales_ids)
+    return reserva
+
+
+@reintentar_si_bloqueada
+@transaction.atomic
+def _cancelar_reserva(reserva):
+    reserva.status = 'cancelled'
+    reserva.save()
+
+
+@solo_lectura
 def index(request):
     """Página principal"""
     context = {
-        'total_salas': Room.objects.filter(is_active=True, is_public=True).count(),
-        'total_bloques': TimeBlock.objects.filter(is_active=True).count(),
+        'total_salas': len(salas_publicas()),
+        'total_bloques': horario().total_activos,
     }
     return render(request, 'reservas/index.html', context)
 
 
+@solo_lectura
 def disponibilidad(request):
     """Grid de disponibilidad de salas"""
     # Obtener fecha del parámetro GET o usar hoy
-    fecha_str = request.GET.get('fecha', date.today().isoformat())
+    ahora = timezone.localtime()
+    hoy = ahora.date()
+    fecha_str = request.GET.get('fecha', hoy.isoformat())
     try:
         fecha_seleccionada = datetime.strptime(fecha_str, '%Y-%m-%d').date()
     except ValueError:
-        fecha_seleccionada = date.today()
+        fecha_seleccionada = hoy
     
     # Validar que no sea fecha pasada
-    if fecha_seleccionada < date.today():
-        fecha_seleccionada = date.today()
+    if fecha_seleccionada < hoy:
+        fecha_seleccionada = hoy
     
     # Obtener reglas
-    reglas = ReservationRules.objects.first()
+    reglas = obtener_reglas()
     max_dias_anticipacion = reglas.max_days_in_advance if reglas else 2
     
     # Validar límite de anticipación
-    fecha_maxima = date.today() + timedelta(days=max_dias_anticipacion)
+    fecha_maxima = hoy + timedelta(days=max_dias_anticipacion)
     if fecha_seleccionada > fecha_maxima:
         fecha_seleccionada = fecha_maxima
     
-    # Obtener día de la semana en inglés
-    dias_semana = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-    dia_semana = dias_semana[fecha_seleccionada.weekday()]
-    
     # Obtener salas públicas y activas
-    salas = Room.objects.filter(is_public=True, is_active=True).order_by('name')
+    salas = salas_publicas()
     
     # Obtener bloques horarios para ese día
-    bloques = TimeBlock.objects.filter(
-        day_of_week=dia_semana,
-        is_active=True
-    ).order_by('start_time')
+    bloques = horario().del_dia(fecha_seleccionada)
     
-    # Construir matriz de disponibilidad
+    # Construir matriz de disponibilidad (un día completo en una consulta)
+    instantaneas_dia = instantaneas.del_dia(fecha_seleccionada)
     disponibilidad_grid = []
     
     for sala in salas:
@@ -59,34 +125,17 @@ def disponibilidad(request):
             'sala': sala,
             'bloques': []
         }
+        instantanea = instantaneas_dia.get(sala.id)
         
         for bloque in bloques:
-            # Verificar si hay reserva
-            reserva = Reservation.objects.filter(
-                room=sala,
-                date=fecha_seleccionada,
-                time_block=bloque,
-                status__in=['pending', 'confirmed']
-            ).first()
-            
-            # Verificar si está bloqueada
-            bloqueada = RoomUnavailability.objects.filter(
-                Q(room=sala, date=fecha_seleccionada, time_block=bloque) |
-                Q(room=sala, date=fecha_seleccionada, time_block__isnull=True)  # Bloqueada todo el día
-            ).exists()
-            
-            # Determinar estado
-            if bloqueada:
-                estado = 'bloqueado'
-            elif reserva:
-                estado = 'reservado'
+            # Hoy, los bloques que ya terminaron no se pueden reservar
+            if fecha_seleccionada == hoy and bloque.end_time <= ahora.time():
+                estado = 'pasado'
             else:
-                estado = 'disponible'
-            
+                estado = instantaneas.estado(instantanea, bloque.id)
             fila['bloques'].append({
                 'bloque': bloque,
                 'estado': estado,
-                'reserva': reserva
             })
         
         disponibilidad_grid.append(fila)
@@ -96,7 +145,7 @@ def disponibilidad(request):
     fecha_siguiente = fecha_seleccionada + timedelta(days=1)
     
     # No permitir ir al pasado
-    if fecha_anterior < date.today():
+    if fecha_anterior < hoy:
         fecha_anterior = None
     
     # No permitir exceder máximo de anticipación
@@ -116,96 +165,53 @@ def disponibilidad(request):
 
 
 @login_required
+@limitar('reservar', exento=es_reenvio)
+@idempotente
 def reservar(request, room_id, timeblock_id, date):
     """Procesar reserva de sala"""
     sala = get_object_or_404(Room, pk=room_id, is_active=True)
-    bloque = get_object_or_404(TimeBlock, pk=timeblock_id, is_active=True)
+    bloque = horario().bloque(timeblock_id)
+    if bloque is None or not bloque.is_active:
+        raise Http404('Bloque horario no encontrado')
     
     try:
         fecha = datetime.strptime(date, '%Y-%m-%d').date()
     except ValueError:
-        messages.error(request, 'Fecha inválida')
-        return redirect('reservas:disponibilidad')
-    
-    # Validaciones
-    reglas = ReservationRules.objects.first()
-    
-    # 1. Verificar que no sea fecha pasada
-    if fecha < timezone.now().date():
-        messages.error(request, 'No puedes reservar en fechas pasadas')
-        return redirect('reservas:disponibilidad')
-    
-    # 2. Verificar límite de anticipación
-    max_dias = reglas.max_days_in_advance if reglas else 2
-    if fecha > timezone.now().date() + timedelta(days=max_dias):
-        messages.error(request, f'No puedes reservar con más de {max_dias} días de anticipación')
-        return redirect('reservas:disponibilidad')
+        return _rechazar(request, 'fecha_invalida', 'Fecha inválida')
     
-    # 3. Verificar que no esté ya reservada
-    if Reservation.objects.filter(
-        room=sala,
-        date=fecha,
-        time_block=bloque,
-        status__in=['pending', 'confirmed']
-    ).exists():
-        messages.error(request, 'Este horario ya está reservado')
-        return redirect('reservas:disponibilidad')
-    
-    # 4. Verificar que no esté bloqueada
-    if RoomUnavailability.objects.filter(
-        Q(room=sala, date=fecha, time_block=bloque) |
-        Q(room=sala, date=fecha, time_block__isnull=True)
-    ).exists():
-        messages.error(request, 'Este horario no está disponible')
-        return redirect('reservas:disponibilidad')
-    
-    # 5. Verificar límite de horas por día del usuario
-    max_horas = reglas.max_hours_per_day if reglas else 2
-    if hasattr(request.user, 'profile'):
-        max_horas = request.user.profile.get_max_hours_per_day()
-    
-    # Calcular horas ya reservadas ese día
-    reservas_dia = Reservation.objects.filter(
-        user=request.user,
-        date=fecha,
-        status__in=['pending', 'confirmed']
-    )
+    # Validaciones (ver validacion.py): primero las que no consultan la base
+    solicitud = validacion.Solicitud(request.user, sala, fecha, bloque)
+    rechazo = validacion.validar_previas(solicitud)
+    if rechazo:
+        return _rechazar(request, rechazo.motivo, rechazo.mensaje)
     
-    horas_reservadas = sum([r.time_block.duration_hours() for r in reservas_dia])
-    horas_nueva_reserva = bloque.duration_hours()
-    
-    if horas_reservadas + horas_nueva_reserva > max_horas:
-        messages.error(
-            request,
-            f'No puedes reservar más de {max_horas} horas por día. '
-            f'Ya tienes {horas_reservadas} horas reservadas.'
+    # Modo oleada: el día recién abierto se asigna por lotes (ver oleada.py)
+    if request.method == 'POST' and oleada.activa(fecha):
+        resultado = oleada.solicitar(
+            solicitud, request.POST.get('notas', ''), request.POST.getlist('materiales')
         )
-        return redirect('reservas:disponibilidad')
+        if resultado.rechazo:
+            return _rechazar(request, resultado.rechazo.motivo, resultado.rechazo.mensaje)
+        return _reserva_confirmada(request, sala, fecha, bloque)
+    
+    rechazo = validacion.validar_con_datos(solicitud, validacion.Datos([solicitud]))
+    if rechazo:
+        return _rechazar(request, rechazo.motivo, rechazo.mensaje)
     
     # Si es POST, procesar formulario de materiales
     if request.method == 'POST':
-        materiales_ids = request.POST.getlist('materiales')
-        
-        # Crear reserva
-        reserva = Reservation.objects.create(
-            user=request.user,
-            room=sala,
-            date=fecha,
-            time_block=bloque,
-            status='confirmed',
-            notes=request.POST.get('notas', '')
-        )
-        
-        # Agregar materiales solicitados
-        if materiales_ids:
-            reserva.requested_materials.set(materiales_ids)
-        
-        messages.success(
-            request,
-            f'¡Reserva confirmada! {sala.name} el {fecha.strftime("%d/%m/%Y")} '
-            f'de {bloque.start_time.strftime("%H:%M")} a {bloque.end_time.strftime("%H:%M")}'
-        )
-        return redirect('reservas:mis_reservas')
+        # Crear reserva (si otra solicitud tomó el bloque entre la validación
+        # y el INSERT, la restricción única lo impide)
+        try:
+            _crear_reserva(
+                solicitud, request.POST.get('notas', ''), request.POST.getlist('materiales')
+            )
+        except IntegrityError:
+            rechazo = validacion.ocupado()
+            return _rechazar(request, rechazo.motivo, rechazo.mensaje)
+        except validacion.Rechazada as error:
+            return _rechazar(request, error.rechazo.motivo, error.rechazo.mensaje)
+        return _reserva_confirmada(request, sala, fecha, bloque)
     
     # Mostrar formulario de confirmación
     context = {
@@ -213,10 +219,13 @@ def reservar(request, room_id, timeblock_id, date):
         'bloque': bloque,
         'fecha': fecha,
         'materiales_disponibles': sala.available_materials.filter(is_active=True),
+        # Un reenvío del formulario repite la respuesta del primero (ver idempotencia.py)
+        'token_idempotencia': nuevo_token(request.user.pk),
     }
     return render(request, 'reservas/confirmar.html', context)
 
 
+@solo_lectura
 @login_required
 def mis_reservas(request):
     """Ver reservas del usuario"""
@@ -226,22 +235,26 @@ def mis_reservas(request):
         date__gte=timezone.now().date()
     ).select_related('room', 'time_block').order_by('date', 'time_block__start_time')
     
-    reservas_pasadas = Reservation.objects.filter(
-        user=request.user,
-        date__lt=timezone.now().date()
-    ).select_related('room', 'time_block').order_by('-date', '-time_block__start_time')[:10]
+    # Historial: incluye las reservas ya movidas al archivo
+    reservas_pasadas = historial_reservas(request.user, limite=10)
     
     context = {
         'reservas_activas': reservas_activas,
         'reservas_pasadas': reservas_pasadas,
+        'url_calendario': request.build_absolute_uri(
+            reverse('reservas:calendario', args=[calendario.token_usuario(request.user.pk)])
+        ),
     }
     return render(request, 'reservas/mis_reservas.html', context)
 
 
 @login_required
+@limitar('cancelar')
 def cancelar_reserva(request, reservation_id):
     """Cancelar una reserva"""
-    reserva = get_object_or_404(Reservation, pk=reservation_id, user=request.user)
+    # Sala y usuario para el correo de cancelación
+    reserva = get_object_or_404(Reservation.objects.select_related('room'), pk=reservation_id, user=request.user)
+    reserva.user = request.user
     
     # Solo permitir cancelar si es futura y no está ya cancelada
     if reserva.date < timezone.now().date():
@@ -249,8 +262,76 @@ def cancelar_reserva(request, reservation_id):
     elif reserva.status == 'cancelled':
         messages.warning(request, 'Esta reserva ya está cancelada')
     else:
-        reserva.status = 'cancelled'
-        reserva.save()
+        _cancelar_reserva(reserva)
+        metricas_registro.incrementar('reservas_canceladas_total')
         messages.success(request, 'Reserva cancelada exitosamente')
     
-    return redirect('reservas:mis_reservas')
\ No newline at end of file
+    return redirect('reservas:mis_reservas')
+
+
+@solo_lectura
+@staff_member_required
+def exportar_reservas(request):
+    """
+    Reservas entre ?desde= y ?hasta= (AAAA-MM-DD) en CSV o JSON por líneas
+    (?formato=ndjson), en streaming. Filtros opcionales: ?estado=, ?sala=<id>
+    y ?archivadas=1 para incluir las del archivo.
+    """
+    try:
+        desde = datetime.strptime(request.GET.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.GET.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return HttpResponseBadRequest('Indica desde y hasta con el formato AAAA-MM-DD')
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacion.FORMATOS:
+        return HttpResponseBadRequest(f'Formato inválido, usa: {", ".join(exportacion.FORMATOS)}')
+
+    filtros = {'date__gte': desde, 'date__lte': hasta}
+    if request.GET.get('estado'):
+        filtros['status'] = request.GET['estado']
+    if request.GET.get('sala', '').isdigit():
+        filtros['room_id'] = int(request.GET['sala'])
+
+    # Las filas se leen después de que la vista retorna: la réplica se elige ahora
+    modelos = [ReservationArchive, Reservation] if request.GET.get('archivadas') == '1' else [Reservation]
+    querysets = [
+        modelo.objects.using(router.db_for_read(modelo)).filter(**filtros).order_by('date', 'pk')
+        for modelo in modelos
+    ]
+    return exportacion.respuesta(querysets, formato, f'reservas_{desde}_{hasta}')
+
+
+def calendario_ics(request, token):
+    """
+    Feed .ics de un usuario o de una sala (token de calendario.token_usuario /
+    token_sala). Con If-None-Match igual a la versión responde 304 sin armar
+    el feed; si no, lo entrega desde el caché o lo genera con una consulta.
+    """
+    destino = calendario.leer_token(token)
+    if destino is None:
+        raise Http404('Calendario no encontrado')
+
+    version = calendario.version(*destino)
+    etag = f'"{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(calendario.feed(*destino, version), content_type='text/calendar; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+def metricas(request):
+    """Métricas en formato Prometheus (no consulta la base de datos)"""
+    token = getattr(settings, 'RESERVAS_METRICAS_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+    elif getattr(settings, 'PRODUCCION', False) and not request.user.is_staff:
+        # En producción sin token solo la ve el staff con sesión iniciada (no se
+        # confía en la IP: detrás de un proxy local todo parece venir de localhost)
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metricas_registro.obtener_registro().exportar(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sala_reservas.settings')
 
 application = get_asgi_application()
+
+# Precarga el caché y las plantillas de este worker antes de la primera solicitud
+from reservas.cache import precargar_al_iniciar  # noqa: E402
+
+precargar_al_iniciar()
@@ -16,25 +16,38 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
+# Configuración por entorno
+# ========================================
+# Todo lo que cambia entre desarrollo y producción se lee de variables de
+# entorno o de un archivo .env en la raíz (ver .env.example). Sin variables
+# definidas se usa el perfil de desarrollo: SQLite y DEBUG activo.
+import os
+import tempfile
+
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
+
+SECRET_KEY_DESARROLLO = 'django-insecure-_d#!1jgj2r(mt#sto=(pwl(5_^m7m7%r76aj6kl5o6gsc33&%3'
+
+# Detectar si está en PythonAnywhere
+PYTHONANYWHERE_DOMAIN = os.environ.get('PYTHONANYWHERE_DOMAIN')
+
+PRODUCCION = config('PRODUCCION', default=bool(PYTHONANYWHERE_DOMAIN), cast=bool)
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-_d#!1jgj2r(mt#sto=(pwl(5_^m7m7%r76aj6kl5o6gsc33&%3'
+SECRET_KEY = config('SECRET_KEY', default=SECRET_KEY_DESARROLLO)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-import os
+# En producción DEBUG siempre está apagado: además de mostrar información
+# interna, con DEBUG Django guarda en memoria cada consulta ejecutada.
+DEBUG = False if PRODUCCION else config('DEBUG', default=True, cast=bool)
 
-# Detectar si está en PythonAnywhere
-if 'PYTHONANYWHERE_DOMAIN' in os.environ:
-    DEBUG = False
-    ALLOWED_HOSTS = [os.environ.get('PYTHONANYWHERE_DOMAIN'), 'localhost', '127.0.0.1']
-else:
-    DEBUG = True
-    ALLOWED_HOSTS = []
-DEBUG = True
+ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='', cast=Csv())
+if PYTHONANYWHERE_DOMAIN:
+    ALLOWED_HOSTS += [PYTHONANYWHERE_DOMAIN, 'localhost', '127.0.0.1']
 
-ALLOWED_HOSTS = []
+if PRODUCCION and SECRET_KEY == SECRET_KEY_DESARROLLO:
+    raise ImproperlyConfigured('En producción se debe definir SECRET_KEY')
 
 
 # Application definition
@@ -51,11 +64,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'reservas.middleware.ServerTimingMiddleware',
+    'reservas.middleware.MetricasMiddleware',
+    'reservas.replicas.PrimariaTrasEscrituraMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'reservas.middleware.PerfilMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,12 +100,119 @@ WSGI_APPLICATION = 'sala_reservas.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_MOTOR=sqlite (por defecto) o DB_MOTOR=postgresql
+DB_MOTOR = config('DB_MOTOR', default='sqlite')
+
+if DB_MOTOR == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='sala_reservas'),
+            'USER': config('DB_USER', default='sala_reservas'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            # Conexiones persistentes: se reutilizan entre solicitudes durante
+            # CONN_MAX_AGE segundos y se verifican antes de usarlas
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            # Detrás de PgBouncer en modo transacción los cursores del lado del
+            # servidor no sobreviven entre transacciones
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_PGBOUNCER', default=False, cast=bool),
+            'OPTIONS': {
+                'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int),
+            },
+        }
     }
+elif DB_MOTOR == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    raise ImproperlyConfigured(f'DB_MOTOR desconocido: {DB_MOTOR} (use sqlite o postgresql)')
+
+# Perfil de producción para SQLite: WAL (lecturas sin bloquear la escritura),
+# synchronous=NORMAL, caché y mmap más grandes, y transacciones con BEGIN
+# IMMEDIATE para que dos escrituras no choquen a mitad de transacción.
+# Activar con SQLITE_PRODUCCION=1. No usar WAL sobre sistemas de archivos de red.
+SQLITE_OPCIONES_PRODUCCION = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA mmap_size=134217728;'   # 128 MB
+        'PRAGMA cache_size=-20000;'     # 20 MB
+        'PRAGMA temp_store=MEMORY;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,  # busy_timeout en segundos: cuánto espera una escritura su turno
 }
+if DB_MOTOR == 'sqlite' and config('SQLITE_PRODUCCION', default=False, cast=bool):
+    DATABASES['default']['OPTIONS'] = SQLITE_OPCIONES_PRODUCCION
+
+# Réplicas de solo lectura (ver reservas/replicas.py). DB_REPLICAS es una lista
+# separada por comas: hosts (host o host:puerto) con PostgreSQL, o rutas de
+# archivo con SQLite (para probar en local; ver sincronizar_replicas).
+RESERVAS_REPLICAS = []
+for numero, replica in enumerate(config('DB_REPLICAS', default='', cast=Csv()), start=1):
+    alias = f'replica{numero}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_MOTOR == 'sqlite':
+        DATABASES[alias]['NAME'] = replica
+    else:
+        host, _, puerto = replica.partition(':')
+        DATABASES[alias].update(HOST=host, PORT=puerto or DATABASES['default']['PORT'])
+    RESERVAS_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['reservas.replicas.ReplicaRouter']
+RESERVAS_REPLICA_FIJAR_SEGUNDOS = config('DB_REPLICA_FIJAR_SEGUNDOS', default=10, cast=int)
+
+
+# Cache
+# CACHE=locmem (por defecto, un caché por proceso) o CACHE=archivo (compartido
+# entre los procesos del servidor, en CACHE_DIR)
+CACHE = config('CACHE', default='locmem')
+CACHE_DIR = config('CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'sala_reservas_cache'))
+
+if CACHE == 'archivo':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'general'),
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+elif CACHE == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sala_reservas',
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    raise ImproperlyConfigured(f'CACHE desconocido: {CACHE} (use locmem o archivo)')
+
+# Las sesiones siempre van en un caché compartido entre procesos (archivos en
+# disco, sin servicios externos): con un caché por proceso, un worker podría
+# seguir viendo una sesión que otro ya cerró.
+CACHES['sesiones'] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(CACHE_DIR, 'sesiones'),
+    'OPTIONS': {'MAX_ENTRIES': 50000},
+}
+
+
+# Sesiones y mensajes
+# Sesiones en caché con respaldo en la base: las lecturas no tocan la base, solo
+# las escrituras (login, logout). Los mensajes van en una cookie firmada, así
+# mostrar "Reserva confirmada" no obliga a guardar la sesión.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sesiones'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
 
 
 # Password validation
@@ -137,4 +261,116 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
 
-
+# Correo (notificaciones de reservas, ver reservas/notificaciones.py). En
+# desarrollo se muestran en la consola; para probar sin servidor SMTP también
+# sirven los backends locmem y filebased (EMAIL_FILE_PATH).
+EMAIL_BACKEND = config(
+    'EMAIL_BACKEND',
+    default='django.core.mail.backends.smtp.EmailBackend' if PRODUCCION
+    else 'django.core.mail.backends.console.EmailBackend',
+)
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
+EMAIL_FILE_PATH = config('EMAIL_FILE_PATH', default=os.path.join(tempfile.gettempdir(), 'sala_reservas_correos'))
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='Reservas de Salas <reservas@localhost>')
+
+
+# ========================================
+# Reservas
+# ========================================
+# Reservas con más días de antigüedad se mueven al archivo (archivar_reservas)
+RESERVAS_ARCHIVO_DIAS = 180
+
+# Instrumentación por solicitud (reservas.middleware.ServerTimingMiddleware)
+RESERVAS_TIMING_MUESTREO = 1.0      # fracción de solicitudes medidas
+RESERVAS_TIMING_UMBRAL_MS = 500     # se registran en el log las más lentas que esto
+RESERVAS_TIMING_CABECERA = True     # cabecera Server-Timing en las respuestas
+
+# Métricas Prometheus (/metrics). Cada proceso escribe su archivo en este
+# directorio y el scrape los suma; None = solo el proceso actual.
+RESERVAS_METRICAS_DIR = os.path.join(tempfile.gettempdir(), 'sala_reservas_metricas')
+RESERVAS_METRICAS_INTERVALO = 1.0   # segundos entre volcados a disco
+# Con token se exige "Authorization: Bearer <token>"; sin token, en producción
+# solo el staff con sesión iniciada puede ver /metrics
+RESERVAS_METRICAS_TOKEN = config('METRICAS_TOKEN', default=None)
+
+# Informes de ?_profile=1 (solo staff): .prof, .txt y .html por solicitud
+RESERVAS_PERFIL_DIR = BASE_DIR / 'perfiles'
+
+# Reintentos de escrituras ante "database is locked" (ver reservas/transacciones.py)
+RESERVAS_DB_REINTENTOS = 4
+RESERVAS_DB_ESPERA = 0.05           # segundos; se duplica en cada reintento
+
+# Límite de solicitudes a reservar/cancelar por minuto (ver reservas/limites.py);
+# cada rol puede definir el suyo (requests_per_minute). None = sin límite.
+RESERVAS_LIMITE_USUARIO_POR_MINUTO = 20
+RESERVAS_LIMITE_IP_POR_MINUTO = 60
+RESERVAS_IP_DESDE_PROXY = False     # True detrás de un proxy que agrega X-Forwarded-For
+RESERVAS_LIMITES_EN_BD = False      # True: conteo exacto en RequestBucket (solo con PostgreSQL)
+
+# Reenvíos del formulario de confirmación (ver reservas/idempotencia.py)
+RESERVAS_IDEMPOTENCIA_SEGUNDOS = 600   # vida de cada token (tabla IdempotencyKey)
+
+# Modo oleada al abrirse un día nuevo de reservas (ver reservas/oleada.py)
+RESERVAS_OLEADA = False
+RESERVAS_OLEADA_MINUTOS = 10        # minutos desde la medianoche con asignación por lotes
+RESERVAS_OLEADA_LOTE_MS = 25        # cuánto junta solicitudes cada lote
+
+# Exportación de reservas en streaming (ver reservas/exportacion.py)
+RESERVAS_EXPORTACION_LOTE = 2000    # filas por lectura (y por prefetch de materiales)
+
+# Feeds .ics por usuario y por sala (ver reservas/calendario.py)
+RESERVAS_CALENDARIO_SEGUNDOS = 3600     # vida del feed en caché (bajo su versión)
+RESERVAS_CALENDARIO_VERSION_SEGUNDOS = 300  # vida de la versión en caché (si no la borra una señal)
+RESERVAS_CALENDARIO_DIAS_ATRAS = 30     # reservas pasadas que se incluyen
+
+# Bandeja de salida de correos (ver reservas/notificaciones.py y enviar_notificaciones)
+RESERVAS_NOTIFICACIONES_MAX_INTENTOS = 5
+RESERVAS_NOTIFICACIONES_ESPERA_SEGUNDOS = 60         # antes del 2º intento; se duplica en cada uno
+RESERVAS_NOTIFICACIONES_ESPERA_MAXIMA_SEGUNDOS = 3600
+
+# Caché de reglas, horario y salas (ver reservas/cache.py)
+RESERVAS_CACHE_SEGUNDOS = 300
+RESERVAS_PRECARGAR = True           # precargar al iniciar cada worker (wsgi/asgi)
+
+# Registro de consultas lentas (ver reservas/consultas.py y reporte_consultas)
+RESERVAS_CONSULTAS_UMBRAL_MS = 100  # None = no registrar por duración
+RESERVAS_CONSULTAS_MUESTREO = 0.0   # fracción de las demás consultas (ej. 0.01)
+RESERVAS_CONSULTAS_LOG = BASE_DIR / 'consultas.log'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'mensaje': {
+            'format': '%(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'consultas': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': RESERVAS_CONSULTAS_LOG,
+            'formatter': 'mensaje',
+            'encoding': 'utf-8',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'reservas': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'reservas.consultas': {
+            'handlers': ['consultas'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
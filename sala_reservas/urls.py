@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.shortcuts import redirect
+from reservas import views as reservas_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('reservas/', include('reservas.urls')),
+    path('metrics', reservas_views.metricas, name='metricas'),  # Prometheus
     path('', lambda request: redirect('reservas:index')),  # Redirigir raíz a reservas
 ]
\ No newline at end of file